@@ -269,3 +269,87 @@ class HkConverter(ConverterTools):
         for it in things_to_save:
             ar[self.dft_subgrp][it] = locals()[it]
         del ar
+
+
+def write_dft_input_from_hk(hdf_filename, hopping, density_required, bz_weights=None, dft_subgrp='dft_input'):
+    """
+    Store H(k) given as an array directly into the dft_subgrp of an hdf5 archive.
+
+    The content is the same as the one produced by HkConverter.convert_dft_input for a General-Hk file
+    with a single shell spanning all the orbitals (no spin polarization, no spin-orbit),
+    but without going through the text file.
+    The projectors are identities, so proj_mat is stored only for one k point
+    together with the flag proj_mat_trivial and the index map proj_mat_offset.
+
+    Parameters
+    ----------
+    hdf_filename : string
+                   Name of hdf5 archive.
+    hopping : complex array of shape (n_k, n, n)
+              H(k)
+    density_required : float
+                       Number of electrons
+    bz_weights : float array of shape (n_k,), optional
+                 Weights of k points. They are normalized to unity. Uniform weights are used if not given.
+    dft_subgrp : string, optional
+                 Name of subgroup storing necessary DFT data.
+
+    """
+    n_k, norb = hopping.shape[0], hopping.shape[1]
+    assert hopping.shape == (n_k, norb, norb)
+
+    energy_unit = 1.0
+    k_dep_projection = 0
+    SP = 0
+    SO = 0
+    charge_below = 0.0
+    density_required = float(density_required)
+    symm_op = 0
+
+    n_shells = 1
+    shells = [{'atom': 0, 'sort': 0, 'l': 0, 'dim': norb}]
+    n_corr_shells = 1
+    corr_shells = [{'atom': 0, 'sort': 0, 'l': 0, 'dim': norb, 'SO': 0, 'irep': 0}]
+    n_inequiv_shells, corr_to_inequiv, inequiv_to_corr = 1, [0], [0]
+
+    use_rotations = 0
+    rot_mat = [numpy.identity(norb, numpy.complex_)]
+    rot_mat_time_inv = [0]
+
+    n_reps = [1]
+    dim_reps = [[norb]]
+    # Same (unused) transformation matrix as in HkConverter
+    T = [numpy.array([[0.0, 0.0, 1.0, 0.0, 0.0],
+                      [1.0 / sqrt(2.0), 0.0, 0.0, 0.0, 1.0 / sqrt(2.0)],
+                      [-1.0 / sqrt(2.0), 0.0, 0.0, 0.0, 1.0 / sqrt(2.0)],
+                      [0.0, 1.0 / sqrt(2.0), 0.0, -1.0 / sqrt(2.0), 0.0],
+                      [0.0, 1.0 / sqrt(2.0), 0.0, 1.0 / sqrt(2.0), 0.0]])]
+
+    n_spin_blocs = SP + 1 - SO
+    n_orbitals = numpy.full((n_k, n_spin_blocs), norb, dtype=numpy.int)
+
+    # The projectors are k-independent identities. They are stored only for one k point.
+    proj_mat = numpy.zeros((1, n_spin_blocs, n_corr_shells, norb, norb), numpy.complex_)
+    proj_mat[:, :, 0, :, :] = numpy.identity(norb)
+    proj_mat_trivial = 1
+    proj_mat_offset = numpy.zeros((n_spin_blocs, n_corr_shells), dtype=numpy.int)
+
+    if bz_weights is None:
+        bz_weights = numpy.ones(n_k, numpy.float_)
+    else:
+        bz_weights = numpy.array(bz_weights, dtype=numpy.float_)
+        assert bz_weights.shape == (n_k,)
+    bz_weights /= numpy.sum(bz_weights)
+
+    hopping = numpy.array(hopping, dtype=numpy.complex_).reshape((n_k, n_spin_blocs, norb, norb))
+
+    ar = HDFArchive(hdf_filename, 'a')
+    if not (dft_subgrp in ar):
+        ar.create_group(dft_subgrp)
+    things_to_save = ['energy_unit', 'n_k', 'k_dep_projection', 'SP', 'SO', 'charge_below', 'density_required',
+                      'symm_op', 'n_shells', 'shells', 'n_corr_shells', 'corr_shells', 'use_rotations', 'rot_mat',
+                      'rot_mat_time_inv', 'n_reps', 'dim_reps', 'T', 'n_orbitals', 'proj_mat', 'bz_weights', 'hopping',
+                      'n_inequiv_shells', 'corr_to_inequiv', 'inequiv_to_corr', 'proj_mat_trivial', 'proj_mat_offset']
+    for it in things_to_save:
+        ar[dft_subgrp][it] = locals()[it]
+    del ar
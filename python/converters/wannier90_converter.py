@@ -47,20 +47,218 @@ from __future__ import print_function
 
 from types import *
 import numpy
-import math
 from pytriqs.archive import *
 from converter_tools import *
-from itertools import product
+from itertools import product, islice
 import os.path
 
 
+def read_hr_dat(hr_filename, rvec_selected=None, strict=False):
+    """
+    Read a file in the format of seedname_hr.dat produced by Wannier90 with numpy.
+
+    The data block is parsed in bulk and the index columns are checked at once.
+    If rvec_selected is given, only the listed R vectors are returned in the order of the file,
+    and reading stops as soon as all of them have been found.
+
+    Parameters
+    ----------
+    hr_filename : string
+        full name of the file
+    rvec_selected : list of 3 integers or None
+        R vectors to be read. If None, all R vectors are read.
+    strict : bool
+        If True, inconsistent orbital indices or R vectors raise RuntimeError.
+        Otherwise, only a message is printed.
+
+    Returns
+    -------
+    rvec : numpy.array[nrpt,3] of integers
+        Miller indices of the R vectors
+    rdeg : numpy.array[nrpt] of integers
+        degeneracies of the R vectors
+    hamr : numpy.array[nrpt,num_wf,num_wf] of complex
+        <w_i|H(R)|w_j> = Hamiltonian matrix elements in the Wannier basis
+
+    """
+
+    with open(hr_filename, "r") as f:
+        print("Reading %s..." % hr_filename + f.readline())
+        num_wf = int(f.readline())
+        nrpt = int(f.readline())
+
+        # degeneracies of the R vectors
+        rdeg = []
+        while len(rdeg) < nrpt:
+            line = f.readline()
+            if line == '':
+                break
+            rdeg.extend(int(x) for x in line.split())
+        if len(rdeg) != nrpt:
+            raise RuntimeError("wrong number of R vectors in %s" % hr_filename)
+        rdeg = numpy.array(rdeg, dtype=int)
+
+        nline = num_wf * num_wf
+        if rvec_selected is None:
+            data = numpy.fromstring(f.read(), sep=' ')
+            if data.size != nrpt * nline * 7:
+                raise RuntimeError("Wrong data or structure in file %s" % hr_filename)
+            data = data.reshape((nrpt, nline, 7))
+            ir_selected = numpy.arange(nrpt)
+        else:
+            # Read H(R) block by block until all the requested R vectors are found
+            rvec_remaining = [tuple(r) for r in rvec_selected]
+            blocks = []
+            ir_selected = []
+            for ir in range(nrpt):
+                if not rvec_remaining:
+                    break
+                block = numpy.fromstring(''.join(islice(f, nline)), sep=' ')
+                if block.size != nline * 7:
+                    raise RuntimeError("Wrong data or structure in file %s" % hr_filename)
+                rcurr = tuple(block[0:3].astype(int))
+                if rcurr in rvec_remaining:
+                    rvec_remaining.remove(rcurr)
+                    blocks.append(block.reshape((nline, 7)))
+                    ir_selected.append(ir)
+            if rvec_remaining:
+                raise RuntimeError("R vectors {} are not found in {}".format(rvec_remaining, hr_filename))
+            data = numpy.array(blocks)
+            ir_selected = numpy.array(ir_selected, dtype=int)
+
+    # Lines run over (R, j, i) with i running fastest
+    rvec_all = data[:, :, 0:3].astype(int)
+    idx = data[:, :, 3:5].astype(int)
+    jj, ii = numpy.divmod(numpy.arange(nline), num_wf)
+    errors = []
+    if not (numpy.all(idx[:, :, 0] == ii + 1) and numpy.all(idx[:, :, 1] == jj + 1)):
+        errors.append("Inconsistent orbital indices in %s" % hr_filename)
+    if not numpy.all(rvec_all == rvec_all[:, 0:1, :]):
+        errors.append("Inconsistent indices for R vectors in %s" % hr_filename)
+    for msg in errors:
+        if strict:
+            raise RuntimeError(msg)
+        print(msg)
+
+    rvec = rvec_all[:, 0, :]
+    hamr = (data[:, :, 5] + 1j * data[:, :, 6]).reshape((-1, num_wf, num_wf)).transpose((0, 2, 1))
+    return rvec, rdeg[ir_selected], numpy.ascontiguousarray(hamr)
+
+
+def fourier_interpolate_ham(kvec, rvec, rdeg, hamr, max_memory=2**28):
+    """
+    Compute H(k) = sum_R exp(2 pi i k.R) H(R) / deg(R) for many k points at once.
+
+    The phase factors are built for a chunk of k points at a time
+    and multiplied with all H(R) stacked into a single matrix.
+
+    Parameters
+    ----------
+    kvec : numpy.array[n_k,3] of floats
+        k points in fractional coordinates (without the factor 2 pi)
+    rvec : numpy.array[nrpt,3] of integers
+        R vectors
+    rdeg : numpy.array[nrpt] of integers
+        degeneracies of R vectors
+    hamr : numpy.array[nrpt,n,n] or list of numpy.array[n,n]
+        Hamiltonian H(R) in Wannier basis
+    max_memory : integer
+        Approximate upper limit of the memory (in bytes) used for a chunk
+
+    Returns
+    -------
+    h_of_k : numpy.array[n_k,n,n]
+        Hamiltonian H(k) in Wannier basis
+
+    """
+
+    kvec = numpy.asarray(kvec, dtype=float).reshape((-1, 3))
+    rvec = numpy.asarray(rvec)
+    nrpt = rvec.shape[0]
+    hamr = numpy.asarray(hamr, dtype=complex)
+    norb = hamr.shape[1]
+    n_elem = norb * norb
+    hamr = hamr.reshape((nrpt, n_elem)) / numpy.asarray(rdeg, dtype=float)[:, None]
+
+    n_k = kvec.shape[0]
+    # A chunk holds the phase factors (chunk, nrpt) and H(k) (chunk, n*n)
+    chunk = max(1, max_memory // (16 * (nrpt + n_elem)))
+    h_of_k = numpy.empty((n_k, n_elem), dtype=complex)
+    for start in range(0, n_k, chunk):
+        end = min(start + chunk, n_k)
+        phase = numpy.exp(2j * numpy.pi * numpy.dot(kvec[start:end], rvec.transpose()))
+        h_of_k[start:end] = numpy.dot(phase, hamr)
+
+    return h_of_k.reshape((n_k, norb, norb))
+
+
+def fourier_ham_fft(msize, rvec, rdeg, hamr, ik0_range=None):
+    """
+    Compute H(k) = sum_R exp(2 pi i k.R) H(R) / deg(R) on the full regular grid generated by
+    Wannier90Converter.kmesh_build using FFT.
+
+    H(R)/deg(R) is scattered into a 3D grid of the same size as the k mesh.
+    R vectors outside the grid wrap around, which is exact because exp(2 pi i k.R) is periodic in R on the grid.
+
+    If ik0_range = (start, end) is given, H(k) is computed only for the slices start <= ik0 < end
+    along the first axis (the slowest index of the k mesh).
+    The sum along the first axis is then done explicitly, and FFT is used along the other two axes.
+
+    Parameters
+    ----------
+    msize : list of 3 integers
+        the dimensions of the k mesh
+    rvec : numpy.array[nrpt,3] of integers
+        R vectors
+    rdeg : numpy.array[nrpt] of integers
+        degeneracies of R vectors
+    hamr : numpy.array[nrpt,n,n] or list of numpy.array[n,n]
+        Hamiltonian H(R) in Wannier basis
+    ik0_range : (int, int), optional
+        range of k-point indices along the first axis
+
+    Returns
+    -------
+    h_of_k : numpy.array[n_k,n,n]
+        Hamiltonian H(k) in Wannier basis in the same order as k points generated by kmesh_build
+
+    """
+
+    msize = tuple(int(m) for m in msize)
+    rvec = numpy.asarray(rvec)
+    hamr = numpy.asarray(hamr, dtype=complex)
+    norb = hamr.shape[1]
+
+    if ik0_range is not None:
+        start, end = ik0_range
+        hamr_deg = hamr / numpy.asarray(rdeg, dtype=float)[:, None, None]
+        phase0 = numpy.exp(2j * numpy.pi * numpy.outer(numpy.arange(start, end), rvec[:, 0]) / msize[0])
+        idx = (rvec[:, 1] % msize[1], rvec[:, 2] % msize[2])
+        grid = numpy.zeros((end - start, msize[1], msize[2], norb, norb), dtype=complex)
+        for i in range(end - start):
+            numpy.add.at(grid[i], idx, phase0[i][:, None, None] * hamr_deg)
+        n_k12 = msize[1] * msize[2]
+        h_of_k = numpy.fft.ifftn(grid, axes=(1, 2)) * n_k12
+        return h_of_k.reshape(((end - start) * n_k12, norb, norb))
+
+    grid = numpy.zeros(msize + (norb, norb), dtype=complex)
+    idx = tuple(rvec[:, i] % msize[i] for i in range(3))
+    numpy.add.at(grid, idx, hamr / numpy.asarray(rdeg, dtype=float)[:, None, None])
+
+    # sum_m A[m] exp(+2 pi i k.m / N) = N * ifft(A)
+    n_k = msize[0] * msize[1] * msize[2]
+    h_of_k = numpy.fft.ifftn(grid, axes=(0, 1, 2)) * n_k
+
+    return h_of_k.reshape((n_k, norb, norb))
+
+
 class Wannier90Converter(ConverterTools):
     """
     Conversion from Wannier90 output to an hdf5 file that can be used as input for the SumkDFT class.
     """
 
     def __init__(self, seedname, hdf_filename=None, dft_subgrp='dft_input',
-                 symmcorr_subgrp='dft_symmcorr_input', repacking=False):
+                 symmcorr_subgrp='dft_symmcorr_input', repacking=False, max_memory=None):
         """
         Initialise the class.
 
@@ -76,6 +274,9 @@ class Wannier90Converter(ConverterTools):
             Name of subgroup storing correlated-shell symmetry data
         repacking : boolean, optional
             Does the hdf5 archive need to be repacked to save space?
+        max_memory : integer, optional
+            If given, hopping is computed and written in chunks of k points
+            so that the memory used for a chunk does not exceed max_memory (in bytes).
 
         """
 
@@ -95,6 +296,9 @@ class Wannier90Converter(ConverterTools):
         # threshold below which matrix elements from wannier90 should be
         # considered equal
         self._w90zero = 2.e-6
+        # dimensions of the regular k mesh (set in convert_dft_input)
+        self.kmesh_size = None
+        self.max_memory = max_memory
 
         # Checks if h5 file is there and repacks it if wanted:
         if (os.path.exists(self.hdf_file) and repacking):
@@ -239,6 +443,7 @@ class Wannier90Converter(ConverterTools):
                     n_k, k_mesh, bz_weights = self.kmesh_build(nki)
                 self.n_k = n_k
                 self.k_mesh = k_mesh
+                self.kmesh_size = nki
 
                 # set the R vectors and their degeneracy
                 self.rvec = rvec
@@ -314,49 +519,109 @@ class Wannier90Converter(ConverterTools):
         if SP == 1:
             bz_weights = 0.5 * bz_weights
 
-        # Third, compute the hoppings in reciprocal space
-        hopping = numpy.zeros([self.n_k, n_spin, numpy.max(
-            n_orbitals), numpy.max(n_orbitals)], numpy.complex_)
-        for isp in range(n_spin):
-            # make Fourier transform H(R) -> H(k) : it can be done one spin at
-            # a time
-            hamk = self.fourier_ham(self.nwfs, hamr_full[isp])
-            # copy the H(k) in the right place of hoppings... is there a better
-            # way to do this??
-            for ik in range(self.n_k):
-                #hopping[ik,isp,:,:] = deepcopy(hamk[ik][:,:])*energy_unit
-                hopping[ik, isp, :, :] = hamk[ik][:, :] * energy_unit
-
-        # Then, initialise the projectors
-        k_dep_projection = 0   # we always have the same number of WFs at each k-point
-        proj_mat = numpy.zeros([self.n_k, n_spin, n_corr_shells, max(
-            [crsh['dim'] for crsh in corr_shells]), numpy.max(n_orbitals)], numpy.complex_)
-        iorb = 0
         # Projectors simply consist in identity matrix blocks selecting those MLWFs that
         # correspond to the specific correlated shell indexed by icrsh.
         # NOTE: we assume that the correlated orbitals appear at the beginning of the H(R)
         # file and that the ordering of MLWFs matches the corr_shell info from
         # the input.
+        # Since the projectors do not depend on k, they are stored only for one k point
+        # together with the flag proj_mat_trivial and the offsets of the identity blocks.
+        k_dep_projection = 0   # we always have the same number of WFs at each k-point
+        proj_mat = numpy.zeros([1, n_spin, n_corr_shells, max(
+            [crsh['dim'] for crsh in corr_shells]), numpy.max(n_orbitals)], numpy.complex_)
+        proj_mat_trivial = 1
+        proj_mat_offset = numpy.zeros((n_spin, n_corr_shells), dtype=int)
+        iorb = 0
         for icrsh in range(n_corr_shells):
             norb = corr_shells[icrsh]['dim']
-            proj_mat[:, :, icrsh, 0:norb, iorb:iorb +
+            proj_mat[0, :, icrsh, 0:norb, iorb:iorb +
                      norb] = numpy.identity(norb, numpy.complex_)
+            proj_mat_offset[:, icrsh] = iorb
             iorb += norb
 
+        things_to_save = ['energy_unit', 'n_k', 'k_dep_projection', 'SP', 'SO', 'charge_below', 'density_required',
+                          'symm_op', 'n_shells', 'shells', 'n_corr_shells', 'corr_shells', 'use_rotations', 'rot_mat',
+                          'rot_mat_time_inv', 'n_reps', 'dim_reps', 'T', 'n_orbitals', 'proj_mat', 'bz_weights',
+                          'n_inequiv_shells', 'corr_to_inequiv', 'inequiv_to_corr', 'proj_mat_trivial',
+                          'proj_mat_offset']
+
+        if self.max_memory is None:
+            # Third, compute the hoppings in reciprocal space
+            hopping = numpy.zeros([self.n_k, n_spin, numpy.max(
+                n_orbitals), numpy.max(n_orbitals)], numpy.complex_)
+            for isp in range(n_spin):
+                # make Fourier transform H(R) -> H(k) : it can be done one spin at
+                # a time
+                hamk = self.fourier_ham(self.nwfs, hamr_full[isp])
+                hopping[:, isp, 0:self.nwfs, 0:self.nwfs] = hamk * energy_unit
+            things_to_save += ['hopping']
+
         # Finally, save all required data into the HDF archive:
         ar = HDFArchive(self.hdf_file, 'a')
         if not (self.dft_subgrp in ar):
             ar.create_group(self.dft_subgrp)
         # The subgroup containing the data. If it does not exist, it is
         # created. If it exists, the data is overwritten!
-        things_to_save = ['energy_unit', 'n_k', 'k_dep_projection', 'SP', 'SO', 'charge_below', 'density_required',
-                          'symm_op', 'n_shells', 'shells', 'n_corr_shells', 'corr_shells', 'use_rotations', 'rot_mat',
-                          'rot_mat_time_inv', 'n_reps', 'dim_reps', 'T', 'n_orbitals', 'proj_mat', 'bz_weights', 'hopping',
-                          'n_inequiv_shells', 'corr_to_inequiv', 'inequiv_to_corr']
         for it in things_to_save:
             ar[self.dft_subgrp][it] = locals()[it]
         del ar
 
+        if self.max_memory is not None:
+            # hopping is computed and written in chunks of k points
+            self.write_hopping_chunked(n_spin, hamr_full, energy_unit)
+
+    def write_hopping_chunked(self, n_spin, hamr_full, energy_unit):
+        """
+        Compute and write hopping into a chunked dataset, a block of k points at a time.
+        The k points are split along the first axis of the regular k mesh.
+
+        Parameters
+        ----------
+        n_spin : integer
+            number of spin blocks
+        hamr_full : list of numpy.array[nrpt,n,n]
+            H(R) for each spin block
+        energy_unit : float
+            energy conversion factor
+
+        """
+        import h5py
+        from ..tools import complex_to_float_array
+
+        msize = self.kmesh_size
+        n_k = self.n_k
+        nwfs = self.nwfs
+        n_k12 = msize[1] * msize[2]
+
+        # Memory per k point: hopping and the work arrays of FFT
+        bytes_per_k = 16 * n_spin * 4 * nwfs * nwfs
+        nk0_chunk = max(1, int(self.max_memory // (bytes_per_k * n_k12)))
+        print("Writing hopping in chunks of %d k points..." % (nk0_chunk * n_k12))
+
+        def _create(g, name, shape):
+            if name in g:
+                del g[name]
+            # Each HDF5 chunk holds up to 1 MB
+            size_k = 16 * int(numpy.prod(shape[1:]))
+            chunks = (max(1, min(n_k, 2**20 // size_k)),) + tuple(shape[1:]) + (2,)
+            ds = g.create_dataset(name, shape + (2,), dtype=float, chunks=chunks)
+            # complex array in the format of HDFArchive
+            ds.attrs['__complex__'] = 1
+            return ds
+
+        with h5py.File(self.hdf_file, 'a') as f:
+            g = f[self.dft_subgrp]
+            ds_hopping = _create(g, 'hopping', (n_k, n_spin, nwfs, nwfs))
+            for ik0 in range(0, msize[0], nk0_chunk):
+                ik0_end = min(ik0 + nk0_chunk, msize[0])
+                start, end = ik0 * n_k12, ik0_end * n_k12
+                hopping = numpy.empty((end - start, n_spin, nwfs, nwfs), dtype=complex)
+                for isp in range(n_spin):
+                    hopping[:, isp, :, :] = fourier_ham_fft(msize, self.rvec, self.rdeg, hamr_full[isp],
+                                                            ik0_range=(ik0, ik0_end)) * energy_unit
+                ds_hopping[start:end] = complex_to_float_array(hopping)
+                del hopping
+
     def read_wannier90hr(self, hr_filename="wannier_hr.dat"):
         """
         Method for reading the seedname_hr.dat file produced by Wannier90 (http://wannier.org)
@@ -376,75 +641,13 @@ class Wannier90Converter(ConverterTools):
             weight of the R vectors
         num_wf : integer
             number of Wannier functions found
-        h_of_r : list of numpy.array
+        h_of_r : numpy.array[nrpt,num_wf,num_wf]
             <w_i|H(R)|w_j> = Hamilonian matrix elements in the Wannier basis
 
         """
 
-        # Read only from the master node
-
-        try:
-            with open(hr_filename, "r") as hr_filedesc:
-                hr_data = hr_filedesc.readlines()
-                hr_filedesc.close()
-        except IOError:
-            print("The file %s could not be read!" % hr_filename)
-
-        print("Reading %s..." % hr_filename + hr_data[0])
-
-        try:
-            # reads number of Wannier functions per spin
-            num_wf = int(hr_data[1])
-            nrpt = int(hr_data[2])
-        except ValueError:
-            print("Could not read number of WFs or R vectors")
-
-        # allocate arrays to save the R vector indexes and degeneracies and the
-        # Hamiltonian
-        rvec_idx = numpy.zeros((nrpt, 3), dtype=int)
-        rvec_deg = numpy.zeros(nrpt, dtype=int)
-        h_of_r = [numpy.zeros((num_wf, num_wf), dtype=numpy.complex_)
-                  for n in range(nrpt)]
-
-        # variable currpos points to the current line in the file
-        currpos = 2
-        try:
-            ir = 0
-            # read the degeneracy of the R vectors (needed for the Fourier
-            # transform)
-            while ir < nrpt:
-                currpos += 1
-                for x in hr_data[currpos].split():
-                    if ir >= nrpt:
-                        raise IndexError("wrong number of R vectors??")
-                    rvec_deg[ir] = int(x)
-                    ir += 1
-            # for each direct lattice vector R read the block of the
-            # Hamiltonian H(R)
-            for ir, jj, ii in product(range(nrpt), range(num_wf), range(num_wf)):
-                # advance one line, split the line into tokens
-                currpos += 1
-                cline = hr_data[currpos].split()
-                # check if the orbital indexes in the file make sense
-                if int(cline[3]) != ii + 1 or int(cline[4]) != jj + 1:
-                    print(
-                        "Inconsistent indices at %s%s of R n. %s" % (ii, jj, ir))
-                rcurr = numpy.array(
-                    [int(cline[0]), int(cline[1]), int(cline[2])])
-                if ii == 0 and jj == 0:
-                    rvec_idx[ir] = rcurr
-                    rprec = rcurr
-                else:
-                    # check if the vector indices are consistent
-                    if not numpy.array_equal(rcurr, rprec):
-                        print(
-                            "Inconsistent indices for R vector n. %s" % ir)
-
-                # fill h_of_r with the matrix elements of the Hamiltonian
-                h_of_r[ir][ii, jj] = complex(float(cline[5]), float(cline[6]))
-
-        except ValueError:
-            print("Wrong data or structure in file %s" % hr_filename)
+        rvec_idx, rvec_deg, h_of_r = read_hr_dat(hr_filename)
+        nrpt, num_wf = h_of_r.shape[0], h_of_r.shape[1]
 
         # return the data into variables
         return nrpt, rvec_idx, rvec_deg, num_wf, h_of_r
@@ -581,6 +784,7 @@ class Wannier90Converter(ConverterTools):
         """
         Method for obtaining H(k) from H(R) via Fourier transform
         The R vectors and k-point mesh are read from global module variables
+        FFT is used if the k-point mesh is the full regular grid
 
         Parameters
         ----------
@@ -591,19 +795,12 @@ class Wannier90Converter(ConverterTools):
 
         Returns
         -------
-        h_of_k : list of numpy.array[norb,norb]
+        h_of_k : numpy.array[n_k,norb,norb]
             transformed Hamiltonian H(k) in Wannier basis
 
         """
 
-        twopi = 2 * numpy.pi
-        h_of_k = [numpy.zeros((norb, norb), dtype=numpy.complex_)
-                  for ik in range(self.n_k)]
-        ridx = numpy.array(range(self.nrpt))
-        for ik, ir in product(range(self.n_k), ridx):
-            rdotk = twopi * numpy.dot(self.k_mesh[ik], self.rvec[ir])
-            factor = (math.cos(rdotk) + 1j * math.sin(rdotk)) / \
-                float(self.rdeg[ir])
-            h_of_k[ik][:, :] += factor * h_of_r[ir][:, :]
-
-        return h_of_k
+        if self.kmesh_size is not None:
+            # The k mesh is the full regular grid generated by kmesh_build
+            return fourier_ham_fft(self.kmesh_size, self.rvec, self.rdeg, h_of_r)
+        return fourier_interpolate_ham(self.k_mesh, self.rvec, self.rdeg, h_of_r)
@@ -21,6 +21,7 @@ import sys
 from .dmft_core import DMFTCoreSolver
 
 from .program_options import *
+from .tools import wait_work_dir_tasks
 
 
 def dcore(filename, np=1):
@@ -46,6 +47,7 @@ def dcore(filename, np=1):
     solver = DMFTCoreSolver(params["model"]["seedname"], params)
 
     solver.do_steps(max_step=params["control"]["max_step"])
+    wait_work_dir_tasks()
 
     print("\n########################  Done  ########################\n")
 
@@ -30,11 +30,13 @@ import impurity_solvers
 
 
 def calc_g2_in_impurity_model(solver_name, solver_params, mpirun_command, basis_rot, Umat, gf_struct, beta, n_iw, n_tau,
-                              Sigma_iw, Gloc_iw, num_wb, num_wf, ish):
+                              Sigma_iw, Gloc_iw, num_wb, num_wf, ish, H_loc=None):
     """
 
     Calculate G2 in an impurity model
 
+    If H_loc is not None, it is used as the non-interacting local Hamiltonian of G0 instead of a tail fit.
+
     """
 
     Solver = impurity_solvers.solver_classes[solver_name]
@@ -44,10 +46,10 @@ def calc_g2_in_impurity_model(solver_name, solver_params, mpirun_command, basis_
     sol = Solver(beta, gf_struct, Umat, n_iw, n_tau)
 
     G0_iw = dyson(Sigma_iw=Sigma_iw, G_iw=Gloc_iw)
-    sol.set_G0_iw(G0_iw)
+    sol.set_G0_iw(G0_iw, H_loc)
 
     # Compute rotation matrix to the diagonal basis if supported
-    rot = compute_diag_basis(G0_iw) if basis_rot else None
+    rot = compute_diag_basis(G0_iw, H_loc) if basis_rot else None
     s_params = copy.deepcopy(solver_params)
     s_params['random_seed_offset'] = 1000 * ish
 
@@ -256,7 +258,8 @@ class DMFTBSESolver(DMFTCoreSolver):
                     q_str = line.split()[1]
                     q_points.append(tuple(map(int, q_str.split('.'))))
             params['X0q_qpoints_saved'] = q_points
-        sumkdft.run(os.path.abspath(self._seedname + '.h5'), './work/sumkdft_bse', self._mpirun_command, params)
+        sumkdft.run(os.path.abspath(self._seedname + '.h5'), './work/sumkdft_bse', self._mpirun_command, params,
+                    self._scratch_dir, self._compress_logs)
 
     def _calc_bse_xloc(self):
         """
@@ -317,7 +320,7 @@ class DMFTBSESolver(DMFTCoreSolver):
                                                      self._n_tau,
                                                      self._sh_quant[ish].Sigma_iw, Gloc_iw_sh[ish],
                                                      self._params['bse']['num_wb'],
-                                                     self._params['bse']['num_wf'], ish)
+                                                     self._params['bse']['num_wf'], ish, self._H_loc_sh[ish])
             assert isinstance(x_loc, dict)
             print("\nx_loc.keys() =", x_loc.keys())
 
@@ -379,6 +382,7 @@ def dcore_bse(filename, np=1):
     #
     # Finish
     #
+    wait_work_dir_tasks()
     print("\n#################  Done  #####################\n")
 
 
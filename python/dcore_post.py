@@ -31,10 +31,12 @@ from dmft_core import DMFTCoreSolver
 from sumkdft import SumkDFTCompat
 from program_options import create_parser, parse_parameters
 
-from .tools import launch_mpi_subprocesses
+from .tools import launch_mpi_subprocesses, input_hash, read_input_hash, write_input_hash, pade_evaluate,\
+    pade_coefficients_parallel, wait_work_dir_tasks
 import impurity_solvers
 from . import sumkdft
 from lattice_models import create_lattice_model
+from lattice_models.tools import one_body_input_hash
 
 class DMFTPostSolver(DMFTCoreSolver):
     def __init__(self, seedname, params, output_file='', output_group='dmft_out'):
@@ -44,46 +46,38 @@ class DMFTPostSolver(DMFTCoreSolver):
         super(DMFTPostSolver, self).__init__(seedname, params, output_file, output_group, read_only=True)
 
 
-    def calc_dos(self, Sigma_w_sh, mesh, broadening):
+    def calc_post(self, observables, Sigma_w_sh=None, mesh=None, broadening=None):
         """
 
-        Compute dos in real frequency.
+        Compute several observables in one MPI job sharing the loaded model and self-energy
+
+        :param observables: list
+           Subset of 'dos', 'spaghettis' and 'momentum_distribution'
 
         :param Sigma_w_sh: list
-           List of real-frequency self-energy
+           List of real-frequency self-energy (must be set for 'dos' and 'spaghettis')
+
+        :param mesh: (float, float, int)
+           real-frequency mesh (min, max, num_points)
 
         :param broadening: float
            Broadening factor
 
-        :return: tuple
-           Results are 'dos', 'dosproj', 'dosproj_orb'.
-
-        """
-
-        params = self._make_sumkdft_params()
-        params['calc_mode'] = 'dos'
-        params['mu'] = self._chemical_potential
-        params['Sigma_w_sh'] = Sigma_w_sh
-        params['mesh'] = mesh
-        params['broadening'] = broadening
-        r = sumkdft.run(os.path.abspath(self._seedname+'.h5'), './work/sumkdft_dos', self._mpirun_command, params)
-        return r['dos'], r['dosproj'], r['dosproj_orb']
-
-    def calc_spaghettis(self, Sigma_w_sh, mesh, broadening):
-        """
-
-        Compute A(k, omega)
+        :return: dict
+           Results are 'dos', 'dosproj', 'dosproj_orb', 'akw' and 'den' depending on observables.
 
         """
 
         params = self._make_sumkdft_params()
-        params['calc_mode'] = 'spaghettis'
+        params['calc_mode'] = 'post'
+        params['observables'] = observables
         params['mu'] = self._chemical_potential
-        params['Sigma_w_sh'] = Sigma_w_sh
-        params['mesh'] = mesh
-        params['broadening'] = broadening
-        r = sumkdft.run(os.path.abspath(self._seedname+'.h5'), './work/sumkdft_spaghettis', self._mpirun_command, params)
-        return r['akw']
+        if 'dos' in observables or 'spaghettis' in observables:
+            params['Sigma_w_sh'] = Sigma_w_sh
+            params['mesh'] = mesh
+            params['broadening'] = broadening
+        return sumkdft.run(os.path.abspath(self._seedname+'.h5'), './work/sumkdft_post', self._mpirun_command, params,
+                           self._scratch_dir, self._compress_logs)
 
     def calc_momentum_distribution(self):
         """
@@ -93,11 +87,7 @@ class DMFTPostSolver(DMFTCoreSolver):
 
         """
 
-        params = self._make_sumkdft_params()
-        params['calc_mode'] = 'momentum_distribution'
-        params['mu'] = self._chemical_potential
-        r = sumkdft.run(os.path.abspath(self._seedname+'.h5'), './work/sumkdft_momentum_distribution', self._mpirun_command, params)
-        return r['den']
+        return self.calc_post(['momentum_distribution'])['den']
 
     def calc_Sigma_w(self, mesh):
         """
@@ -121,8 +111,41 @@ class DMFTPostSolver(DMFTCoreSolver):
             return [None] * self.n_inequiv_shells
 
 
+def write_akw_txt(filename, xk, mesh, akw, spin_block_names):
+    """
+    Write A(k, omega) in a text file for gnuplot.
+    Each line has x-position of k, omega and A(k, omega). Blocks of k points are separated by a blank line.
+    Spin blocks are shifted along the x axis.
+    """
+    n_k, n_omega = len(xk), len(mesh)
+    fmt = "%f %f %f\n" * n_omega + "\n"
+    with open(filename, 'w') as f:
+        offset = 0.0
+        for isp in spin_block_names:
+            data = numpy.empty((n_k, n_omega, 3))
+            data[:, :, 0] = (xk + offset)[:, None]
+            data[:, :, 1] = mesh[None, :]
+            data[:, :, 2] = akw[isp]
+            for ik in range(n_k):
+                f.write(fmt % tuple(data[ik].ravel()))
+            offset = xk[n_k-1] * 1.1
+            f.write("\n")
+
+
+def write_akw_h5(filename, xk, mesh, akw, spin_block_names):
+    """
+    Write A(k, omega) in a HDF5 file: xk (n_k), omega (n_omega) and akw/spin (n_k, n_omega).
+    """
+    import h5py
+    with h5py.File(filename, 'w') as f:
+        f['xk'] = numpy.asarray(xk)
+        f['omega'] = numpy.asarray(mesh)
+        for isp in spin_block_names:
+            f.create_dataset('akw/' + isp, data=numpy.asarray(akw[isp]), chunks=True, compression='gzip')
+
+
 class DMFTCoreTools:
-    def __init__(self, seedname, params, n_k, xk, prefix):
+    def __init__(self, seedname, params, n_k, xk, prefix, force=False):
         """
         Class of posting tool for DCore.
 
@@ -136,6 +159,8 @@ class DMFTCoreTools:
             Number of k points
         :param xk:  integer array
             x-position for plotting band
+        :param force: bool
+            Recompute Sigma_w even if it is cached
         """
 
         self._params = copy.deepcopy(params)
@@ -150,6 +175,8 @@ class DMFTCoreTools:
         self._n_k = n_k
         self._xk = xk
         self._prefix = prefix
+        self._force = force
+        self._den = None
 
         self._params['control']['restart'] = True
         self._solver = DMFTPostSolver(seedname, self._params, output_file=seedname+'.out.h5')
@@ -196,25 +223,90 @@ class DMFTCoreTools:
                 print("", file=f)
         print("\n    Output {0}".format(filename))
 
-    def post(self):
+    def pade_coefficients(self, Sigma_iw_sh, shells):
         """
-        Calculate DOS (Density Of State) and energy dispersions.
-        For Hubbard-I solver, self-energy is calculated in this function.
-        For cthyb (both TRIQS and ALPS), self-energy is read from hdf5 file.
+        Compute the coefficients of Pade approximants of Sigma_iw for all blocks and matrix elements
+        of the given shells at the first n_pade positive Matsubara frequencies (used if [tool] fast_pade is set).
+        The problems are distributed over a pool of --np processes.
+        The coefficients are saved in seedname.out.h5 (dmft_out/pade) and reused if Sigma_iw and n_pade are unchanged.
+        Only the latest ones are kept.
+
+        :return: (z, a_sh)
+            z: Matsubara frequencies, a_sh: dict of {ish: {block name: coefficients of shape (n_pade, n, n)}}
+        """
+        output_file = self._seedname + '.out.h5'
+        Sigma_data = [[g.data for _, g in Sigma_iw_sh[ish]] for ish in shells]
+        key = input_hash([Sigma_data, self._n_pade])
+        if not self._force:
+            with HDFArchive(output_file, 'r') as ar:
+                if 'pade' in ar['dmft_out'] and key in ar['dmft_out']['pade']:
+                    print("Loaded Pade coefficients from {}".format(output_file))
+                    coeffs = ar['dmft_out']['pade'][key]
+                    return coeffs['z'], {ish: coeffs['sh' + str(ish)] for ish in shells}
+
+        # Stack all Pade problems sharing the Matsubara frequencies
+        block_names = self._solver.spin_block_names
+        sig0 = Sigma_iw_sh[shells[0]][block_names[0]]
+        iw = numpy.array([complex(x) for x in sig0.mesh])
+        idx = numpy.where(iw.imag > 0)[0][0:self._n_pade]
+        z = iw[idx]
+        u = [Sigma_iw_sh[ish][bname].data[idx, :, :].reshape((len(idx), -1)) for ish in shells for bname in block_names]
+        a = pade_coefficients_parallel(z, numpy.hstack(u), self._params['mpi']['num_processes'])
+
+        a_sh = {}
+        offset = 0
+        for ish in shells:
+            a_sh[ish] = {}
+            for bname in block_names:
+                n = Sigma_iw_sh[ish][bname].data.shape[1]
+                a_sh[ish][bname] = a[:, offset:offset + n*n].reshape((len(idx), n, n))
+                offset += n*n
+
+        # Only the latest one is kept
+        with HDFArchive(output_file, 'a') as ar:
+            if 'pade' in ar['dmft_out']:
+                del ar['dmft_out']['pade']
+            ar['dmft_out'].create_group('pade')
+            coeffs = {'z': z}
+            for ish in shells:
+                coeffs['sh' + str(ish)] = a_sh[ish]
+            ar['dmft_out']['pade'][key] = coeffs
+
+        return z, a_sh
+
+    def _Sigma_w_key(self, mesh):
+        """
+        Hash of the inputs of Sigma_w: the inputs of Gloc (model, chemical potential, self-energy etc.),
+        the iteration number, the real-frequency mesh, Pade parameters and the impurity-solver parameters.
+        None is returned if Gloc has no key.
         """
+        Gloc_key = self._solver._Gloc_key()
+        if Gloc_key is None:
+            return None
+        return input_hash([Gloc_key, self._solver.iteration_number, mesh, self._n_pade, self._eta,
+                           self._params['tool']['fast_pade'], self._params['impurity_solver']])
 
-        print("\n#############  Compute Green's Function in the Real Frequency  ################\n")
+    def calc_Sigma_w_sh(self, mesh):
+        """
+        Compute Sigma_w by the impurity solver or Pade approximation.
+        The result is cached in seedname.out.h5 (dmft_out/Sigma_w) and reused if the inputs are unchanged.
+        Only the latest result is kept.
+        """
+        output_file = self._seedname + '.out.h5'
+        key = None if self._force else self._Sigma_w_key(mesh)
+        if key is not None:
+            with HDFArchive(output_file, 'r') as ar:
+                if 'Sigma_w' in ar['dmft_out'] and key in ar['dmft_out']['Sigma_w']:
+                    print("Loaded Sigma_w computed with the same parameters from {}".format(output_file))
+                    return ar['dmft_out']['Sigma_w'][key]
 
-        #
-        # Real-frequency self-energy
-        #
-        mesh = [self._omega_min, self._omega_max, self._Nomega]
         sigma_w_sh = self._solver.calc_Sigma_w(mesh)
         Sigma_iw_sh = self._solver.Sigma_iw_sh(self._solver.iteration_number)
-        for ish in range(self._solver.n_inequiv_shells):
-            if not sigma_w_sh[ish] is None:
-                continue
-
+        pade_shells = [ish for ish in range(self._solver.n_inequiv_shells) if sigma_w_sh[ish] is None]
+        fast_pade = self._params['tool']['fast_pade']
+        if pade_shells and fast_pade:
+            z, a_sh = self.pade_coefficients(Sigma_iw_sh, pade_shells)
+        for ish in pade_shells:
             # set BlockGf sigma_w
             Sigma_iw = Sigma_iw_sh[ish]
             block_names = self._solver.spin_block_names
@@ -223,15 +315,54 @@ class DMFTCoreTools:
                                  n_points=self._Nomega, name="sig_pade") for block, sigma in Sigma_iw]
             sigma_w_sh[ish] = BlockGf(name_list=block_names, block_list=glist(), make_copies=False)
             # Analytic continuation
-            for bname, sig in Sigma_iw:
-                sigma_w_sh[ish][bname].set_from_pade(sig, n_points=self._n_pade, freq_offset=self._eta)
+            if fast_pade:
+                for bname, sig in sigma_w_sh[ish]:
+                    omega = numpy.array([x.real for x in sig.mesh])
+                    sig.data[...] = pade_evaluate(z, a_sh[ish][bname], omega + 1J * self._eta)
+            else:
+                for bname, sig in Sigma_iw:
+                    sigma_w_sh[ish][bname].set_from_pade(sig, n_points=self._n_pade, freq_offset=self._eta)
+
+        # Only the latest one is kept
+        key = self._Sigma_w_key(mesh)
+        if key is not None:
+            with HDFArchive(output_file, 'a') as ar:
+                if 'Sigma_w' in ar['dmft_out']:
+                    del ar['dmft_out']['Sigma_w']
+                ar['dmft_out'].create_group('Sigma_w')
+                ar['dmft_out']['Sigma_w'][key] = sigma_w_sh
+
+        return sigma_w_sh
+
+    def post(self):
+        """
+        Calculate DOS (Density Of State) and energy dispersions.
+        For Hubbard-I solver, self-energy is calculated in this function.
+        For cthyb (both TRIQS and ALPS), self-energy is read from hdf5 file.
+        """
+
+        print("\n#############  Compute Green's Function in the Real Frequency  ################\n")
+
+        #
+        # Real-frequency self-energy
+        #
+        mesh = [self._omega_min, self._omega_max, self._Nomega]
+        sigma_w_sh = self.calc_Sigma_w_sh(mesh)
+
+        #
+        # (Partial) DOS, band structure and momentum distribution in one MPI job
+        #
+        observables = ['dos']
+        if self._xk is not None:
+            observables += ['spaghettis', 'momentum_distribution']
+        print("\n#############  Compute {}  ################\n".format(', '.join(observables)))
+        r = self._solver.calc_post(observables, sigma_w_sh, mesh, self._broadening)
+        self._den = r.get('den', None)
 
         #
         #  (Partial) DOS
         #
-        print("\n#############  Compute (partial) DOS  ################\n")
-        dos, dosproj, dosproj_orb = self._solver.calc_dos(sigma_w_sh, mesh, self._broadening)
-        self.print_dos(dos, dosproj_orb, self._prefix + self._seedname+'_dos.dat')
+        self.print_dos(r['dos'], r['dosproj_orb'], self._prefix + self._seedname+'_dos.dat')
 
         #
         # Band structure
@@ -239,23 +370,20 @@ class DMFTCoreTools:
         if self._xk is None:
             return
         #
-        print("\n#############  Compute Band Structure  ################\n")
-        akw = self._solver.calc_spaghettis(sigma_w_sh, mesh, self._broadening)
+        akw = r['akw']
         #
         # Print band-structure into file
         #
-        mesh = [x.real for x in sigma_w_sh[0].mesh]
-        filename = self._prefix + self._seedname + '_akw.dat'
-        with open(filename, 'w') as f:
-            offset = 0.0
-            for isp in self._solver.spin_block_names:
-                for ik in range(self._n_k):
-                    for iom in range(self._Nomega):
-                        print("%f %f %f" % (self._xk[ik]+offset, mesh[iom], akw[isp][ik, iom]), file=f)
-                    print("", file=f)
-                offset = self._xk[self._n_k-1] * 1.1
-                print("", file=f)
-        print("\n    Output {0}".format(filename))
+        mesh = numpy.array([x.real for x in sigma_w_sh[0].mesh])
+        akw_format = self._params['tool']['akw_format']
+        if akw_format in ['txt', 'both']:
+            filename = self._prefix + self._seedname + '_akw.dat'
+            write_akw_txt(filename, self._xk, mesh, akw, self._solver.spin_block_names)
+            print("\n    Output {0}".format(filename))
+        if akw_format in ['h5', 'both']:
+            filename = self._prefix + self._seedname + '_akw.h5'
+            write_akw_h5(filename, self._xk, mesh, akw, self._solver.spin_block_names)
+            print("\n    Output {0}".format(filename))
 
     def momentum_distribution(self):
         """
@@ -263,7 +391,10 @@ class DMFTCoreTools:
         """
         print("\n#############  Momentum Distribution  ################\n")
 
-        den = self._solver.calc_momentum_distribution()
+        # Computed together with DOS in post() if available
+        den = self._den
+        if den is None:
+            den = self._solver.calc_momentum_distribution()
 
         spn = self._solver.spin_block_names
 
@@ -319,7 +450,7 @@ def __print_paramter(p, param_name):
 
 
 
-def dcore_post(filename, np=1, prefix="./"):
+def dcore_post(filename, np=1, prefix="./", force=False):
     """
     Main routine for the post-processing tool
 
@@ -327,6 +458,8 @@ def dcore_post(filename, np=1, prefix="./"):
     ----------
     filename : string
         Input-file name
+    force : bool
+        Recompute H(k) along the k-path and Sigma_w even if the inputs are unchanged
     """
     print("\n############  Reading Input File  #################\n")
     print("  Input File Name : ", filename)
@@ -409,34 +542,18 @@ def dcore_post(filename, np=1, prefix="./"):
         nk_line = p["tool"]["nk_line"]
         n_k = (nnode - 1)*nk_line + 1
         print("\n   Total number of k =", str(n_k))
-        kvec = numpy.zeros((n_k, 3), numpy.float_)
-        ikk = 0
-        for inode in range(nnode - 1):
-            for ik in range(nk_line + 1):
-                if inode != 0 and ik == 0:
-                    continue
-                for i in range(3):
-                    kvec[ikk, i] = float((nk_line - ik)) * knode[inode, i] + float(ik) * knode[inode + 1, i]
-                    kvec[ikk, i] = 2.0 * numpy.pi * kvec[ikk, i] / float(nk_line)
-                ikk += 1
+        # (inode, ik) for all k points along the path; the first point of each line except the first one is skipped
+        inode_k = numpy.hstack([numpy.zeros(1, dtype=int), numpy.repeat(numpy.arange(nnode - 1), nk_line)])
+        ik_k = numpy.hstack([numpy.zeros(1, dtype=int), numpy.tile(numpy.arange(1, nk_line + 1), nnode - 1)])
+        kvec = (nk_line - ik_k)[:, None] * knode[inode_k, :] + ik_k[:, None] * knode[inode_k + 1, :]
+        kvec = 2.0 * numpy.pi * kvec / float(nk_line)
         #
         # Compute x-position for plotting band
         #
-        dk = numpy.zeros(3, numpy.float_)
-        dk_cart = numpy.zeros(3, numpy.float_)
-        xk = numpy.zeros(n_k, numpy.float_)
-        xk_label = numpy.zeros(nnode, numpy.float_)
-        xk[0] = 0.0
-        ikk = 0
-        for inode in range(nnode - 1):
-            dk[:] = knode[inode+1, :] - knode[inode, :]
-            dk_cart[:] = numpy.dot(dk[:], bvec[:, :])
-            klength = numpy.sqrt(numpy.dot(dk_cart[:], dk_cart[:])) / nk_line
-            xk_label[inode] = xk[ikk]
-            for ik in range(nk_line):
-                xk[ikk+1] = xk[ikk] + klength
-                ikk += 1
-        xk_label[nnode-1] = xk[n_k-1]
+        dk_cart = numpy.dot(knode[1:nnode, :] - knode[0:nnode-1, :], bvec[:, :])
+        klength = numpy.sqrt(numpy.sum(dk_cart**2, axis=1)) / nk_line
+        xk = numpy.hstack([numpy.zeros(1), numpy.cumsum(numpy.repeat(klength, nk_line))])
+        xk_label = xk[0:n_k:nk_line].copy()
 
         #
         # HDF5 file for band
@@ -445,43 +562,53 @@ def dcore_post(filename, np=1, prefix="./"):
         # Compute k-dependent Hamiltonian and save into seedname.h5
         #
         print("\n#############  Compute k-dependent Hamiltonian  ########################\n")
-        lattice_model.write_dft_band_input_data(p, kvec)
+        hash_bands = input_hash([one_body_input_hash(p), p["tool"]["knode"], nk_line])
+        if not force and read_input_hash(seedname + '.h5', '/dft_bands_input') == hash_bands:
+            print("    The k-path and the model are unchanged. Skipping. (Use --force to recompute)")
+        else:
+            lattice_model.write_dft_band_input_data(p, kvec)
+            write_input_hash(seedname + '.h5', '/dft_bands_input', hash_bands)
 
         #
         # Output gnuplot script
         #
         print("\n#############   Generate GnuPlot Script  ########################\n")
-        file_akw_gp = prefix + seedname + '_akw.gp'
-        with open(file_akw_gp, 'w') as f:
-            print("set size 0.95, 1.0", file=f)
-            print("set xtics (\\", file=f)
-            if p["model"]["spin_orbit"]:
-                for inode in range(nnode-1):
-                    print("  \"{0}\"  {1}, \\".format(klabel[inode], xk_label[inode]), file=f)
-                print("  \"{0}\"  {1} \\".format(klabel[nnode-1], xk_label[nnode-1]), file=f)
-            else:
-                for inode in range(nnode):
-                    print("  \"{0}\"  {1}, \\".format(klabel[inode], xk_label[inode]), file=f)
-                offset = xk_label[nnode-1]*1.1
-                for inode in range(nnode-1):
-                    print("  \"{0}\"  {1}, \\".format(klabel[inode], xk_label[inode]+offset), file=f)
-                print("  \"{0}\"  {1} \\".format(klabel[nnode-1], xk_label[nnode-1]+offset), file=f)
-            print("  )", file=f)
-            print("set pm3d map", file=f)
-            print("#set pm3d interpolate 5, 5", file=f)
-            print("unset key", file=f)
-            print("set ylabel \"Energy\"", file=f)
-            print("set cblabel \"A(k,w)\"", file=f)
-            print("splot \"{0}_akw.dat\"".format(seedname), file=f)
-            print("pause -1", file=f)
-            print("    Usage:")
-            print("\n      $ gnuplot {0}".format(file_akw_gp))
+        if p['tool']['akw_format'] in ['txt', 'both']:
+            file_akw_gp = prefix + seedname + '_akw.gp'
+            with open(file_akw_gp, 'w') as f:
+                print("set size 0.95, 1.0", file=f)
+                print("set xtics (\\", file=f)
+                if p["model"]["spin_orbit"]:
+                    for inode in range(nnode-1):
+                        print("  \"{0}\"  {1}, \\".format(klabel[inode], xk_label[inode]), file=f)
+                    print("  \"{0}\"  {1} \\".format(klabel[nnode-1], xk_label[nnode-1]), file=f)
+                else:
+                    for inode in range(nnode):
+                        print("  \"{0}\"  {1}, \\".format(klabel[inode], xk_label[inode]), file=f)
+                    offset = xk_label[nnode-1]*1.1
+                    for inode in range(nnode-1):
+                        print("  \"{0}\"  {1}, \\".format(klabel[inode], xk_label[inode]+offset), file=f)
+                    print("  \"{0}\"  {1} \\".format(klabel[nnode-1], xk_label[nnode-1]+offset), file=f)
+                print("  )", file=f)
+                print("set pm3d map", file=f)
+                print("#set pm3d interpolate 5, 5", file=f)
+                print("unset key", file=f)
+                print("set ylabel \"Energy\"", file=f)
+                print("set cblabel \"A(k,w)\"", file=f)
+                print("splot \"{0}_akw.dat\"".format(seedname), file=f)
+                print("pause -1", file=f)
+                print("    Usage:")
+                print("\n      $ gnuplot {0}".format(file_akw_gp))
+        else:
+            # gnuplot cannot read the HDF5 file
+            print("    No gnuplot script is generated for akw_format = h5.")
+            print("    A(k,w) is written in {0}_akw.h5 (datasets xk, omega and akw/<spin>).".format(seedname))
 
 
     #
     # Plot
     #
-    dct = DMFTCoreTools(seedname, p, n_k, xk, prefix)
+    dct = DMFTCoreTools(seedname, p, n_k, xk, prefix, force)
     dct.post()
     if lattice_model.is_Hk_supported():
         dct.momentum_distribution()
@@ -489,6 +616,7 @@ def dcore_post(filename, np=1, prefix="./"):
     #
     # Finish
     #
+    wait_work_dir_tasks()
     print("\n#################  Done  #####################\n")
 
 
@@ -517,9 +645,13 @@ if __name__ == '__main__':
                         type=str,
                         help='prefix for output files'
                         )
+    parser.add_argument('--force',
+                        action='store_true',
+                        help='recompute H(k) along the k-path and Sigma_w even if the inputs are unchanged'
+                        )
 
     args = parser.parse_args()
     if os.path.isfile(args.path_input_file) is False:
         print("Input file is not exist.")
         sys.exit(-1)
-    dcore_post(args.path_input_file, int(args.np), args.prefix)
+    dcore_post(args.path_input_file, int(args.np), args.prefix, args.force)
@@ -22,18 +22,17 @@ import os
 import numpy
 import re
 import ast
-import h5py
 from pytriqs.archive.hdf_archive import HDFArchive
 from program_options import create_parser
 from pytriqs.operators.util.U_matrix import U_J_to_radial_integrals, U_matrix, eg_submatrix, t2g_submatrix
 
-from converters.wannier90_converter import Wannier90Converter
+from converters.wannier90_converter import read_hr_dat
 
 from .tools import *
 from .sumkdft import SumkDFTCompat
 
 from lattice_models import create_lattice_model
-from lattice_models.tools import print_local_fields
+from lattice_models.tools import validate_model_file, one_body_input_hash
 from .program_options import parse_parameters
 
 def __print_paramter(p, param_name):
@@ -191,24 +190,13 @@ def __generate_umat(p):
             else:
                 u_mat[ish] = umat_full
     elif p["model"]["interaction"] == 'respack':
-        w90u = Wannier90Converter(seedname=p["model"]["seedname"])
-        nr_u, rvec_u, rdeg_u, nwan_u, hamr_u = w90u.read_wannier90hr(p["model"]["seedname"] + "_ur.dat")
-        w90j = Wannier90Converter(seedname=p["model"]["seedname"])
-        nr_j, rvec_j, rdeg_j, nwan_j, hamr_j = w90j.read_wannier90hr(p["model"]["seedname"] + "_jr.dat")
         #
-        # Read 2-index U-matrix
+        # Read 2-index U-matrix and J-matrix at R=0
         #
-        umat2 = numpy.zeros((nwan_u, nwan_u), numpy.complex_)
-        for ir in range(nr_u):
-            if rvec_u[ir, 0] == 0 and rvec_u[ir, 1] == 0 and rvec_u[ir, 2] == 0:
-                umat2 = hamr_u[ir]
-        #
-        # Read 2-index J-matrix
-        #
-        jmat2 = numpy.zeros((nwan_j, nwan_j), numpy.complex_)
-        for ir in range(nr_j):
-            if rvec_j[ir, 0] == 0 and rvec_j[ir, 1] == 0 and rvec_j[ir, 2] == 0:
-                jmat2 = hamr_j[ir]
+        _, _, umat2 = read_hr_dat(p["model"]["seedname"] + "_ur.dat", rvec_selected=[(0, 0, 0)])
+        umat2 = umat2[0]
+        _, _, jmat2 = read_hr_dat(p["model"]["seedname"] + "_jr.dat", rvec_selected=[(0, 0, 0)])
+        jmat2 = jmat2[0]
         #
         # Map into 4-index U at each correlated shell
         #
@@ -300,7 +288,50 @@ def __generate_local_potential(p):
     print("\n    Written to {0}".format(p["model"]["seedname"]+'.h5'))
 
 
-def dcore_pre(filename):
+def __reduce_kmesh(p, lattice_model):
+    """
+    Reduce the k mesh in the model HDF5 file to the irreducible k points
+
+    Parameters
+    ----------
+    p : dictionary
+        Input parameters
+    lattice_model : LatticeModel
+    """
+    from lattice_models.tools import cubic_point_group, read_symmetry_ops, reduce_to_irreducible_kmesh
+
+    if not lattice_model.name() in ['chain', 'square', 'cubic', 'wannier90']:
+        raise RuntimeError("kmesh_symmetry is not supported for lattice = {}!".format(lattice_model.name()))
+
+    print("\n@@@@@@@@@@@@@@@@@@@  Reduce k mesh  @@@@@@@@@@@@@@@@@@@@\n")
+    if p['model']['kmesh_symmetry'] == 'auto':
+        ops = cubic_point_group()
+    else:
+        ops = read_symmetry_ops(p['model']['kmesh_symmetry'])
+    reduce_to_irreducible_kmesh(p['model']['seedname'] + '.h5', lattice_model.nkdiv(), ops)
+
+
+def __generate_one_body(p):
+    """
+    Generate the one-body part of the model (H(k) and projectors) from scratch
+
+    Parameters
+    ----------
+    p : dictionary
+        Input parameters
+    """
+    if os.path.exists(p['model']['seedname'] + '.h5'):
+        print("Removing the existing model HDF5 file...")
+        os.remove(p['model']['seedname'] + '.h5')
+
+    lattice_model = create_lattice_model(p)
+    lattice_model.generate_model_file()
+
+    if p['model']['kmesh_symmetry'] != 'None':
+        __reduce_kmesh(p, lattice_model)
+
+
+def dcore_pre(filename, force=False):
     """
     Main routine for the pre-processing tool
 
@@ -308,6 +339,8 @@ def dcore_pre(filename):
     ----------
     filename : string
         Input-file name
+    force : bool
+        Regenerate all data even if the inputs are unchanged
     """
     print("\n@@@@@@@@@@@@@@@@@@@  Reading Input File  @@@@@@@@@@@@@@@@@@@@\n")
     print("Input File Name : ", filename)
@@ -333,48 +366,54 @@ def dcore_pre(filename):
     for k, v in p["system"].items():
         print("      {0} = {1}".format(k, v))
 
-    if os.path.exists(p['model']['seedname'] + '.h5'):
-        print("Removing the existing model HDF5 file...")
-        os.remove(p['model']['seedname'] + '.h5')
+    h5_file = p['model']['seedname'] + '.h5'
 
     #
     # One-body term
     #
     print("\n@@@@@@@@@@@@@@@@@@@  Generate Model-HDF5 File  @@@@@@@@@@@@@@@@@@@@\n")
-    lattice_model = create_lattice_model(p)
-    lattice_model.generate_model_file()
-
-    # Check if H(k) is hermite
-    with h5py.File(p['model']['seedname'] + '.h5', 'r') as f:
-        hk = float_to_complex_array(f['/dft_input/hopping'][()])
-        for ik in range(hk.shape[0]):
-            for ib in range(hk.shape[1]):
-                max_val = numpy.amax(numpy.abs(hk[ik,ib,:,:]))
-                if max_val < 1e-8:
-                    continue
-                diff = numpy.amax(numpy.abs(hk[ik,ib,:,:] - hk[ik,ib,:,:].conjugate().transpose()))/max_val
-                message = 'H(k) is not hermite at ik={} and iblock={}, relative diff is {}.' .format(ik, ib, diff)
-                if diff > 1e-2:
-                    raise RuntimeError('Error: {}'.format(message))
-                elif diff > 1e-8:
-                    print('Warning: {}'.format(message))
-
+    hash_one_body = one_body_input_hash(p)
+    if not force and read_input_hash(h5_file, '/dft_input') == hash_one_body:
+        print("The one-body part of the model is unchanged. Skipping generating it. (Use --force to regenerate)")
+    else:
+        __generate_one_body(p)
+        write_input_hash(h5_file, '/dft_input', hash_one_body)
 
+    #
     # Interaction
     #
-    __generate_umat(p)
+    files_umat = []
+    if p["model"]["interaction"] == 'respack':
+        files_umat = [p["model"]["seedname"] + "_ur.dat", p["model"]["seedname"] + "_jr.dat"]
+    hash_umat = input_hash(p['model'], files_umat)
+    if not force and read_input_hash(h5_file, '/DCore/Umat') == hash_umat:
+        print("\n  @ Interactions are unchanged. Skipping generating them.")
+    else:
+        __generate_umat(p)
+        write_input_hash(h5_file, '/DCore/Umat', hash_umat)
 
     #
     # Local potential
     #
-    __generate_local_potential(p)
+    files_pot = []
+    if p["model"]["local_potential_matrix"] != 'None':
+        try:
+            files_pot = [str(fname) for fname in ast.literal_eval(p["model"]["local_potential_matrix"]).values()]
+        except Exception:
+            pass  # Reported by __generate_local_potential
+    hash_pot = input_hash(p['model'], files_pot)
+    if not force and read_input_hash(h5_file, '/DCore/LocalPotential') == hash_pot:
+        print("\n  @ Local potential is unchanged. Skipping generating it.")
+    else:
+        __generate_local_potential(p)
+        write_input_hash(h5_file, '/DCore/LocalPotential', hash_pot)
 
     #
-    # Check one-body term
+    # Check H(k) and U
     #
     print('')
     print('@@@@@@@@@@@@@@@@@@@ Check Model-HDF5 file @@@@@@@@@@@@@@@@@@@@')
-    print_local_fields(p['model']['seedname'] + '.h5')
+    validate_model_file(h5_file)
 
     #
     # Finish
@@ -401,9 +440,13 @@ if __name__ == '__main__':
                         type=str,
                         help="input file name."
                         )
+    parser.add_argument('--force',
+                        action='store_true',
+                        help='regenerate all data in the model HDF5 file even if the inputs are unchanged'
+                        )
 
     args = parser.parse_args()
     if os.path.isfile(args.path_input_file) is False:
         print("Input file is not exist.")
         sys.exit(-1)
-    dcore_pre(args.path_input_file)
+    dcore_pre(args.path_input_file, args.force)
@@ -87,13 +87,25 @@ class ShellQuantity(object):
             g.zero()
 
 
-def solve_impurity_model(solver_name, solver_params, mpirun_command, basis_rot, Umat, gf_struct, beta, n_iw, Sigma_iw, Gloc_iw, mesh, ish, work_dir):
+# Input files of impurity solvers not copied back from scratch directories
+_large_solver_input_files = ['input.h5', 'delta.txt', 'delta']
+
+
+def solve_impurity_model(solver_name, solver_params, mpirun_command, basis_rot, Umat, gf_struct, beta, n_iw, Sigma_iw, Gloc_iw, mesh, ish, work_dir, cache_dir=None, H_loc=None,
+                         scratch_dir=None, compress_logs=False):
     """
 
     Solve an impurity model
 
     If mesh is not None, Sigma_w will be computed. Otherwise, None will be returned as Sigma_w.
 
+    If cache_dir is not None, the solver may cache data reusable over iterations in that directory.
+
+    If H_loc is not None, it is used as the non-interacting local Hamiltonian of G0 instead of a tail fit.
+
+    If scratch_dir is not None, the solver runs in scratch_dir.
+    Then, the working directory except large input files is copied back to work_dir in background.
+
     """
 
     assert isinstance(basis_rot, str)
@@ -113,21 +125,24 @@ def solve_impurity_model(solver_name, solver_params, mpirun_command, basis_rot,
     diff = make_hermite_conjugate(G0_iw)
     if diff > 1e-8:
         raise RuntimeError('G0(iwn) is not hermite!')
-    sol.set_G0_iw(G0_iw)
+    sol.set_G0_iw(G0_iw, H_loc)
 
     # Compute rotation matrix to the diagonal basis if supported
     if basis_rot == 'None':
         rot = None
     elif basis_rot == 'Hloc':
-        rot = compute_diag_basis(G0_iw)
+        rot = compute_diag_basis(G0_iw, H_loc)
     else:
         raise RuntimeError("Invalid basis_rot : {}".format(basis_rot))
     s_params = copy.deepcopy(solver_params)
     s_params['random_seed_offset'] = 1000 * ish
 
+    if not cache_dir is None:
+        sol.set_cache_dir(os.path.abspath(cache_dir))
+
     work_dir_org = os.getcwd()
-    make_empty_dir(work_dir)
-    os.chdir(work_dir)
+    work_dir_run = make_work_dir(work_dir, scratch_dir)
+    os.chdir(work_dir_run)
 
     if not mesh is None:
         s_params['calc_Sigma_w'] = True
@@ -138,6 +153,9 @@ def solve_impurity_model(solver_name, solver_params, mpirun_command, basis_rot,
 
     os.chdir(work_dir_org)
 
+    if work_dir_run != work_dir:
+        copy_back_work_dir(work_dir_run, work_dir, exclude=_large_solver_input_files, compress_logs=compress_logs)
+
     # Read & save local quantities
     # Change from DCore v1:
     #      Local impurity Green's function is saved as "Gimp_iw" in DCore v2.
@@ -173,6 +191,11 @@ class DMFTCoreSolver(object):
         if 'num_processes' in params['mpi']:
             self._mpirun_command = params['mpi']['command'].replace('#', str(params['mpi']['num_processes']))
 
+        # Working directories on scratch storage
+        self._scratch_dir = None if params['mpi']['scratch_dir'] == 'None' else params['mpi']['scratch_dir']
+        self._compress_logs = params['mpi']['compress_logs']
+        self._shared_memory = params['mpi']['shared_memory']
+
         self._read_only = read_only
         if read_only:
             assert params['control']['restart']
@@ -229,6 +252,12 @@ class DMFTCoreSolver(object):
             self._dc_imp.append(dc)
         self._dc_energ = 0.0
 
+        # Non-interacting local Hamiltonian at inequivalent shells (set by calc_Gloc)
+        self._H_loc_sh = None
+
+        # Last iteration whose working directories have been pruned
+        self._last_pruned_iteration = 0
+
         #
         # Read or set up seedname.out.h5
         #
@@ -386,22 +415,34 @@ class DMFTCoreSolver(object):
             'dc_energ'      : self._dc_energ,
             'mu'            : self._chemical_potential,
             'adjust_mu'     : False,
+            'shared_memory' : self._shared_memory,
         }
 
     def calc_Gloc(self):
         """
         Compute the lattice/local Green's function using SumkDFT.
 
-        Return a list of Gloc_iw and density matrices for inequivalent shells
+        Return a list of Gloc_iw and density matrices for inequivalent shells.
+        The non-interacting local Hamiltonian obtained from the k-sum is kept for solving impurity models.
+        Gloc saved in the output file is reused if it was computed from the same inputs.
+        In read-only mode, a newly computed Gloc is saved in the output file.
         """
 
+        # The saved one is valid unless the chemical potential is adjusted
+        if self._read_only or self._params['system']['fix_mu']:
+            r = self._load_Gloc()
+            if r is not None:
+                print("Loaded Gloc_iw computed with the same chemical potential and self-energy from {}".format(self._output_file))
+                return r
+
         mu_old = self._chemical_potential
 
         params = self._make_sumkdft_params()
         params['calc_mode'] = 'Gloc'
         if (not self._params['system']['fix_mu']) and (not self._read_only):
             params['adjust_mu'] = True
-        r = sumkdft.run(os.path.abspath(self._seedname+'.h5'), './work/sumkdft', self._mpirun_command, params)
+        r = sumkdft.run(os.path.abspath(self._seedname+'.h5'), './work/sumkdft', self._mpirun_command, params,
+                        self._scratch_dir, self._compress_logs)
 
         if params['adjust_mu']:
             self._chemical_potential = r['mu']
@@ -410,8 +451,94 @@ class DMFTCoreSolver(object):
         if self._params['system']['fix_mu'] or self._read_only:
             assert self._chemical_potential == mu_old
 
+        self._H_loc_sh = r['H_loc_sh']
+
+        # Keep the result for later runs of post-processing tools
+        if self._read_only:
+            self._save_Gloc(r['Gloc_iw_sh'], r['dm_sh'], r['H_loc_sh'])
+
         return r['Gloc_iw_sh'], r['dm_sh']
 
+    def _save_Gloc_for_post(self):
+        """
+        Compute Gloc for the current (updated) self-energy at the current chemical potential
+        and save it for post-processing tools.
+        This costs one more k-sum and is done only if [control] save_Gloc_for_post is set.
+        """
+
+        key = self._Gloc_key()
+        if key is None or read_input_hash(self._output_file, self._output_group + '/Gloc') == key:
+            return
+
+        print("\nComputing Gloc_iw for the final self-energy to be reused by post-processing tools...")
+        params = self._make_sumkdft_params()
+        params['calc_mode'] = 'Gloc'
+        r = sumkdft.run(os.path.abspath(self._seedname+'.h5'), './work/sumkdft', self._mpirun_command, params,
+                        self._scratch_dir, self._compress_logs)
+        self._save_Gloc(r['Gloc_iw_sh'], r['dm_sh'], r['H_loc_sh'])
+
+    def _Gloc_key(self):
+        """
+        Hash of the inputs of calc_Gloc: the model, chemical potential, self-energy, double counting and local potential.
+        None is returned if the model HDF5 file has no hash (generated by an old version of dcore_pre).
+        """
+
+        model_hash = read_input_hash(self._seedname + '.h5', '/dft_input')
+        if model_hash is None:
+            return None
+        Sigma_data = [[g.data for _, g in self._sh_quant[ish].Sigma_iw] for ish in range(self._n_inequiv_shells)]
+        with_dc = self._params['system']['with_dc']
+        return input_hash([model_hash, self._beta, self._chemical_potential, Sigma_data, with_dc,
+                           self._dc_imp if with_dc else None, self._local_potential])
+
+    def _save_Gloc(self, Gloc_iw_sh, dm_sh, H_loc_sh):
+        """
+        Save Gloc_iw, G0_iw fed to impurity solvers, H_loc and density matrices in the output HDF5 file
+        under output_group/Gloc, replacing the previous ones.
+        The hash of the inputs (see _Gloc_key) is stored as an attribute.
+        """
+
+        path = self._output_group + '/Gloc'
+        key = self._Gloc_key()
+        with h5py.File(self._output_file, 'a') as ar:
+            if path in ar:
+                del ar[path]
+            for ish in range(self._n_inequiv_shells):
+                G0_iw = dyson(Sigma_iw=self._sh_quant[ish].Sigma_iw, G_iw=Gloc_iw_sh[ish])
+                for bname, g in Gloc_iw_sh[ish]:
+                    save_giw(ar, path + '/Gloc_iw/sh{}/{}'.format(ish, bname), g)
+                for bname, g in G0_iw:
+                    save_giw(ar, path + '/G0_iw/sh{}/{}'.format(ish, bname), g)
+        with HDFArchive(self._output_file, 'a') as ar:
+            ar[self._output_group]['Gloc']['H_loc_sh'] = H_loc_sh
+            ar[self._output_group]['Gloc']['dm_sh'] = dm_sh
+        if key is not None:
+            write_input_hash(self._output_file, path, key)
+
+    def _load_Gloc(self):
+        """
+        Load Gloc_iw and density matrices saved by _save_Gloc if the inputs are unchanged.
+        H_loc is set as well.
+        Return None if not found.
+        """
+
+        key = self._Gloc_key()
+        path = self._output_group + '/Gloc'
+        if key is None or read_input_hash(self._output_file, path) != key:
+            return None
+
+        Gloc_iw_sh = []
+        with h5py.File(self._output_file, 'r') as ar:
+            for ish in range(self._n_inequiv_shells):
+                Gloc_iw = make_block_gf(GfImFreq, self._gf_struct[ish], self._beta, self._n_iw)
+                for bname, g in Gloc_iw:
+                    load_giw(ar, path + '/Gloc_iw/sh{}/{}'.format(ish, bname), g)
+                Gloc_iw_sh.append(Gloc_iw)
+        with HDFArchive(self._output_file, 'r') as ar:
+            self._H_loc_sh = ar[self._output_group]['Gloc']['H_loc_sh']
+            dm_sh = ar[self._output_group]['Gloc']['dm_sh']
+        return Gloc_iw_sh, dm_sh
+
 
     def print_density_matrix(self, dm_sh):
         smoments = spin_moments_sh(dm_sh)
@@ -452,13 +579,16 @@ class DMFTCoreSolver(object):
         for ish in range(self._n_inequiv_shells):
             print('')
             work_dir = 'work/imp_shell'+str(ish)+'_ite'+str(iteration_number)
+            cache_dir = 'work/imp_shell'+str(ish)+'_cache'
             print('Solving impurity model for inequivalent shell {} in {}...'.format(ish, work_dir))
             print('')
             sys.stdout.flush()
             Sigma_iw, Gimp_iw, Sigma_w = solve_impurity_model(solver_name, self._solver_params, self._mpirun_command,
                              self._params["impurity_solver"]["basis_rotation"], self._Umat[ish], self._gf_struct[ish],
                                  self._beta, self._n_iw,
-                                 self._sh_quant[ish].Sigma_iw, Gloc_iw_sh[ish], mesh, ish, work_dir)
+                                 self._sh_quant[ish].Sigma_iw, Gloc_iw_sh[ish], mesh, ish, work_dir, cache_dir,
+                                 None if self._H_loc_sh is None else self._H_loc_sh[ish],
+                                 self._scratch_dir, self._compress_logs)
             if make_hermite_conjugate(Sigma_iw) > 1e-8:
                 raise RuntimeError("Sigma_iw is not hermite conjugate!")
             if make_hermite_conjugate(Gimp_iw) > 1e-8:
@@ -602,6 +732,11 @@ class DMFTCoreSolver(object):
             Gloc_iw_sh, dm_sh = self.calc_Gloc()
             self.print_density_matrix(dm_sh)
 
+            # Gloc of the last iteration is kept for dcore_post and dcore_bse.
+            # It is reused only if they use the same self-energy (e.g. converged one).
+            if iteration_number == self._previous_runs + max_step:
+                self._save_Gloc(Gloc_iw_sh, dm_sh, self._H_loc_sh)
+
             for ish in range(self._n_inequiv_shells):
                 print("\n  Total charge of Gloc_{shell %d} : %.6f" % (ish, Gloc_iw_sh[ish].total_density()))
 
@@ -651,10 +786,37 @@ class DMFTCoreSolver(object):
                         path = output_group + '/Sigma_iw/ite{}/sh{}/{}'.format(iteration_number, ish, bname)
                         save_giw(ar, path, g)
 
+            self._prune_work_dirs(iteration_number)
+
             sys.stdout.flush()
 
         self._previous_runs += max_step
 
+        # Gloc for the final self-energy is reused by dcore_post and dcore_bse
+        if self._params['control']['save_Gloc_for_post']:
+            self._save_Gloc_for_post()
+
+    def _prune_work_dirs(self, iteration_number):
+        """
+        Prune working directories of impurity solvers for iterations before iteration_number
+        according to [control] keep_work_dirs, keep_work_dirs_every and prune_work_dirs.
+        This is done in background.
+        """
+
+        keep_last = self._params['control']['keep_work_dirs']
+        keep_every = self._params['control']['keep_work_dirs_every']
+        if keep_last < 0:
+            return
+
+        # Iterations up to _last_pruned_iteration have been pruned in this run
+        dirs = work_dirs_to_prune(iteration_number, self._n_inequiv_shells, keep_last, keep_every,
+                                  self._last_pruned_iteration + 1)
+        self._last_pruned_iteration = max(self._last_pruned_iteration, iteration_number - keep_last)
+
+        if dirs:
+            prune_work_dirs(dirs, self._params['control']['prune_work_dirs'], _large_solver_input_files,
+                            'work/imp_shell_archive.zip')
+
     def chemical_potential(self, iteration_number):
         with HDFArchive(self._output_file, 'r') as ar:
             return ar[self._output_group]['chemical_potential'][str(iteration_number)]
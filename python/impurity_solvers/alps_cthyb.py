@@ -28,16 +28,14 @@ from pytriqs.archive import HDFArchive
 from pytriqs.operators import *
 
 from ..tools import make_block_gf, launch_mpi_subprocesses, extract_H0, get_block_size
-from .base import SolverBase
+from .base import SolverBase, compute_delta_tau
 
 
 def remove_positive_eigenvalues(Delta_tau):
-    ntau = Delta_tau.shape[0]
-
-    for itau in range(ntau):
-        evals, evecs = numpy.linalg.eigh(Delta_tau[itau, :, :])
-        evals[evals>0] = 0.0
-        Delta_tau[itau, :, :] = evecs.dot(numpy.diag(evals).dot(evecs.transpose().conjugate()))
+    # Diagonalize all the tau points at once
+    evals, evecs = numpy.linalg.eigh(Delta_tau)
+    evals[evals>0] = 0.0
+    Delta_tau[...] = numpy.matmul(evecs * evals[:, None, :], evecs.transpose((0, 2, 1)).conjugate())
 
 def to_numpy_array(g, block_names):
     """
@@ -120,6 +118,7 @@ class ALPSCTHYBSolver(SolverBase):
         params_kw must may contain the following parameters.
           exec_path : str, path to an executable, mandatory
           dry_run   : bool, actual computation is not performed if dry_run is True, optional
+          delta_method : str, 'numpy' (default) or 'triqs', how Delta(tau) is computed, optional
 
         """
 
@@ -127,6 +126,7 @@ class ALPSCTHYBSolver(SolverBase):
             'exec_path'           : '',
             'random_seed_offset'  : 0,
             'dry_run'             : False,
+            'delta_method'        : 'numpy',
         }
 
         def _read(key):
@@ -144,26 +144,32 @@ class ALPSCTHYBSolver(SolverBase):
         # Non-interacting part of the local Hamiltonian including chemical potential
         # Make sure H0 is hermite.
         # Ordering of index in H0 is spin1, spin2, spin1, spin2, ...
-        H0 = extract_H0(self._G0_iw, self.block_names)
+        H0 = extract_H0(self._G0_iw, self.block_names, H_loc=self._H_loc)
 
         # from (up,orb1), (up,orb2), ..., (down,orb1), (down,orb2), ...
         # to (up,orb1), (down,orb1), (up,orb2), (down,orb2), ...
         index = numpy.zeros((2*self.n_orb), dtype=int)
         index[0::2] = numpy.arange(self.n_orb)
         index[1::2] = numpy.arange(self.n_orb) + self.n_orb
-        # Swap cols and rows
-        H0 = (H0[:, index])[index, :]
 
         # Compute the hybridization function from G0:
         #     Delta(iwn_n) = iw_n + mu - H0 - G0^{-1}(iw_n)
-        # H0 -mu is extracted from the tail of G0. (correct?)
-        self._Delta_iw = delta(self._G0_iw)
-        Delta_tau = make_block_gf(GfImTime, self.gf_struct, self.beta, self.n_tau)
-        for name in self.block_names:
-            Delta_tau[name] << InverseFourier(self._Delta_iw[name])
-        Delta_tau_data = to_numpy_array(Delta_tau, self.block_names)
+        if _read('delta_method') == 'numpy':
+            self._Delta_iw, Delta_tau_data = compute_delta_tau(self._G0_iw, H0, self.block_names, self.beta, self.n_tau)
+            Delta_tau_data = (Delta_tau_data[:, :, index])[:, index, :]
+        elif _read('delta_method') == 'triqs':
+            self._Delta_iw = delta(self._G0_iw)
+            Delta_tau = make_block_gf(GfImTime, self.gf_struct, self.beta, self.n_tau)
+            for name in self.block_names:
+                Delta_tau[name] << InverseFourier(self._Delta_iw[name])
+            Delta_tau_data = to_numpy_array(Delta_tau, self.block_names)
+        else:
+            raise RuntimeError("Unknown delta_method: " + _read('delta_method'))
         remove_positive_eigenvalues(Delta_tau_data)
 
+        # Swap cols and rows
+        H0 = (H0[:, index])[index, :]
+
         # non-zero elements of U matrix
         # Note: notation differences between ALPS/CT-HYB and TRIQS!
         #    The positions of l and k are swapped.
@@ -226,8 +232,12 @@ class ALPSCTHYBSolver(SolverBase):
                 print('{} {} {:.15e} {:.15e}'.format(i, j, H0[i,j].real, H0[i,j].imag), file=f)
 
         with open('./delta.txt', 'w') as f:
-            for itau, f1, f2 in product(range(self.n_tau), range(self.n_flavors), range(self.n_flavors)):
-                print('{} {} {} {:.15e} {:.15e}'.format(itau, f1, f2, Delta_tau_data[itau, f1, f2].real, Delta_tau_data[itau, f1, f2].imag), file=f)
+            # Columns: itau, f1, f2, real part, imaginary part
+            itau, f1, f2 = numpy.meshgrid(numpy.arange(self.n_tau), numpy.arange(self.n_flavors),
+                                          numpy.arange(self.n_flavors), indexing='ij')
+            numpy.savetxt(f, numpy.column_stack((itau.ravel(), f1.ravel(), f2.ravel(),
+                                                 Delta_tau_data.real.ravel(), Delta_tau_data.imag.ravel())),
+                          fmt='%d %d %d %.15e %.15e')
 
         with open('./Uijkl.txt', 'w') as f:
             print(len(U_nonzeros), file=f)
@@ -24,7 +24,7 @@ from ..pytriqs_gf_compat import *
 from pytriqs.archive import HDFArchive
 from pytriqs.operators import *
 from ..tools import make_block_gf, launch_mpi_subprocesses, extract_H0, umat2dd
-from .base import SolverBase
+from .base import SolverBase, compute_delta_tau
 
 
 def to_numpy_array(g, names):
@@ -148,11 +148,13 @@ class ALPSCTHYBSEGSolver(SolverBase):
         one can pass solver-dependent parameters using params_kw. For example,
           exec_path : str, path to an executable, mandatory
           dry_run   : bool, actual computation is not performed if dry_run is True, optional
+          delta_method : str, 'numpy' (default) or 'triqs', how Delta(tau) is computed, optional
         """
         internal_params = {
             'exec_path'           : '',
             'random_seed_offset'  : 0,
             'dry_run'             : False,
+            'delta_method'        : 'numpy',
         }
 
         def _read(key):
@@ -180,25 +182,31 @@ class ALPSCTHYBSEGSolver(SolverBase):
         # Non-interacting part of the local Hamiltonian including chemical potential
         # Make sure H0 is hermite.
         # Ordering of index in H0 is spin1, spin1, ..., spin2, spin2, ...
-        H0 = extract_H0(self._G0_iw, self.block_names)
+        H0 = extract_H0(self._G0_iw, self.block_names, H_loc=self._H_loc)
 
         # from (up,orb1), (up,orb2), ..., (down,orb1), (down,orb2), ...
         # to (up,orb1), (down,orb1), (up,orb2), (down,orb2), ...
         index = numpy.zeros((2*self.n_orb), dtype=int)
         index[0::2] = numpy.arange(self.n_orb)
         index[1::2] = numpy.arange(self.n_orb) + self.n_orb
-        # Swap cols and rows
-        H0 = (H0[:, index])[index, :]
 
         # (1b) If Delta(iw) and/or Delta(tau) are necessary:
         # Compute the hybridization function from G0:
         #     Delta(iwn_n) = iw_n - H0 - G0^{-1}(iw_n)
-        # H0 is extracted from the tail of the Green's function.
-        self._Delta_iw = delta(self._G0_iw)
-        Delta_tau = make_block_gf(GfImTime, self.gf_struct, self.beta, self.n_tau)
-        for name in self.block_names:
-            Delta_tau[name] << InverseFourier(self._Delta_iw[name])
-        Delta_tau_data = to_numpy_array(Delta_tau, self.block_names)
+        if _read('delta_method') == 'numpy':
+            self._Delta_iw, Delta_tau_data = compute_delta_tau(self._G0_iw, H0, self.block_names, self.beta, self.n_tau)
+            Delta_tau_data = (Delta_tau_data[:, :, index])[:, index, :]
+        elif _read('delta_method') == 'triqs':
+            self._Delta_iw = delta(self._G0_iw)
+            Delta_tau = make_block_gf(GfImTime, self.gf_struct, self.beta, self.n_tau)
+            for name in self.block_names:
+                Delta_tau[name] << InverseFourier(self._Delta_iw[name])
+            Delta_tau_data = to_numpy_array(Delta_tau, self.block_names)
+        else:
+            raise RuntimeError("Unknown delta_method: " + _read('delta_method'))
+
+        # Swap cols and rows
+        H0 = (H0[:, index])[index, :]
 
         # (1c) Set U_{ijkl} for the solver
         # Set up input parameters and files for ALPS/CTHYB-SEG
@@ -27,6 +27,7 @@ import subprocess
 import os
 import shlex
 import copy
+import hashlib
 
 from ..tools import *
 
@@ -96,11 +97,31 @@ class SolverBase(object):
         self._Sigma_w = None
         #"self._G_l = None # Please define it if Legendre basis is used
 
+        # Directory where data reusable over DMFT iterations may be cached (e.g. h_int)
+        self._cache_dir = None
+
+        # Non-interacting local Hamiltonian of G0_iw (dict of matrices).
+        # If None, it is extracted from the tail of G0_iw.
+        self._H_loc = None
+
     def name(self):
         return "Base solver"
 
-    def set_G0_iw(self, new_G0_iw):
+    def set_cache_dir(self, cache_dir):
+        """
+        Set a directory which persists over DMFT iterations.
+        A solver may store data which can be reused in the next iteration there.
+        """
+        self._cache_dir = cache_dir
+
+    def set_G0_iw(self, new_G0_iw, H_loc=None):
+        """
+        Set G0_iw.
+        H_loc is the non-interacting local Hamiltonian of G0_iw, i.e. its 1/(iw)^2 tail coefficient.
+        If given, solvers use it instead of fitting the tail of G0_iw.
+        """
         self._G0_iw << new_G0_iw.copy()
+        self._H_loc = None if H_loc is None else {name: numpy.array(h) for name, h in H_loc.items()}
 
     def get_Sigma_iw(self):
         return self._Sigma_iw.copy()
@@ -176,23 +197,81 @@ def make_h_int(u_mat, gf_struct):
     """
     Construct an operator representing the interacting Hamiltonian
 
+    Only non-zero elements of U are visited.
+    The terms (i1, i2, i3, i4) and (i2, i1, i4, i3) represent the same operator and are merged.
+    Terms with i1 == i2 or i3 == i4 vanish and are skipped.
+
     :param u_mat: four-index U matrix.
         The dimensions of each axis is spin * orbital.
            gf_struct: dict
     """
 
-    n_orb = int(u_mat.shape[0]/2)
     _, from_flatten_index = creat_mapping_flatten_index(gf_struct)
 
+    # Merge symmetric terms: c^+_1 c^+_2 c_4 c_3 = c^+_2 c^+_1 c_3 c_4
+    u_merged = {}
+    for i1, i2, i3, i4 in zip(*numpy.nonzero(u_mat)):
+        if i1 == i2 or i3 == i4:
+            continue
+        key = min((i1, i2, i3, i4), (i2, i1, i4, i3))
+        u_merged[key] = u_merged.get(key, 0.0) + 0.5 * u_mat[i1, i2, i3, i4]
+
     ham = Operator()
-    for i1, i2, i3, i4 in product(range(2*n_orb), repeat=4):
-        ham += 0.5 * u_mat[i1, i2, i3, i4] \
-               * c_dag(*from_flatten_index[i1]) * c_dag(*from_flatten_index[i2]) \
+    for (i1, i2, i3, i4), u in sorted(u_merged.items()):
+        if u == 0.0:
+            continue
+        ham += u * c_dag(*from_flatten_index[i1]) * c_dag(*from_flatten_index[i2]) \
                * c(*from_flatten_index[i4]) * c(*from_flatten_index[i3])
 
     return ham
 
 
+def _h_int_cache_key(u_mat, gf_struct):
+    """
+    Hash of U matrix and gf_struct identifying a cached h_int
+    """
+    h = hashlib.sha1()
+    h.update(numpy.ascontiguousarray(u_mat, dtype=complex).tobytes())
+    for name in sorted(gf_struct.keys()):
+        h.update(str((name, list(gf_struct[name]))).encode())
+    return h.hexdigest()
+
+
+def load_or_make_h_int(u_mat, gf_struct, cache_dir=None, write_cache=True):
+    """
+    Construct h_int by make_h_int or load it from a cache in cache_dir.
+
+    The cache is keyed by the (rotated) U matrix and gf_struct.
+    Thus, subsequent iterations with identical U and basis skip the rebuild.
+
+    :param cache_dir: str or None
+        Directory for cached operators. If None, h_int is always built.
+    :param write_cache: bool
+        Write h_int to the cache if it is not found (set False on non-master MPI ranks).
+    """
+
+    if cache_dir is None:
+        return make_h_int(u_mat, gf_struct)
+
+    cache_file = os.path.join(cache_dir, 'h_int_{}.h5'.format(_h_int_cache_key(u_mat, gf_struct)))
+    if os.path.exists(cache_file):
+        with HDFArchive(cache_file, 'r') as h:
+            return h['h_int']
+
+    ham = make_h_int(u_mat, gf_struct)
+
+    if write_cache:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # Write to a temporary file first so that other processes never read an incomplete file
+        tmp_file = cache_file + '.tmp{}'.format(os.getpid())
+        with HDFArchive(tmp_file, 'w') as h:
+            h['h_int'] = ham
+        os.rename(tmp_file, cache_file)
+
+    return ham
+
+
 def rotate_basis(rot, use_spin_orbit, u_matrix, Gfs=[], direction='forward'):
     """
     Rotate all Gf-like objects and U-matrix to the basis defined by rot
@@ -212,6 +291,38 @@ def rotate_basis(rot, use_spin_orbit, u_matrix, Gfs=[], direction='forward'):
         raise RuntimeError("Unknown direction " + direction)
 
 
+def rotate_u_matrix(u_matrix, rot):
+    """
+    Rotate a four-index U matrix as
+        U'_{mnop} = sum_{ijkl} U_{ijkl} conj(rot_{im}) conj(rot_{jn}) rot_{ko} rot_{lp}
+
+    This is done by four successive contractions, each of which costs O(n^5).
+
+    :param u_matrix: four-index U matrix
+    :param rot: unitary matrix
+    :return: rotated U matrix
+    """
+
+    rot_conj = numpy.conj(rot)
+    # Each contraction eats the leading index of the tensor and appends the new one.
+    u_rot = numpy.tensordot(u_matrix, rot_conj, axes=(0, 0))
+    u_rot = numpy.tensordot(u_rot, rot_conj, axes=(0, 0))
+    u_rot = numpy.tensordot(u_rot, rot, axes=(0, 0))
+    return numpy.tensordot(u_rot, rot, axes=(0, 0))
+
+
+def _rotate_gf(gf, rot):
+    """
+    Rotate a Gf-like object in place as rot^dagger G rot.
+    The matrix product is batched over all mesh points.
+    """
+
+    rot_conj_trans = rot.transpose().conjugate()
+    gf.data[...] = numpy.matmul(numpy.matmul(rot_conj_trans, gf.data), rot)
+    if triqs_major_version == 1 and hasattr(gf, 'tail'):
+        gf.tail.data[...] = numpy.matmul(numpy.matmul(rot_conj_trans, gf.tail.data), rot)
+
+
 def _rotate_basis(rot, u_matrix, use_spin_orbit, Gfs):
     """
     Rotate all Gf-like object and U matrix to a new local basis defined by "rot".
@@ -230,11 +341,99 @@ def _rotate_basis(rot, u_matrix, use_spin_orbit, Gfs):
 
     for G in Gfs:
         for bname, gf in G:
-            gf.from_L_G_R(rot[bname].transpose().conjugate(), gf, rot[bname])
+            _rotate_gf(gf, rot[bname])
 
     if not u_matrix is None:
-        return numpy.einsum("ijkl,im,jn,ko,lp", u_matrix,
-                                    numpy.conj(rot_spin_full), numpy.conj(rot_spin_full), rot_spin_full, rot_spin_full)
+        return rotate_u_matrix(u_matrix, rot_spin_full)
+
+
+def compute_delta_iw(G0_iw_data, H0, beta):
+    """
+    Compute the hybridization function
+        Delta(iw_n) = iw_n - H0 - G0(iw_n)^{-1}
+    for all Matsubara frequencies at once.
+
+    :param G0_iw_data: numpy array of shape (2*n_iw, n, n) for w_n with n = -n_iw, ..., n_iw-1
+    :param H0: numpy array of shape (n, n)
+    :return: numpy array of shape (2*n_iw, n, n)
+    """
+
+    n_iw = G0_iw_data.shape[0] // 2
+    iw = 1J * numpy.pi * (2 * numpy.arange(-n_iw, n_iw) + 1) / beta
+    identity = numpy.identity(G0_iw_data.shape[1])
+    return iw[:, None, None] * identity[None, :, :] - H0[None, :, :] - numpy.linalg.inv(G0_iw_data)
+
+
+def delta_iw_to_tau(Delta_iw_data, beta, n_tau):
+    """
+    Fourier transform a hybridization function to n_tau equidistant imaginary times in [0, beta]
+        Delta(tau) = (1/beta) sum_n exp(-iw_n tau) Delta(iw_n).
+
+    The 1/iw_n and 1/(iw_n)^2 terms of the tail are estimated at the largest frequency.
+    They are subtracted before the FFT and added back analytically.
+
+    :param Delta_iw_data: numpy array of shape (2*n_iw, n, n) for w_n with n = -n_iw, ..., n_iw-1
+    :return: numpy array of shape (n_tau, n, n)
+    """
+
+    n_iw = Delta_iw_data.shape[0] // 2
+    n_flavors = Delta_iw_data.shape[1]
+    n = numpy.arange(-n_iw, n_iw)
+    iw = 1J * numpy.pi * (2 * n + 1) / beta
+
+    # Delta(iw_n) = c1/iw_n + c2/(iw_n)^2 + ... with hermite c1 and c2
+    iw_delta = iw[-1] * Delta_iw_data[-1]
+    c1 = 0.5 * (iw_delta + iw_delta.transpose().conj())
+    c2 = 0.5 * iw[-1] * (iw_delta - iw_delta.transpose().conj())
+    delta_rest = Delta_iw_data - c1[None, :, :] / iw[:, None, None] - c2[None, :, :] / (iw**2)[:, None, None]
+
+    # With tau_j = j * beta/M (M = n_tau-1),
+    #    sum_n exp(-iw_n tau_j) f_n = exp(-i pi j/M) sum_n exp(-2 pi i n j/M) f_n.
+    # This is a FFT of length M after folding n modulo M.
+    M = n_tau - 1
+    folded = numpy.zeros((M, n_flavors, n_flavors), dtype=complex)
+    if M >= 2 * n_iw:
+        folded[n % M] = delta_rest
+    else:
+        numpy.add.at(folded, n % M, delta_rest)
+    ft = numpy.fft.fft(folded, axis=0)
+
+    j = numpy.arange(n_tau)
+    tau = beta * j / float(M)
+    Delta_tau = (numpy.exp(-1J * numpy.pi * j / float(M)) / beta)[:, None, None] * ft[j % M]
+
+    # Fourier transforms of 1/iw_n and 1/(iw_n)^2
+    Delta_tau += -0.5 * c1[None, :, :] + ((2 * tau - beta) / 4)[:, None, None] * c2[None, :, :]
+
+    return Delta_tau
+
+
+def compute_delta_tau(G0_iw, H0, block_names, beta, n_tau):
+    """
+    Compute Delta(iw_n) and Delta(tau) from G0_iw with numpy.
+    This is a vectorized replacement of TRIQS delta() followed by InverseFourier for each block.
+
+    :param G0_iw: BlockGf
+    :param H0: non-interacting Hamiltonian in the flattened spin-orbital space (see extract_H0)
+    :param block_names: list of block names
+    :return: Delta_iw (BlockGf) and Delta_tau (numpy array of shape (n_tau, n_flavors, n_flavors)).
+        The spin-orbital indices of Delta_tau are ordered in the same way as H0.
+    """
+
+    Delta_iw = G0_iw.copy()
+    n_flavors = H0.shape[0]
+    Delta_tau = numpy.zeros((n_tau, n_flavors, n_flavors), dtype=complex)
+    offset = 0
+    for name in block_names:
+        g = Delta_iw[name]
+        dim = g.data.shape[1]
+        sl = slice(offset, offset + dim)
+        g.data[...] = compute_delta_iw(G0_iw[name].data, H0[sl, sl], beta)
+        if triqs_major_version == 1:
+            g.tail.zero()
+        Delta_tau[:, sl, sl] = delta_iw_to_tau(g.data, beta, n_tau)
+        offset += dim
+    return Delta_iw, Delta_tau
 
 
 class PytriqsMPISolver(SolverBase):
@@ -263,6 +462,10 @@ class PytriqsMPISolver(SolverBase):
             h['n_iw'] = self.n_iw
             if not rot is None:
                 h['rot'] = rot
+            if not self._cache_dir is None:
+                h['cache_dir'] = self._cache_dir
+            if not self._H_loc is None:
+                h['H_loc'] = self._H_loc
             h['G0_iw'] = self._G0_iw
             h['params'] = params
 
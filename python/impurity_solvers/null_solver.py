@@ -25,7 +25,7 @@ from ..pytriqs_gf_compat import *
 from pytriqs.operators import *
 
 from ..tools import make_block_gf, launch_mpi_subprocesses, extract_H0
-from .base import SolverBase
+from .base import SolverBase, compute_delta_tau
 
 
 class NullSolver(SolverBase):
@@ -36,6 +36,7 @@ class NullSolver(SolverBase):
         """
 
         super(NullSolver, self).__init__(beta, gf_struct, u_mat, n_iw)
+        self.n_tau = max(10001, 5 * n_iw)
 
     def solve(self, rot, mpirun_command, params_kw):
         """
@@ -62,16 +63,13 @@ class NullSolver(SolverBase):
         # Non-interacting part of the local Hamiltonian including chemical potential
         # Make sure H0 is hermite.
         # Ordering of index in H0 is spin1, spin1, ..., spin2, spin2, ...
-        H0 = extract_H0(self._G0_iw, self.block_names)
+        H0 = extract_H0(self._G0_iw, self.block_names, H_loc=self._H_loc)
 
         # (1b) If Delta(iw) and/or Delta(tau) are necessary:
         # Compute the hybridization function from G0:
         #     Delta(iwn_n) = iw_n - H0 - G0^{-1}(iw_n)
-        # H0 is extracted from the tail of the Green's function.
-        self._Delta_iw = delta(self._G0_iw)
-        Delta_tau = make_block_gf(GfImTime, self.gf_struct, self.beta)
-        for name, block in self._Delta_iw:
-            Delta_tau[name] << InverseFourier(self._Delta_iw[name])
+        # Delta_tau is a numpy array of shape (n_tau, n_flavor, n_flavor). Indices are ordered as in H0.
+        self._Delta_iw, Delta_tau = compute_delta_tau(self._G0_iw, H0, self.block_names, self.beta, self.n_tau)
 
         # (1c) Set U_{ijkl} for the solver
         # for i, j, k, l in product(range(self.n_flavors), repeat=4):
@@ -138,7 +138,7 @@ class PomerolSolver(SolverBase):
         # Non-interacting part of the local Hamiltonian including chemical potential
         # Make sure H0 is hermite.
         # Ordering of index in H0 is spin1, spin1, ..., spin2, spin2, ...
-        h0_mat = extract_H0(self._G0_iw, self.block_names)
+        h0_mat = extract_H0(self._G0_iw, self.block_names, H_loc=self._H_loc)
 
         with open(file_h0, "w") as f:
             for i, j in product(range(h0_mat.shape[0]), range(h0_mat.shape[1])):
@@ -24,7 +24,7 @@ import os
 import numpy
 
 from pytriqs.applications.impurity_solvers.cthyb import Solver as TRIQSCTHYBSolver
-from .base import rotate_basis, make_h_int
+from .base import rotate_basis, load_or_make_h_int
 
 from pytriqs.archive.hdf_archive import HDFArchive
 import pytriqs.utility.mpi as mpi
@@ -48,6 +48,7 @@ def main(input_file, output_file):
         n_iw = h['n_iw']
         G0_iw = h['G0_iw']
         params = h['params']
+        cache_dir = h['cache_dir'] if 'cache_dir' in h else None
 
     use_spin_orbit = len(gf_struct) == 1
 
@@ -56,7 +57,7 @@ def main(input_file, output_file):
     G0_iw_rot = G0_iw.copy()
     if not rot is None:
         u_mat_rot = rotate_basis(rot, use_spin_orbit, u_mat_rot, Gfs=[G0_iw_rot], direction='forward')
-    h_int = make_h_int(u_mat_rot, gf_struct)
+    h_int = load_or_make_h_int(u_mat_rot, gf_struct, cache_dir, write_cache=mpi.is_master_node())
 
     # Create a working horse
     S = TRIQSCTHYBSolver(beta, gf_struct, n_iw)
@@ -319,6 +319,7 @@ def main(input_file, output_file):
         u_mat = h['u_mat']
         n_iw = h['n_iw']
         G0_iw = h['G0_iw']
+        H_loc = h['H_loc'] if 'H_loc' in h else None
         params = h['params']
 
     use_spin_orbit = len(gf_struct) == 1
@@ -328,7 +329,7 @@ def main(input_file, output_file):
     S = Solver(beta=beta, norb=norb, n_msb=n_iw, use_spin_orbit=use_spin_orbit)
     eal = {}
     for bname, gf in G0_iw:
-        eal[bname] = numpy.array(gf.tail[2])
+        eal[bname] = numpy.array(gf.tail[2]) if H_loc is None else numpy.array(H_loc[bname])
     S.set_atomic_levels(eal)
     umat2 = u_mat[0:norb, 0:norb, 0:norb, 0:norb]
     #print("debug", umat2)
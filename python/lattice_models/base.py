@@ -17,6 +17,7 @@
 #
 from __future__ import print_function
 
+import numpy
 from pytriqs.archive.hdf_archive import HDFArchive
 
 
@@ -49,7 +50,23 @@ class LatticeModel(object):
             spin_orbit == False:
                 Hk for up and down sectors: (complex(num_orb, num_orb), complex(num_orb, num_orb))
         """
-        pass
+        Hk = self.Hk_batch(numpy.asarray(kvec, dtype=float).reshape((1, 3)))
+        if isinstance(Hk, tuple):
+            return tuple(h[0] for h in Hk)
+        else:
+            return Hk[0]
+
+    def Hk_batch(self, kvecs):
+        """
+        kvecs is a 2D array-like object of shape (n_k, 3) (with 2*pi)
+
+        :return:
+            spin_orbit == True:
+                Hk for ud sector: complex(n_k, 2*num_orb, 2*num_orb)
+            spin_orbit == False:
+                Hk for up and down sectors: (complex(n_k, num_orb, num_orb), complex(n_k, num_orb, num_orb))
+        """
+        raise RuntimeError("Hk_batch is not implemented for the model {}".format(self.name()))
 
     def generate_model_file(self):
         pass
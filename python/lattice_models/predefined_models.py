@@ -18,9 +18,7 @@
 from __future__ import print_function
 
 # DO NOT IMPORT GLOBALLY ANY MODULE DEPENDING ON MPI
-import os
 import numpy
-import scipy
 from itertools import product
 from pytriqs.archive.hdf_archive import HDFArchive
 
@@ -59,7 +57,7 @@ def _generate_bethe_lattice_model(norb, t, nk):
 
 def _call_Hk_converter(seedname, nelec, norb, Hk, weight):
     """
-    Compute a list of H(k) for bethe lattice model with t
+    Write H(k) and weights into the dft_input group of seedname.h5
 
     Parameters
     ----------
@@ -72,44 +70,16 @@ def _call_Hk_converter(seedname, nelec, norb, Hk, weight):
     weight : [nkbz] or None
             weight for k
     """
-    from ..converters.hk_converter import HkConverter
+    from ..converters.hk_converter import write_dft_input_from_hk
 
     nkbz = Hk.shape[0]
     #assert nelec <= norb
     assert Hk.shape == (nkbz, norb, norb)
     assert weight is None or weight.shape == (nkbz,)
 
-    use_weight = not weight is None
-
     print("\n    Total number of k =", str(nkbz))
 
-    with open(seedname+'.inp', 'w') as f:
-        #
-        # Write General-Hk formatted file
-        #
-        print(nkbz, file=f)
-        print(nelec, file=f)
-        print("1", file=f)
-        print("0 0 {0} {1}".format(0, norb), file=f)
-        print("1", file=f)
-        print("0 0 {0} {1} 0 0".format(0, norb), file=f)
-        print("1 {0}".format(norb), file=f)
-
-        # Write weight
-        if use_weight:
-            for ik in range(nkbz):
-                print("{0}".format(weight[ik]), file=f)
-
-        # Write H(k)
-        for ik in range(nkbz):
-            for iorb, jorb in product(range(norb), repeat=2):
-                print("{}".format(Hk[ik,iorb,jorb].real), file=f)
-            for iorb, jorb in product(range(norb), repeat=2):
-                print("{}".format(Hk[ik,iorb,jorb].imag), file=f)
-
-    converter = HkConverter(filename=seedname + ".inp", hdf_filename=seedname+".h5")
-    converter.convert_dft_input(weights_in_file=use_weight)
-    os.remove(seedname + ".inp")
+    write_dft_input_from_hk(seedname + '.h5', Hk, nelec, bz_weights=weight)
 
 
 class BetheModel(LatticeModel):
@@ -135,7 +105,7 @@ class BetheModel(LatticeModel):
     def is_Hk_supported(cls):
         return False
 
-    def Hk(self, kvec):
+    def Hk_batch(self, kvecs):
         raise RuntimeError("Hk is ill-defied for BetheModel")
 
     def generate_model_file(self):
@@ -177,57 +147,54 @@ class NNNHoppingModel(LatticeModel):
     def spatial_dim(cls):
         raise RuntimeError("spatial_dim must be inherited in a subclass.")
 
-    def Hk(self, kvec):
+    def Hk_batch(self, kvecs):
         spatial_dim = self.__class__.spatial_dim()
         t = self._params['model']['t']
         tp = self._params['model']["t'"]
         norb = int(self._params['model']['norb'])
 
-        Hk = numpy.zeros((norb, norb), dtype=complex)
+        kvecs = numpy.asarray(kvecs, dtype=float)
+        n_k = kvecs.shape[0]
+        k0, k1, k2 = kvecs[:, 0], kvecs[:, 1], kvecs[:, 2]
         if spatial_dim == 1:
-            ek = 2.0*t*numpy.cos(kvec[0]) + 2*tp*numpy.cos(2.0*kvec[0])
-            for iorb in range(norb):
-                Hk[iorb, iorb] = ek
+            ek = 2.0*t*numpy.cos(k0) + 2*tp*numpy.cos(2.0*k0)
         elif spatial_dim == 2:
-           ek = 2.0*t*(numpy.cos(kvec[0]) + numpy.cos(kvec[1])) \
-                + 2.0*tp*(numpy.cos(kvec[0] + kvec[1]) + numpy.cos(kvec[0] - kvec[1]))
-           for iorb in range(norb):
-               Hk[iorb, iorb] = ek
+            ek = 2.0*t*(numpy.cos(k0) + numpy.cos(k1)) \
+                 + 2.0*tp*(numpy.cos(k0 + k1) + numpy.cos(k0 - k1))
         elif spatial_dim == 3:
-           ek = 2*t*(numpy.cos(kvec[0]) + numpy.cos(kvec[1]) + numpy.cos(kvec[2])) \
-                + 2*tp*(numpy.cos(kvec[0] + kvec[1]) + numpy.cos(kvec[0] - kvec[1])
-                        + numpy.cos(kvec[1] + kvec[2]) + numpy.cos(kvec[1] - kvec[2])
-                        + numpy.cos(kvec[2] + kvec[0]) + numpy.cos(kvec[2] - kvec[0]))
-           for iorb in range(norb):
-               Hk[iorb, iorb] = ek
+            ek = 2*t*(numpy.cos(k0) + numpy.cos(k1) + numpy.cos(k2)) \
+                 + 2*tp*(numpy.cos(k0 + k1) + numpy.cos(k0 - k1)
+                         + numpy.cos(k1 + k2) + numpy.cos(k1 - k2)
+                         + numpy.cos(k2 + k0) + numpy.cos(k2 - k0))
 
+        # The dispersion is diagonal and identical for all orbitals (and spins)
         if self._params['model']['spin_orbit']:
-            return scipy.linalg.block_diag(Hk, Hk)
+            Hk = numpy.zeros((n_k, 2*norb, 2*norb), dtype=complex)
+            Hk[:, numpy.arange(2*norb), numpy.arange(2*norb)] = ek[:, None]
+            return Hk
         else:
-            return (Hk, Hk)
+            Hk = numpy.zeros((n_k, norb, norb), dtype=complex)
+            Hk[:, numpy.arange(norb), numpy.arange(norb)] = ek[:, None]
+            return (Hk, Hk.copy())
 
     def generate_model_file(self):
         p = self._params
         seedname = p['model']['seedname']
         spin_orbit = p['model']['spin_orbit']
-        spatial_dim = self.__class__.spatial_dim()
         norb = int(p['model']['norb'])
         nk = p['model']['nk']
-        nkbz = nk**spatial_dim
-        Hk = numpy.zeros((nkbz, norb, norb), dtype=complex)
         nkdiv = self.nkdiv()
+        kvecs = 2*numpy.pi*numpy.array(list(product(range(nkdiv[0]), range(nkdiv[1]), range(nkdiv[2]))), dtype=float)/float(nk)
 
         # Since Hk_converter does support SO=1, we create a model file for a spinless model.
         if spin_orbit:
-            for ik, (ik0, ik1, ik2) in enumerate(product(range(nkdiv[0]), range(nkdiv[1]), range(nkdiv[2]))):
-                Hk_ud = self.Hk( 2*numpy.pi*numpy.array((ik0, ik1, ik2))/float(nk))
-                assert numpy.allclose(Hk_ud[0:norb, 0:norb], Hk_ud[norb:2*norb, norb:2*norb])
-                Hk[ik, :, :] = Hk_ud[0:norb, 0:norb]
+            Hk_ud = self.Hk_batch(kvecs)
+            assert numpy.allclose(Hk_ud[:, 0:norb, 0:norb], Hk_ud[:, norb:2*norb, norb:2*norb])
+            Hk = Hk_ud[:, 0:norb, 0:norb]
         else:
-            for ik, (ik0, ik1, ik2) in enumerate(product(range(nkdiv[0]), range(nkdiv[1]), range(nkdiv[2]))):
-                Hk_up_down = self.Hk( 2*numpy.pi*numpy.array((ik0, ik1, ik2))/float(nk))
-                assert numpy.allclose(Hk_up_down[0], Hk_up_down[1])
-                Hk[ik, :, :] = Hk_up_down[0]
+            Hk_up_down = self.Hk_batch(kvecs)
+            assert numpy.allclose(Hk_up_down[0], Hk_up_down[1])
+            Hk = Hk_up_down[0]
         _call_Hk_converter(seedname, p['model']['nelec'], int(p['model']['norb']), Hk, None)
 
         if p['model']['spin_orbit']:
@@ -267,12 +234,10 @@ class NNNHoppingModel(LatticeModel):
         n_orbitals = numpy.ones((n_k, n_spin), dtype=int) * dim_Hk
         hopping = numpy.zeros((n_k, n_spin, dim_Hk, dim_Hk), complex)
         if params['model']['spin_orbit']:
-            for ik in range(n_k):
-                hopping[ik, 0, :, :] = self.Hk(kvec[ik])
+            hopping[:, 0, :, :] = self.Hk_batch(kvec)
         else:
-            for ik in range(n_k):
-                # Copy only the up component
-                hopping[ik, 0, :, :] = self.Hk(kvec[ik])[0]
+            # Copy only the up component
+            hopping[:, 0, :, :] = self.Hk_batch(kvec)[0]
 
         #
         # proj_mat is (norb*norb) identities at each correlation shell
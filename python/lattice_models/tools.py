@@ -19,10 +19,39 @@ from __future__ import print_function
 
 import numpy
 import sys
+from itertools import product, permutations
 
 from pytriqs.archive.hdf_archive import HDFArchive
 
-from ..tools import pauli_matrix
+from ..tools import pauli_matrix, input_hash
+
+# Parameters in [model] block which do not affect the one-body part of the model
+_interaction_params = ['interaction', 'density_density', 'kanamori', 'slater_f', 'slater_uj',
+                       'local_potential_matrix', 'local_potential_factor']
+
+
+def one_body_input_hash(params):
+    """
+    Hash of the inputs that determine the one-body part of the model (H(k) and projectors)
+
+    Parameters
+    ----------
+    params : dict
+        Input parameters
+
+    Returns
+    -------
+    hash : str
+    """
+    values = {k: v for k, v in params['model'].items() if k not in _interaction_params}
+    filenames = []
+    if params['model']['lattice'] == 'wannier90':
+        filenames.append(params['model']['seedname'] + '_hr.dat')
+    if params['model']['kmesh_symmetry'] not in ['None', 'auto']:
+        # File of symmetry operations used for reducing the k mesh
+        filenames.append(params['model']['kmesh_symmetry'])
+    return input_hash(values, filenames)
+
 
 def _drop_small_vals(z, eps=1e-10):
     z_real = z.real if numpy.abs(z.real) > eps else 0.0
@@ -44,15 +73,34 @@ def print_spin_orbital_matrix(mat, file, print_offset=0):
             print('', file=file)
         print('', file=file) 
 
-def print_local_fields(h5_file, corr_shell_dims=None, subgrp='dft_input'):
+def _scan_hopping(h5_file, subgrp, bz_weights, max_memory=2**28):
     """
-    Print local fields of H(R=0)
-    :param h5_file: input file for DFTTools
-    :param subgrp:
+    Read H(k) in chunks of k points and compute
+        H0: sum_k w_k H(k) of shape (n_spin_blocks, n, n)
+        herm_diff: max_ij |H(k) - H(k)^dagger| / max_ij |H(k)| of shape (n_k, n_spin_blocks)
+    herm_diff is set to 0 for blocks with max_ij |H(k)| < 1e-8.
     """
+    import h5py
+    from ..tools import float_to_complex_array
+
+    with h5py.File(h5_file, 'r') as f:
+        ds = f[subgrp]['hopping']
+        n_k = ds.shape[0]
+        H0 = numpy.zeros(ds.shape[1:-1], dtype=complex)
+        herm_diff = numpy.zeros(ds.shape[0:2])
+        chunk = max(1, max_memory // (16 * H0.size))
+        for start in range(0, n_k, chunk):
+            end = min(start + chunk, n_k)
+            hk = float_to_complex_array(ds[start:end])
+            H0 += numpy.einsum('kbij,k->bij', hk, bz_weights[start:end])
+            max_val = numpy.amax(numpy.abs(hk), axis=(2, 3))
+            diff = numpy.amax(numpy.abs(hk - hk.conjugate().transpose((0, 1, 3, 2))), axis=(2, 3))
+            herm_diff[start:end] = numpy.where(max_val < 1e-8, 0.0, diff / numpy.maximum(max_val, 1e-8))
+    return H0, herm_diff
+
 
+def _read_local_field_data(h5_file, subgrp):
     with HDFArchive(h5_file, 'r') as f:
-        Hk = f[subgrp]['hopping'][()]
         SO = f[subgrp]['SO']
         SP = f[subgrp]['SP']
         bz_weights = f[subgrp]['bz_weights'][()]
@@ -62,25 +110,23 @@ def print_local_fields(h5_file, corr_shell_dims=None, subgrp='dft_input'):
     if (SO==1 and SP==0) or (SO==0 and SP==1):
         raise RuntimeError("SO={} and SP={} are not supported by DCore!".format(SO, SP))
 
-    nk = Hk.shape[0]
-    spin_block_dim = Hk.shape[2]
+    return SO, bz_weights, dims_corr_sh
+
+
+def _print_local_fields(H0, SO, dims_corr_sh):
+    n_corr_sh = len(dims_corr_sh)
+    spin_block_dim = H0.shape[1]
     if SO==0:
-        Hk_ud = numpy.zeros((nk, 2, spin_block_dim, 2, spin_block_dim), dtype=complex)
+        H0_ud = numpy.zeros((2, spin_block_dim, 2, spin_block_dim), dtype=complex)
         for isp in range(2):
-            Hk_ud[:, isp, :, isp, :] = Hk[:, 0, :, :]
-        Hk_ud = Hk_ud.reshape((nk, 2*spin_block_dim, 2*spin_block_dim))
+            H0_ud[isp, :, isp, :] = H0[0, :, :]
         norb = spin_block_dim
         num_spin_orb_corr_sh = 2*dims_corr_sh
     else:
-        Hk_ud = Hk.reshape((nk, spin_block_dim, spin_block_dim))
         norb = spin_block_dim//2
+        H0_ud = H0.reshape((2, norb, 2, norb))
         num_spin_orb_corr_sh = dims_corr_sh
 
-    # Hk_ud (nk, 2*num_orb, 2*num_orb)
-    # Check only H(R=0)
-    H0_ud = numpy.einsum('kij,k->ij', Hk_ud, bz_weights)
-    H0_ud = H0_ud.reshape((2, norb, 2, norb))
-
     print('')
     print('---local fields (w/o local potential)')
     pauli_mat = pauli_matrix()
@@ -108,3 +154,231 @@ def print_local_fields(h5_file, corr_shell_dims=None, subgrp='dft_input'):
         print('      eigenvalues: ', evals)
         print('')
         offset += block_size
+
+
+def print_local_fields(h5_file, corr_shell_dims=None, subgrp='dft_input'):
+    """
+    Print local fields of H(R=0)
+    :param h5_file: input file for DFTTools
+    :param subgrp:
+    """
+
+    SO, bz_weights, dims_corr_sh = _read_local_field_data(h5_file, subgrp)
+    H0, _ = _scan_hopping(h5_file, subgrp, bz_weights)
+    _print_local_fields(H0, SO, dims_corr_sh)
+
+
+def umat_symmetry_errors(u_mat):
+    """
+    Deviations of a U tensor from the symmetries of
+        H_int = 1/2 sum_{ijkl} U_{ijkl} c^dagger_i c^dagger_j c_l c_k
+    :return: (max_{ijkl} |U_{ijkl} - U_{jilk}|, max_{ijkl} |U_{ijkl} - U_{klij}^*|)
+    """
+    exchange = numpy.amax(numpy.abs(u_mat - u_mat.transpose((1, 0, 3, 2))))
+    hermite = numpy.amax(numpy.abs(u_mat - u_mat.transpose((2, 3, 0, 1)).conjugate()))
+    return exchange, hermite
+
+
+def validate_model_file(h5_file, subgrp='dft_input', max_memory=2**28):
+    """
+    Check the model HDF5 file generated by dcore_pre, reading H(k) only once in chunks of k points:
+    hermiticity of H(k), local fields of H(R=0) and symmetries of the U tensors.
+    Small deviations are reported as warnings. RuntimeError is raised for large ones.
+    """
+
+    SO, bz_weights, dims_corr_sh = _read_local_field_data(h5_file, subgrp)
+    H0, herm_diff = _scan_hopping(h5_file, subgrp, bz_weights, max_memory)
+
+    # Check if H(k) is hermite
+    for ik, ib in numpy.argwhere(herm_diff > 1e-8):
+        message = 'H(k) is not hermite at ik={} and iblock={}, relative diff is {}.' .format(ik, ib, herm_diff[ik, ib])
+        if herm_diff[ik, ib] > 1e-2:
+            raise RuntimeError('Error: {}'.format(message))
+        print('Warning: {}'.format(message))
+
+    _print_local_fields(H0, SO, dims_corr_sh)
+
+    with HDFArchive(h5_file, 'r') as f:
+        u_mat = f['DCore']['Umat'] if 'DCore' in f and 'Umat' in f['DCore'] else []
+    print('---symmetry of U tensors')
+    for ish, u in enumerate(u_mat):
+        exchange, hermite = umat_symmetry_errors(u)
+        print('    shell {} : |U_ijkl - U_jilk| = {:.2e}, |U_ijkl - U_klij^*| = {:.2e}'.format(ish, exchange, hermite))
+        if max(exchange, hermite) > 1e-8:
+            print('Warning: U tensor of shell {} does not have the symmetries of a two-body interaction.'.format(ish))
+    print('')
+
+
+def cubic_point_group():
+    """
+    48 signed permutation matrices (point group O_h in the fractional coordinates of a cubic lattice).
+    They are used as candidates of symmetry operations for kmesh_symmetry = auto.
+    """
+    ops = []
+    for perm in permutations(range(3)):
+        for signs in product([1, -1], repeat=3):
+            op = numpy.zeros((3, 3), dtype=int)
+            op[numpy.arange(3), perm] = signs
+            ops.append(op)
+    return numpy.array(ops)
+
+
+def read_symmetry_ops(filename):
+    """
+    Read point-group operations acting on k in the fractional coordinates.
+    Each line contains the 9 integer elements of a 3x3 matrix (row major).
+    """
+    ops = numpy.loadtxt(filename, dtype=int, ndmin=2)
+    if ops.shape[1] != 9:
+        raise RuntimeError("Each line of {} must contain 9 integers!".format(filename))
+    return ops.reshape((-1, 3, 3))
+
+
+def _kmesh_images(nkdiv, ops):
+    """
+    Index of S k on the regular k mesh (as generated by Wannier90Converter.kmesh_build) for each operation S.
+    Operations which do not map the mesh onto itself are dropped.
+
+    :return: (ops, images) with images[iop, ik]
+    """
+    nkdiv = numpy.array(nkdiv)
+    mesh = numpy.array(list(product(range(nkdiv[0]), range(nkdiv[1]), range(nkdiv[2]))))
+    ops_kept = []
+    images = []
+    for op in ops:
+        # m'_i = sum_j S_ij m_j N_i/N_j must be an integer
+        scaled = op * nkdiv[:, None]
+        if numpy.any(scaled % nkdiv[None, :] != 0):
+            continue
+        m_new = numpy.dot(mesh, (scaled // nkdiv[None, :]).transpose()) % nkdiv[None, :]
+        ops_kept.append(op)
+        images.append(numpy.ravel_multi_index(m_new.transpose(), nkdiv))
+    return numpy.array(ops_kept), numpy.array(images)
+
+
+def irreducible_kmesh(nkdiv, ops, Hk=None, proj_mat=None, tol=1e-8):
+    """
+    Reduce the regular k mesh to the irreducible wedge.
+
+    Only operations S satisfying H(Sk) = H(k) and P(Sk) = P(k) on the mesh are used.
+    Then, G(Sk) = G(k) holds and the k-sum over the irreducible points with the returned weights is exact.
+
+    :param nkdiv: (int, int, int)
+    :param ops: 3D int array (n_ops, 3, 3) acting on k in the fractional coordinates
+    :param Hk: complex array (n_k, ...) or None
+    :param proj_mat: complex array (n_k, ...) or None
+    :param tol: relative tolerance for the invariance of Hk and proj_mat
+    :return: (ops, ik_irr, weights)
+    """
+    ops, images = _kmesh_images(nkdiv, ops)
+
+    def _invariant(data, img):
+        if data is None:
+            return True
+        return numpy.amax(numpy.abs(data[img] - data)) <= tol * max(numpy.amax(numpy.abs(data)), 1.0)
+
+    keep = [iop for iop in range(len(ops)) if _invariant(Hk, images[iop]) and _invariant(proj_mat, images[iop])]
+    ops, images = ops[keep], images[keep]
+
+    # Operations acting identically on the mesh are counted only once
+    _, idx = numpy.unique([img.tobytes() for img in images], return_index=True)
+    idx = numpy.sort(idx)
+    ops, images = ops[idx], images[idx]
+
+    # The operations must form a group. Otherwise, the minimum over the images is not a representative of a star.
+    image_set = set(img.tobytes() for img in images)
+    for img1, img2 in product(images, repeat=2):
+        if not img1[img2].tobytes() in image_set:
+            raise RuntimeError("Symmetry operations do not form a group on the k mesh!")
+
+    rep = numpy.amin(images, axis=0)
+    ik_irr, counts = numpy.unique(rep, return_counts=True)
+    weights = counts / float(images.shape[1])
+
+    return ops, ik_irr, weights
+
+
+def reduce_to_irreducible_kmesh(h5_file, nkdiv, ops, subgrp='dft_input', symmcorr_subgrp='dft_symmcorr_input',
+                                fbz_subgrp='dft_input_fbz'):
+    """
+    Replace the data on the full k mesh by those on the irreducible k points.
+
+    The full-BZ data are kept in fbz_subgrp (used by dcore_bse).
+    The symmetrization data needed by SumkDFT are written into symmcorr_subgrp.
+    Since the operations leave H(k) invariant, they are represented by identity matrices in the correlated shells.
+
+    :param h5_file: model HDF5 file
+    :param nkdiv: (int, int, int)
+    :param ops: candidates of symmetry operations (n_ops, 3, 3)
+    """
+
+    with HDFArchive(h5_file, 'r') as f:
+        data = {key: f[subgrp][key] for key in f[subgrp].keys()}
+
+    n_k = data['n_k']
+    if n_k != numpy.prod(nkdiv):
+        raise RuntimeError("n_k = {} does not match the k mesh {}!".format(n_k, nkdiv))
+    if data['symm_op'] != 0 or not numpy.allclose(data['bz_weights'], 1.0/n_k):
+        raise RuntimeError("The k mesh in {} is already reduced!".format(h5_file))
+
+    # Trivial projectors are stored only for one k point and do not depend on k
+    trivial = data.get('proj_mat_trivial', 0) != 0
+    ops, ik_irr, weights = irreducible_kmesh(nkdiv, ops, data['hopping'], None if trivial else data['proj_mat'])
+    n_symm = len(ops)
+    print("    Number of symmetry operations = {}".format(n_symm))
+    print("    Number of irreducible k points = {} (full mesh: {})".format(len(ik_irr), n_k))
+
+    corr_shells = data['corr_shells']
+    n_atoms = max([crsh['atom'] for crsh in corr_shells]) + 1
+
+    with HDFArchive(h5_file, 'a') as f:
+        if not fbz_subgrp in f:
+            f.create_group(fbz_subgrp)
+        for key, val in data.items():
+            f[fbz_subgrp][key] = val
+
+        f[subgrp]['n_k'] = len(ik_irr)
+        f[subgrp]['bz_weights'] = weights
+        for key in ['hopping', 'n_orbitals'] + ([] if trivial else ['proj_mat']):
+            f[subgrp][key] = data[key][ik_irr]
+        f[subgrp]['symm_op'] = 1
+
+        if not symmcorr_subgrp in f:
+            f.create_group(symmcorr_subgrp)
+        g = f[symmcorr_subgrp]
+        g['n_symm'] = n_symm
+        g['n_atoms'] = n_atoms
+        # Atoms are not moved. SumkDFT looks up perm[isymm][atom-1].
+        g['perm'] = [[(i + 1) % n_atoms for i in range(n_atoms)] for isymm in range(n_symm)]
+        g['orbits'] = corr_shells
+        g['SO'] = data['SO']
+        g['SP'] = data['SP']
+        g['time_inv'] = [0] * n_symm
+        g['mat'] = [[numpy.identity(crsh['dim'], dtype=complex) for crsh in corr_shells] for isymm in range(n_symm)]
+        g['mat_tinv'] = [[numpy.identity(crsh['dim'], dtype=complex) for crsh in corr_shells] for isymm in range(n_symm)]
+        g['ops'] = ops
+
+
+def identity_block_offsets(proj_mat, corr_shells, tol=1e-12):
+    """
+    Check if the projectors of one k point are identity blocks, i.e.,
+    the correlated orbitals of shell icrsh are offset, ..., offset+dim-1 in H(k).
+
+    :param proj_mat: complex array (n_spin_blocks, n_corr_shells, max_dim, n_orb)
+    :param corr_shells: list of dict
+    :return: int array of offsets (n_spin_blocks, n_corr_shells), or None if the projectors are not identity blocks
+    """
+    n_spin, n_corr, _, n_orb = proj_mat.shape
+    offset = numpy.zeros((n_spin, n_corr), dtype=int)
+    for isp, icrsh in product(range(n_spin), range(n_corr)):
+        dim = corr_shells[icrsh]['dim']
+        p = proj_mat[isp, icrsh, :, :]
+        nonzero = numpy.nonzero(numpy.abs(p[0, :]) > tol)[0]
+        if len(nonzero) == 0 or nonzero[0] + dim > n_orb:
+            return None
+        offset[isp, icrsh] = nonzero[0]
+        p_ref = numpy.zeros_like(p)
+        p_ref[0:dim, offset[isp, icrsh]:offset[isp, icrsh]+dim] = numpy.identity(dim)
+        if not numpy.allclose(p, p_ref, rtol=0, atol=tol):
+            return None
+    return offset
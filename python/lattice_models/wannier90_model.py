@@ -22,7 +22,8 @@ import numpy
 from pytriqs.archive.hdf_archive import HDFArchive
 
 from .base import LatticeModel
-from ..converters.wannier90_converter import Wannier90Converter
+from .tools import identity_block_offsets
+from ..converters.wannier90_converter import Wannier90Converter, fourier_interpolate_ham, read_hr_dat
 
 def _generate_w90_converter_input(nkdiv, params, f):
     """
@@ -83,6 +84,21 @@ def _set_nk(nk, nk0, nk1, nk2):
             raise RuntimeError("Some of nk0, nk1 and nk2 are zero!")
     return nk0, nk1, nk2
 
+def _to_dcore_spin_order(proj_mat):
+    """
+    Reorder the basis of projectors from (orb, spin) to (spin, orb) to make them compatible with DCore's block structure
+
+    proj_mat : (n_k, nb, n_corr, max_dim_sh, max_n_orb)
+    """
+    n_k, nb, n_corr, max_dim_sh, max_n_orb = proj_mat.shape
+    assert nb == 1
+    # (n_k, nb, n_corr, orb, spin, orb, spin) => (n_k, nb, n_corr, spin, orb, spin, orb)
+    assert max_dim_sh//2 > 0
+    proj_mat = proj_mat.reshape((n_k, nb, n_corr, max_dim_sh//2, 2, max_n_orb//2, 2))
+    proj_mat = proj_mat.transpose((0, 1, 2, 4, 3, 6, 5))
+    return proj_mat.reshape((n_k, 1, n_corr, max_dim_sh, max_n_orb))
+
+
 class Wannier90Model(LatticeModel):
     def __init__(self, params):
         super(Wannier90Model, self).__init__(params)
@@ -92,7 +108,28 @@ class Wannier90Model(LatticeModel):
                              params["model"]["nk1"],
                              params["model"]["nk2"])
         self._spin_orbit = params['model']['spin_orbit']
+        self._hr = None
 
+    def _read_hr(self):
+        """
+        Read H(R) from seedname_hr.dat only once
+        """
+        if self._hr is None:
+            seedname = self._params['model']['seedname']
+            rvec, rdeg, hamr = read_hr_dat(seedname + "_hr.dat")
+            self._hr = (rvec, rdeg, hamr)
+        return self._hr
+
+    def Hk_batch(self, kvecs):
+        """
+        H(k) in the basis of the Wannier functions (as ordered in seedname_hr.dat)
+        """
+        rvec, rdeg, hamr = self._read_hr()
+        Hk = fourier_interpolate_ham(numpy.asarray(kvecs, dtype=float) / (2 * numpy.pi), rvec, rdeg, hamr)
+        if self._spin_orbit:
+            return Hk
+        else:
+            return (Hk, Hk.copy())
 
     @classmethod
     def name(self):
@@ -110,7 +147,8 @@ class Wannier90Model(LatticeModel):
             _generate_w90_converter_input(self.nkdiv(), p, f)
 
         # Convert General-Hk to SumDFT-HDF5 format
-        converter = Wannier90Converter(seedname=seedname)
+        max_memory = int(p["model"]["max_memory_mb"] * 2**20) if p["model"]["max_memory_mb"] > 0 else None
+        converter = Wannier90Converter(seedname=seedname, max_memory=max_memory)
         converter.convert_dft_input()
 
         if p["model"]["spin_orbit"]:
@@ -124,16 +162,34 @@ class Wannier90Model(LatticeModel):
                 f["dft_input"]["corr_shells"] = corr_shells
 
                 # Make projectors compatible with DCore's block structure
-                # proj_mat (n_k, nb, n_corr, max_dim_sh, max_n_orb)
-                proj_mat = f['dft_input']['proj_mat']
-                n_k, nb, n_corr, max_dim_sh, max_n_orb = proj_mat.shape
-                assert nb == 1
-                # (n_k, nb, n_corr, orb, spin, orb, spin) => (n_k, nb, n_corr, spin, orb, spin, orb)
-                assert max_dim_sh//2 > 0
-                proj_mat = proj_mat.reshape((n_k, nb, n_corr, max_dim_sh//2, 2, max_n_orb//2, 2))
-                proj_mat = proj_mat.transpose((0, 1, 2, 4, 3, 6, 5))
-                proj_mat = proj_mat.reshape((n_k, 1, n_corr, max_dim_sh, max_n_orb))
-                f['dft_input']['proj_mat'] = proj_mat
+                proj_mat = _to_dcore_spin_order(f['dft_input']['proj_mat'])
+                offset = identity_block_offsets(proj_mat[0], corr_shells)
+                n_k = f['dft_input']['n_k']
+                if offset is not None:
+                    f['dft_input']['proj_mat'] = proj_mat
+                    f['dft_input']['proj_mat_offset'] = offset
+                else:
+                    # The reordered projectors are not identity blocks. They are stored for all k points.
+                    del f['dft_input']['proj_mat_trivial']
+                    del f['dft_input']['proj_mat_offset']
+                    del f['dft_input']['proj_mat']
+                    if max_memory is None:
+                        proj_mat = numpy.broadcast_to(proj_mat, (n_k,) + proj_mat.shape[1:])
+                        f['dft_input']['proj_mat'] = numpy.ascontiguousarray(proj_mat)
+
+            if offset is None and max_memory is not None:
+                # proj_mat is written in chunks of k points
+                import h5py
+                from ..tools import complex_to_float_array
+                with h5py.File(seedname + '.h5', 'a') as f:
+                    ds = f['dft_input'].create_dataset('proj_mat', (n_k,) + proj_mat.shape[1:] + (2,), dtype=float)
+                    # complex array in the format of HDFArchive
+                    ds.attrs['__complex__'] = 1
+                    chunk = max(1, max_memory // (16 * proj_mat.size))
+                    for start in range(0, n_k, chunk):
+                        end = min(start + chunk, n_k)
+                        block = numpy.broadcast_to(proj_mat, (end - start,) + proj_mat.shape[1:])
+                        ds[start:end] = complex_to_float_array(numpy.ascontiguousarray(block))
 
 
     def write_dft_band_input_data(self, params, kvec):
@@ -164,26 +220,19 @@ class Wannier90Model(LatticeModel):
             print("     num_spin_orb[{0}] = {1}".format(i, n_spin_orb_sh[i]))
 
         #
-        # Read hopping in the real space from the Wannier90 output
-        #  FIXME: Wannier90Converter may be replaced by an original implementation
+        # Fourier transformation of the one-body Hamiltonian read from the Wannier90 output
         #
         # if spin_orbit == True, nwan must be twice of the number of orbitals in the correlated shells.
         # Otherwise, nwan must be the number of orbitals in the correlated shells.
         #
-        w90c = Wannier90Converter(seedname=seedname)
-        nr, rvec, rdeg, nwan, hamr = w90c.read_wannier90hr(seedname + "_hr.dat")
+        Hk = self.Hk_batch(kvec)
+        if not spin_orbit:
+            Hk = Hk[0]
+        nwan = Hk.shape[1]
 
-
-        #
-        # Fourier transformation of the one-body Hamiltonian
-        #
         nblock = 1
         hopping = numpy.zeros((n_k, nblock, nwan, nwan), complex)
-        for ik in range(n_k):
-            for ir in range(nr):
-                rdotk = numpy.dot(kvec[ik, :], rvec[ir, :])
-                factor = (numpy.cos(rdotk) + 1j * numpy.sin(rdotk)) / float(rdeg[ir])
-                hopping[ik, 0, :, :] += factor * hamr[ir][:, :]
+        hopping[:, 0, :, :] = Hk
 
         #
         # proj_mat is (norb*norb) identities at each correlation shell
@@ -197,9 +246,7 @@ class Wannier90Model(LatticeModel):
 
         # Make proj_mat compatible with DCore's block structure
         if spin_orbit:
-            proj_mat = proj_mat.reshape((n_k, nblock, ncor, numpy.max(dim_Hk)//2, 2, nwan//2, 2))
-            proj_mat = proj_mat.transpose((0, 1, 2, 4, 3, 6, 5))
-            proj_mat = proj_mat.reshape((n_k, nblock, ncor, numpy.max(dim_Hk), nwan))
+            proj_mat = _to_dcore_spin_order(proj_mat)
 
         #
         # Output them into seedname.h5
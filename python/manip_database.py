@@ -156,23 +156,44 @@ class H5SpinOrbitOn:
         return n_orbitals
 
     def proj_mat(self):
+        from .lattice_models.tools import identity_block_offsets
+
         max_n_orbitals = self.max_n_orbitals
         max_corr_shell_dim = self.max_corr_shell_dim
 
-        proj_mat = numpy.zeros((self.nk, 1, self.n_corr_shells, max_corr_shell_dim, max_n_orbitals), dtype=complex)
-        for k in range(self.nk):
-            for j in range(self.n_corr_shells):
-                proj_mat[k, 0, j] \
-                    = expand_block_diag_matrix(self.data['proj_mat'][k, self.sp[0], j], self.data['proj_mat'][k, self.sp[1], j])
+        # Trivial projectors are stored only for one k point
+        proj_mat_in = self.data['proj_mat']
+        nk, dim, n_orb = proj_mat_in.shape[0], proj_mat_in.shape[3], proj_mat_in.shape[4]
+
+        # diag(P_up, P_down) for all k points and shells
+        proj_mat = numpy.zeros((nk, 1, self.n_corr_shells, max_corr_shell_dim, max_n_orbitals), dtype=complex)
+        proj_mat[:, 0, :, 0:dim, 0:n_orb] = proj_mat_in[:, self.sp[0]]
+        proj_mat[:, 0, :, dim:2*dim, n_orb:2*n_orb] = proj_mat_in[:, self.sp[1]]
+
+        self._proj_mat_offset = None
+        if self.data.get('proj_mat_trivial', 0) != 0:
+            self._proj_mat_offset = identity_block_offsets(proj_mat[0], self.corr_shells())
+            if self._proj_mat_offset is None:
+                # diag(P_up, P_down) is not an identity block. Expand it to all k points.
+                proj_mat = numpy.array(numpy.broadcast_to(proj_mat, (self.nk,) + proj_mat.shape[1:]))
         return proj_mat
 
+    def proj_mat_trivial(self):
+        return 0 if self._proj_mat_offset is None else 1
+
+    def proj_mat_offset(self):
+        if self._proj_mat_offset is None:
+            return numpy.zeros((1, self.n_corr_shells), dtype=int)
+        return self._proj_mat_offset
+
     def hopping(self):
         max_n_orbitals = self.max_n_orbitals
 
+        # diag(H_up, H_down) for all k points
+        n_orb = self.data['hopping'].shape[2]
         hopping = numpy.zeros((self.nk, 1, max_n_orbitals, max_n_orbitals), dtype=complex)
-        for k in range(self.nk):
-            hopping[k, 0] \
-                = expand_block_diag_matrix(self.data['hopping'][k, self.sp[0]], self.data['hopping'][k, self.sp[1]])
+        hopping[:, 0, 0:n_orb, 0:n_orb] = self.data['hopping'][:, self.sp[0]]
+        hopping[:, 0, n_orb:2*n_orb, n_orb:2*n_orb] = self.data['hopping'][:, self.sp[1]]
         return hopping
 
     def corr_shells(self):
@@ -211,7 +232,10 @@ def turn_on_spin_orbit(h5_file_in, h5_file_out, update_dft_input=True, update_df
     # 'dft_input'
     h5so = H5SpinOrbitOn(h5_file_in)
     if update_dft_input:
-        for key in ['n_orbitals', 'proj_mat', 'hopping', 'corr_shells', 'shells', 'rot_mat', 'T', 'SP', 'SO']:
+        keys = ['n_orbitals', 'proj_mat', 'hopping', 'corr_shells', 'shells', 'rot_mat', 'T', 'SP', 'SO']
+        if 'proj_mat_trivial' in h5so.data:
+            keys += ['proj_mat_trivial', 'proj_mat_offset']
+        for key in keys:
             h5so.update(key)
         h5so.save(h5_file_out, 'dft_input')
 
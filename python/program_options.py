@@ -30,6 +30,9 @@ def create_parser():
 
     # [mpi]
     parser.add_option("mpi", "command", str, "mpirun -np #", "Command for executing a MPI job. # will be relaced by the number of processes.")
+    parser.add_option("mpi", "scratch_dir", str, "None", "Directory on fast storage where working directories are created. Node-local storage (e.g. $TMPDIR) can be used if all MPI processes run on the node of DCore. Environment variables are expanded. Results are copied back to ./work.")
+    parser.add_option("mpi", "compress_logs", bool, False, "Compress logs with gzip when copying them back from scratch_dir.")
+    parser.add_option("mpi", "shared_memory", bool, False, "Place H(k) and projectors in node-shared memory in SumkDFT (one copy per node). Requires mpi4py and MPI-3.")
 
     # [model]
     parser.add_option("model", "t", float, 1.0, "Transfer integral (Nearest neighbor)")
@@ -48,6 +51,10 @@ def create_parser():
     parser.add_option("model", "nk0", int, 0, "Number of *k* along b_0 (for lattice = wannier90, external)")
     parser.add_option("model", "nk1", int, 0, "Number of *k* along b_1 (for lattice = wannier90, external)")
     parser.add_option("model", "nk2", int, 0, "Number of *k* along b_2 (for lattice = wannier90, external)")
+    parser.add_option("model", "kmesh_symmetry", str, "None",
+                      'Reduce the k mesh to irreducible points (for lattice = chain, square, cubic, wannier90). "None", "auto" (detected from the cubic point group), or a file of point-group operations (9 integers per line).')
+    parser.add_option("model", "max_memory_mb", float, 0.0,
+                      "If positive, hopping is computed and written in chunks of k points using at most about this amount of memory (in MB) at a time (for lattice = wannier90). 0 means no limit.")
     parser.add_option("model", "spin_orbit", bool, False, "Whether the spin-orbit case (See :ref:`pbtutorial`).")
     parser.add_option("model", "interaction", str, "kanamori",
                       'Chosen from "slater_uj", "slater_f", "kanamori", "respack" (See below)')
@@ -84,6 +91,10 @@ def create_parser():
     parser.add_option("control", "initial_static_self_energy", str, "None", "dict of {ish: 'filename'} to specify initial value of the self-energy of ish-th shell. The file format is the same as local_potential_matrix.")
     parser.add_option("control", "initial_self_energy", str, "None", "Filename containing initial self-energy in the same format as sigma.dat generated by dcore_check.")
     parser.add_option("control", "time_reversal", bool, False, "If true, an average over spin components are taken.")
+    parser.add_option("control", "keep_work_dirs", int, -1, "Number of latest iterations whose working directories (work/imp_shell*_ite*) are kept intact. -1 means all.")
+    parser.add_option("control", "keep_work_dirs_every", int, 0, "Working directories of every N-th iteration are also kept intact. 0 disables this.")
+    parser.add_option("control", "prune_work_dirs", str, "delete", "How to prune the other working directories: 'delete', 'delete_inputs' (delete large input files only) or 'archive' (move into work/imp_shell_archive.zip).")
+    parser.add_option("control", "save_Gloc_for_post", bool, False, "If true, Gloc for the final self-energy is computed at the end of dcore (one more k-sum) and saved in the output file so that dcore_post and dcore_bse can reuse it.")
 
     # [tool]
     parser.add_option("tool", "nnode", int, 0, "[NOT USED] Number of node for the *k* path", OptionStatus.RETIRED)
@@ -96,7 +107,9 @@ def create_parser():
     parser.add_option("tool", "broadening", float, 0.1, "An additional Lorentzian broadening")
     parser.add_option("tool", "eta", float, 0.0, "Imaginary frequency shift for the Pade approximation")
     parser.add_option("tool", "omega_pade", float, 5.0, "Cutoff frequencies for the Pade approximation")
+    parser.add_option("tool", "fast_pade", bool, False, "If true, Pade coefficients of all elements of the self-energy are computed at once in double precision, in parallel with num_processes, and cached in seedname.out.h5. Otherwise, set_from_pade of TRIQS (multiprecision) is used.")
     parser.add_option("tool", "omega_check", float, 0, "Maximum frequency for dcore_check. If not specified, a fixed number of Matsubara points are taken.")
+    parser.add_option("tool", "akw_format", str, "txt", "Output format of A(k,w): 'txt' (seedname_akw.dat and seedname_akw.gp for gnuplot), 'h5' (seedname_akw.h5) or 'both'.")
 
     # [bse]
     parser.add_option("bse", "num_wb", int, 0, "Number of bosonic frequencies (>=0)")
@@ -159,5 +172,12 @@ def parse_parameters(params):
     corr_to_inequiv = params['model']['corr_to_inequiv']
     params['model']['norb_corr_sh'] = numpy.array([params['model']['norb_inequiv_sh'][corr_to_inequiv[icrsh]] for icrsh in range(ncor)])
 
+    if params['control']['prune_work_dirs'] not in ['delete', 'delete_inputs', 'archive']:
+        raise RuntimeError("Invalid prune_work_dirs: {}!".format(params['control']['prune_work_dirs']))
+
+    if params['tool']['akw_format'] not in ['txt', 'h5', 'both']:
+        raise RuntimeError("Invalid akw_format: {}!".format(params['tool']['akw_format']))
+
     # Expand enviroment variables
     params['mpi']['command'] = os.path.expandvars(params['mpi']['command'])
+    params['mpi']['scratch_dir'] = os.path.expandvars(params['mpi']['scratch_dir'])
@@ -50,13 +50,20 @@ def read_dft_input_data(file, subgrp, things_to_read):
 class SumkDFTCompat(object):
     """
     Reading data from a SumkDFT HDF5 file
+    Scalars and the shell structure are read at construction.
+    Large arrays (hopping, proj_mat, bz_weights and rot_mat) are read when they are accessed for the first time.
     """
+
+    _lazy_things = ['rot_mat', 'proj_mat', 'bz_weights', 'hopping']
+
     def __init__(self, hdf_file, subgrp='dft_input'):
 
+        self._hdf_file = hdf_file
+        self._subgrp = subgrp
+
         things_to_read = ['energy_unit', 'n_k', 'k_dep_projection', 'SP', 'SO', 'charge_below', 'density_required',
-                          'symm_op', 'n_shells', 'shells', 'n_corr_shells', 'corr_shells', 'use_rotations', 'rot_mat',
-                          'rot_mat_time_inv', 'n_reps', 'dim_reps', 'T', 'n_orbitals', 'proj_mat', 'bz_weights',
-                          'hopping',
+                          'symm_op', 'n_shells', 'shells', 'n_corr_shells', 'corr_shells', 'use_rotations',
+                          'rot_mat_time_inv', 'n_reps', 'dim_reps', 'T', 'n_orbitals',
                           'n_inequiv_shells', 'corr_to_inequiv', 'inequiv_to_corr']
 
         dft_data = read_dft_input_data(hdf_file, subgrp, things_to_read=things_to_read)
@@ -67,8 +74,16 @@ class SumkDFTCompat(object):
         if self.SO != self.SP:
             raise RuntimeError("Not supported SP={} != SO={}.".format(self.SO, self.SP))
 
+    def __getattr__(self, name):
+        # Called only if the attribute has not been set yet
+        if name not in SumkDFTCompat._lazy_things:
+            raise AttributeError("'SumkDFTCompat' object has no attribute '{}'".format(name))
+        value = read_dft_input_data(self._hdf_file, self._subgrp, things_to_read=[name])[name]
+        setattr(self, name, value)
+        return value
 
-def run(model_file, work_dir, mpirun_command, params):
+
+def run(model_file, work_dir, mpirun_command, params, scratch_dir=None, compress_logs=False):
     """
     Runs SumKDFT by launching MPI processes.
 
@@ -80,26 +95,31 @@ def run(model_file, work_dir, mpirun_command, params):
         Command for executing mpi programs
     :param params: dict
         Parameters for SumkDFT
+    :param scratch_dir: str
+        If not None, the working directory is created in scratch_dir and copied back to work_dir.
+    :param compress_logs: bool
+        Compress logs when copying back from scratch_dir
     :return: dict
         results
 
     params contains the following parameters.
-        calc_mode   : str, 'Gloc', 'dos', 'spaghettis' or 'momentum_distribution' (mandatory)
+        calc_mode   : str, 'Gloc', 'post' or 'bse' (mandatory)
+        observables : list of 'dos', 'spaghettis' and 'momentum_distribution' computed in one job (calc_mode = post)
         mu          : float, chemical potential. If mu is not given, mu will be adjusted (optional).
         prec_mu     : float, precision of adjustment of chemical potential (optional)
-        broadening  : float, broadening parameter for DOS (must be set when calc_mode = dos, spaghettis)
+        broadening  : float, broadening parameter for DOS (must be set when observables include dos, spaghettis)
         mesh        : (float, float, int) real-frequency mesh (optional)
 
     """
 
-    from .tools import raise_if_mpi_imported, make_empty_dir
+    from .tools import raise_if_mpi_imported, make_work_dir, copy_back_work_dir
     raise_if_mpi_imported()
 
     # Prepare input files
-    make_empty_dir(work_dir)
+    work_dir_run = make_work_dir(work_dir, scratch_dir)
 
     cwd_org = os.getcwd()
-    os.chdir(work_dir)
+    os.chdir(work_dir_run)
 
     if os.path.exists('./input.h5'):
         os.remove('./input.h5')
@@ -128,9 +148,79 @@ def run(model_file, work_dir, mpirun_command, params):
 
     os.chdir(cwd_org)
 
+    if work_dir_run != work_dir:
+        copy_back_work_dir(work_dir_run, work_dir, exclude=['input.h5'], compress_logs=compress_logs)
+
     return results
 
 
+def _calc_H_loc_sh(sk, params):
+    """
+
+    Compute the non-interacting local Hamiltonian at inequivalent shells from the k-sum
+        H_loc = sum_k w_k P(k) H(k) P(k)^dagger - DC - mu + potential
+    in the local coordinate system.
+    This is exactly the one-body part of G0 fed to impurity solvers,
+    where the static part of the self-energy cancels out.
+    This function depends on MPI through DFTTools.
+
+    """
+
+    import pytriqs.utility.mpi as mpi
+
+    spn = sk.spin_block_names[sk.SO]
+    ntoi = sk.spin_names_to_ind[sk.SO]
+
+    # sum_k w_k P(k) H(k) P(k)^dagger in the global coordinate system
+    H_sum = [{sp: numpy.zeros((sk.corr_shells[icrsh]['dim'], sk.corr_shells[icrsh]['dim']), dtype=complex)
+              for sp in spn} for icrsh in range(sk.n_corr_shells)]
+    ikarray = numpy.array(range(sk.n_k))
+    for ik in mpi.slice_array(ikarray):
+        for sp in spn:
+            ind = ntoi[sp]
+            n_orb = sk.n_orbitals[ik, ind]
+            hk = sk.hopping[ik, ind, 0:n_orb, 0:n_orb]
+            for icrsh in range(sk.n_corr_shells):
+                dim = sk.corr_shells[icrsh]['dim']
+                if getattr(sk, 'proj_mat_trivial', False):
+                    offset = sk.proj_mat_offset[ind, icrsh]
+                    H_sum[icrsh][sp] += sk.bz_weights[ik] * hk[offset:offset+dim, offset:offset+dim]
+                    continue
+                projmat = sk.proj_mat[ik, ind, icrsh, 0:dim, 0:n_orb]
+                H_sum[icrsh][sp] += sk.bz_weights[ik] * numpy.dot(numpy.dot(projmat, hk), projmat.conjugate().transpose())
+
+    for icrsh in range(sk.n_corr_shells):
+        for sp in spn:
+            H_sum[icrsh][sp] = mpi.all_reduce(mpi.world, H_sum[icrsh][sp], lambda x, y: x + y)
+
+    if sk.symm_op != 0:
+        H_sum = sk.symmcorr.symmetrize(H_sum)
+
+    # Rotate to local coordinate system
+    if sk.use_rotations:
+        for icrsh in range(sk.n_corr_shells):
+            for sp in spn:
+                H_sum[icrsh][sp] = numpy.dot(numpy.dot(sk.rot_mat[icrsh].conjugate().transpose(), H_sum[icrsh][sp]),
+                                             sk.rot_mat[icrsh])
+                if sk.rot_mat_time_inv[icrsh] == 1:
+                    H_sum[icrsh][sp] = H_sum[icrsh][sp].conjugate()
+
+    # dc_imp is given in the local coordinate system as in SumkDFT.add_dc
+    if params['with_dc']:
+        for icrsh in range(sk.n_corr_shells):
+            for sp in spn:
+                H_sum[icrsh][sp] = H_sum[icrsh][sp] - params['dc_imp'][icrsh][sp]
+
+    H_loc_sh = []
+    for ish in range(sk.n_inequiv_shells):
+        H_loc = {}
+        for sp in spn:
+            h = H_sum[sk.inequiv_to_corr[ish]][sp]
+            H_loc[sp] = h - params['mu'] * numpy.identity(h.shape[0]) + params['potential'][ish][sp]
+        H_loc_sh.append(H_loc)
+    return H_loc_sh
+
+
 def _main_mpi(model_hdf5_file, input_file, output_file):
     """
 
@@ -178,8 +268,9 @@ def _main_mpi(model_hdf5_file, input_file, output_file):
         sk.set_mu(params['mu'])
 
     if params['calc_mode'] == 'Gloc':
-        from .dft_tools_compat import SumkDFT
-        sk = SumkDFT(hdf_file=model_hdf5_file, use_dft_blocks=False, h_field=0.0)
+        from .sumkdft_dcore import SumkDFTDCore
+        sk = SumkDFTDCore(hdf_file=model_hdf5_file, use_dft_blocks=False, h_field=0.0,
+                          node_shared=params.get('shared_memory', False))
         setup_sk(sk, 'iwn')
         if params['adjust_mu']:
             # find the chemical potential for given density
@@ -194,30 +285,35 @@ def _main_mpi(model_hdf5_file, input_file, output_file):
                 dm[ish][b] = numpy.conj(dm[ish][b])
         results['dm_sh'] = dm
 
-    elif params['calc_mode'] == 'dos':
-        # Compute dos
-        from .sumkdft_post import SumkDFTDCorePost
-        sk = SumkDFTDCorePost(hdf_file=model_hdf5_file, use_dft_blocks=False, h_field=0.0)
-        setup_sk(sk, 'w')
-        results['dos'], results['dosproj'], results['dosproj_orb'] = \
-            sk.dos_wannier_basis(broadening=params['broadening'],
-                             mesh=params['mesh'],
-                             with_Sigma=True, with_dc=with_dc, save_to_file=False)
-
-    elif params['calc_mode'] == 'spaghettis':
-        # A(k, omega)
-        from .sumkdft_post import SumkDFTDCorePost
-        sk = SumkDFTDCorePost(hdf_file=model_hdf5_file, use_dft_blocks=False, h_field=0.0)
-        setup_sk(sk, 'w')
-        results['akw'] = sk.spaghettis(broadening=params['broadening'], plot_range=None, ishell=None, save_to_file=None)
+        # Non-interacting local Hamiltonian of G0
+        results['H_loc_sh'] = _calc_H_loc_sh(sk, dict(params, mu=sk.chemical_potential))
 
-    elif params['calc_mode'] == 'momentum_distribution':
-        # n(k)
+    elif params['calc_mode'] == 'post':
+        # Observables share the loaded model and self-energy in one job
         from .sumkdft_post import SumkDFTDCorePost
-        sk = SumkDFTDCorePost(hdf_file=model_hdf5_file, use_dft_blocks=False, h_field=0.0)
-        setup_sk(sk, 'iwn')
-        results['den'] = \
-            sk.calc_momentum_distribution(mu=params["mu"], beta=beta, with_Sigma=True, with_dc=True)
+        sk = SumkDFTDCorePost(hdf_file=model_hdf5_file, use_dft_blocks=False, h_field=0.0,
+                              node_shared=params.get('shared_memory', False))
+        observables = params['observables']
+
+        if 'dos' in observables or 'spaghettis' in observables:
+            setup_sk(sk, 'w')
+
+        if 'dos' in observables:
+            # Compute dos
+            results['dos'], results['dosproj'], results['dosproj_orb'] = \
+                sk.dos_wannier_basis(broadening=params['broadening'],
+                                 mesh=params['mesh'],
+                                 with_Sigma=True, with_dc=with_dc, save_to_file=False)
+
+        if 'spaghettis' in observables:
+            # A(k, omega)
+            results['akw'] = sk.spaghettis(broadening=params['broadening'], plot_range=None, ishell=None, save_to_file=None)
+
+        if 'momentum_distribution' in observables:
+            # n(k)
+            setup_sk(sk, 'iwn')
+            results['den'] = \
+                sk.calc_momentum_distribution(mu=params["mu"], beta=beta, with_Sigma=True, with_dc=True)
 
     elif params['calc_mode'] == 'bse':
         # chi0
@@ -238,6 +334,9 @@ def _main_mpi(model_hdf5_file, input_file, output_file):
         dft_data_fbz = mpi.bcast(dft_data_fbz)
         sk = SumkDFTChi(hdf_file=model_hdf5_file, use_dft_blocks=False, h_field=0.0,
                         dft_data_fbz=dft_data_fbz)
+        # Expand proj_mat stored only once for trivial projectors
+        from .sumkdft_dcore import init_trivial_projectors
+        init_trivial_projectors(sk)
         setup_sk(sk, 'iwn')
 
         temp_file = None
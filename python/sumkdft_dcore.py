@@ -0,0 +1,361 @@
+#
+# DCore -- Integrated DMFT software for correlated electrons
+# Copyright (C) 2017 The University of Tokyo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+from __future__ import print_function
+
+import numpy
+import h5py
+
+from pytriqs.archive.hdf_archive import HDFArchive
+import pytriqs.utility.mpi as mpi
+
+from .dft_tools_compat import SumkDFT
+from .tools import triqs_major_version, float_to_complex_array
+
+
+class KSlicedArray(object):
+    """
+    Array of which only the k points assigned to this rank by mpi.slice_array are held in memory.
+    It can be indexed with a global k index as a numpy array of shape (n_k, ...).
+    """
+
+    def __init__(self, data, k_start, n_k, name=''):
+        self.data = data
+        self.k_start = k_start
+        self.shape = (n_k,) + data.shape[1:]
+        self.dtype = data.dtype
+        self.name = name
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        ik = key[0]
+        if not isinstance(ik, (int, numpy.integer)):
+            raise RuntimeError("{} is sliced over k points and must be indexed with an integer k index.".format(self.name))
+        if not self.k_start <= ik < self.k_start + self.data.shape[0]:
+            raise RuntimeError("{}[{}] is accessed, but MPI rank {} holds only k points {} to {}. "
+                               "Only k sums over mpi.slice_array(range(n_k)) are supported "
+                               "for k-sliced arrays.".format(self.name, ik, mpi.rank, self.k_start,
+                                                             self.k_start + self.data.shape[0] - 1))
+        return self.data[(ik - self.k_start,) + key[1:]]
+
+
+def local_k_data(a):
+    """
+    Return the k points of an array held by this rank
+    """
+    return a.data if isinstance(a, KSlicedArray) else a
+
+
+def read_k_slice(hdf_file, subgrp, name):
+    """
+    Read the k points assigned to this rank by mpi.slice_array from a dataset of shape (n_k, ...).
+    Every rank reads its own hyperslab.
+    A dataset stored only for one k point (e.g. trivial projectors) is read as it is.
+    """
+
+    with h5py.File(hdf_file, 'r') as f:
+        ds = f[subgrp][name]
+        n_k = ds.shape[0]
+        if n_k == 1:
+            k_start, data = 0, ds[()]
+        else:
+            ik_local = mpi.slice_array(numpy.arange(n_k))
+            k_start = ik_local[0] if len(ik_local) > 0 else 0
+            data = ds[k_start:k_start+len(ik_local)]
+        if '__complex__' in ds.attrs:
+            data = float_to_complex_array(data)
+    if n_k == 1:
+        return data
+    return KSlicedArray(data, k_start, n_k, name)
+
+
+_node_comm = None
+
+
+def _get_node_comm():
+    """
+    Return a communicator of the MPI ranks on the same node (MPI-3 is required)
+    """
+
+    global _node_comm
+    if _node_comm is None:
+        try:
+            from mpi4py import MPI
+        except ImportError:
+            raise RuntimeError("mpi4py is required for shared_memory = True.")
+        _node_comm = MPI.COMM_WORLD.Split_type(MPI.COMM_TYPE_SHARED)
+    return _node_comm
+
+
+def read_node_shared(hdf_file, subgrp, name):
+    """
+    Read a dataset into node-shared memory allocated as an MPI-3 shared window.
+    Only the first rank on each node reads the file. All ranks on the node map the same memory.
+    The returned array is read-only.
+
+    :return: (numpy.ndarray, MPI.Win)
+        The window must be kept alive as long as the array is used.
+        (None, None) is returned if the dataset does not exist.
+    """
+
+    from mpi4py import MPI
+
+    comm = _get_node_comm()
+    shape, is_complex, dtype = None, None, None
+    if comm.rank == 0:
+        with h5py.File(hdf_file, 'r') as f:
+            if name in f[subgrp]:
+                ds = f[subgrp][name]
+                is_complex = '__complex__' in ds.attrs
+                shape = ds.shape[:-1] if is_complex else ds.shape
+                dtype = numpy.dtype(numpy.complex128 if is_complex else ds.dtype)
+    shape, is_complex, dtype = comm.bcast((shape, is_complex, dtype))
+    if shape is None:
+        return None, None
+
+    size = int(numpy.prod(shape))
+    win = MPI.Win.Allocate_shared(size * dtype.itemsize if comm.rank == 0 else 0, dtype.itemsize, comm=comm)
+    buf, _ = win.Shared_query(0)
+    data = numpy.frombuffer(buf, dtype=dtype, count=size).reshape(shape)
+
+    if comm.rank == 0 and size > 0:
+        with h5py.File(hdf_file, 'r') as f:
+            ds = f[subgrp][name]
+            ds.read_direct(data.view(float).reshape(ds.shape) if is_complex else data)
+    comm.Barrier()
+
+    data.flags.writeable = False
+    return data, win
+
+
+def init_trivial_projectors(sk):
+    """
+    Read the trivial-projector flag and the index map written by dcore_pre.
+    If the projectors are trivial, proj_mat is stored only for one k point.
+    It is then expanded to all k points as a read-only view without copying data.
+    """
+
+    trivial, offset = 0, None
+    if mpi.is_master_node():
+        with HDFArchive(sk.hdf_file, 'r') as ar:
+            if 'proj_mat_trivial' in ar[sk.dft_data]:
+                trivial = ar[sk.dft_data]['proj_mat_trivial']
+                offset = ar[sk.dft_data]['proj_mat_offset']
+    sk.proj_mat_trivial = mpi.bcast(trivial) != 0
+    sk.proj_mat_offset = mpi.bcast(offset)
+
+    if sk.proj_mat.shape[0] != sk.n_k:
+        assert sk.proj_mat_trivial and sk.proj_mat.shape[0] == 1
+        sk.proj_mat = numpy.broadcast_to(sk.proj_mat, (sk.n_k,) + sk.proj_mat.shape[1:])
+
+
+def init_spin_blocks(sk):
+    """
+    Detect if H(k) of a spin-orbit model is block diagonal in spin (up block first, then down block).
+    This is the case for models converted by manip_database.turn_on_spin_orbit.
+    """
+
+    sk.hopping_spin_diag = False
+    if sk.SO != 1 or numpy.any(sk.n_orbitals != sk.n_orbitals[0, 0]) or sk.n_orbitals[0, 0] % 2 != 0:
+        return
+    n = sk.n_orbitals[0, 0] // 2
+    hopping = local_k_data(sk.hopping)[:, 0, 0:2*n, 0:2*n]
+    offdiag = 0.0
+    if hopping.shape[0] > 0:
+        offdiag = max(numpy.amax(numpy.abs(hopping[:, 0:n, n:2*n])), numpy.amax(numpy.abs(hopping[:, n:2*n, 0:n])))
+    if isinstance(sk.hopping, KSlicedArray):
+        offdiag = mpi.all_reduce(mpi.world, offdiag, lambda x, y: max(x, y))
+    sk.hopping_spin_diag = bool(offdiag < 1e-12)
+
+
+class SpinBlockMixin(object):
+    """
+    Invert the lattice Green's function block by block if both H(k) and the self-energy
+    do not couple up and down spins in a spin-orbit model.
+    init_spin_blocks must be called at the end of __init__.
+    Only the Matsubara Green's function of TRIQS 2.x is supported. Otherwise, SumkDFT.lattice_gf is used.
+    """
+
+    def read_input_from_hdf(self, subgrp, things_to_read):
+        value_read = super(SpinBlockMixin, self).read_input_from_hdf(subgrp, things_to_read)
+        # e.g. H(k) in dft_bands_input is read by spaghettis
+        if 'hopping' in things_to_read and hasattr(self, 'hopping_spin_diag'):
+            init_spin_blocks(self)
+        return value_read
+
+    def lattice_gf(self, ik, mu=None, iw_or_w="iw", beta=40, broadening=None, mesh=None, with_Sigma=True, with_dc=True):
+        use_blocks = self.hopping_spin_diag and iw_or_w == 'iw' and triqs_major_version >= 2 \
+            and hasattr(self, 'G_latt_iw')
+        if use_blocks:
+            G_latt = self.G_latt_iw
+            if with_Sigma and hasattr(self, 'Sigma_imp_iw'):
+                beta = self.Sigma_imp_iw[0].mesh.beta
+            else:
+                with_Sigma = False
+            n_orb = self.n_orbitals[ik, 0]
+            use_blocks = G_latt.mesh.beta == beta and G_latt['ud'].target_shape[0] == n_orb
+
+        if not use_blocks:
+            return super(SpinBlockMixin, self).lattice_gf(ik, mu, iw_or_w, beta, broadening, mesh, with_Sigma, with_dc)
+
+        if mu is None:
+            mu = self.chemical_potential
+
+        gf = G_latt['ud']
+        if getattr(self, '_iw_cache_beta', None) != beta or len(self._iw_cache) != gf.data.shape[0]:
+            self._iw_cache = numpy.array([complex(x) for x in gf.mesh])
+            self._iw_cache_beta = beta
+
+        # iw + mu - H(k) - h_field - (Sigma - DC)
+        Ginv = -self.hopping[ik, 0, 0:n_orb, 0:n_orb] + (mu + self.h_field) * numpy.identity(n_orb)
+        Ginv = numpy.repeat(Ginv[None, :, :], len(self._iw_cache), axis=0)
+        Ginv[:, numpy.arange(n_orb), numpy.arange(n_orb)] += self._iw_cache[:, None]
+        if with_Sigma:
+            sigma_minus_dc = self.add_dc('iw') if with_dc else self.Sigma_imp_iw
+            for icrsh in range(self.n_corr_shells):
+                Ginv -= self.upfold(ik, icrsh, 'ud', sigma_minus_dc[icrsh]['ud'], gf).data
+
+        n = n_orb // 2
+        eps = 1e-12 * numpy.amax(numpy.abs(Ginv))
+        if numpy.amax(numpy.abs(Ginv[:, 0:n, n:])) <= eps and numpy.amax(numpy.abs(Ginv[:, n:, 0:n])) <= eps:
+            gf.data[...] = 0.0
+            gf.data[:, 0:n, 0:n] = numpy.linalg.inv(Ginv[:, 0:n, 0:n])
+            gf.data[:, n:, n:] = numpy.linalg.inv(Ginv[:, n:, n:])
+        else:
+            gf.data[...] = numpy.linalg.inv(Ginv)
+        return G_latt
+
+
+class TrivialProjectorMixin(object):
+    """
+    Use slicing instead of matrix products for projections onto correlated shells
+    if the projectors are k-independent identity blocks.
+    init_trivial_projectors must be called at the end of __init__.
+    """
+
+    def read_input_from_hdf(self, subgrp, things_to_read):
+        value_read = super(TrivialProjectorMixin, self).read_input_from_hdf(subgrp, things_to_read)
+        # e.g. dft_bands_input is read by spaghettis
+        if 'proj_mat' in things_to_read and subgrp != self.dft_data:
+            self.proj_mat_trivial = False
+        return value_read
+
+    def downfold(self, ik, ish, bname, gf_to_downfold, gf_inp, shells='corr', ir=None):
+        if not self.proj_mat_trivial or shells != 'corr' or ir is not None:
+            return super(TrivialProjectorMixin, self).downfold(ik, ish, bname, gf_to_downfold, gf_inp, shells, ir)
+
+        isp = self.spin_names_to_ind[self.SO][bname]
+        dim = self.corr_shells[ish]['dim']
+        offset = self.proj_mat_offset[isp, ish]
+        gf_downfolded = gf_inp.copy()
+        gf_downfolded << gf_to_downfold[offset:offset+dim, offset:offset+dim]
+        return gf_downfolded
+
+    def upfold(self, ik, ish, bname, gf_to_upfold, gf_inp, shells='corr', ir=None):
+        if not self.proj_mat_trivial or shells != 'corr' or ir is not None:
+            return super(TrivialProjectorMixin, self).upfold(ik, ish, bname, gf_to_upfold, gf_inp, shells, ir)
+
+        isp = self.spin_names_to_ind[self.SO][bname]
+        dim = self.corr_shells[ish]['dim']
+        offset = self.proj_mat_offset[isp, ish]
+        gf_upfolded = gf_inp.copy()
+        gf_upfolded.zero()
+        gf_upfolded[offset:offset+dim, offset:offset+dim] << gf_to_upfold
+        return gf_upfolded
+
+
+class KSliceMixin(object):
+    """
+    Each MPI rank reads only its share of hopping and proj_mat in dft_input.
+    The k sums in SumkDFT used by DCore (e.g. extract_G_loc, density_matrix, total_density)
+    loop over mpi.slice_array(range(n_k)) and are followed by a global reduction,
+    so that every rank accesses only the k points it holds.
+    Methods looping over all k points on every rank (eff_atomic_levels, check_projectors) are not supported
+    and raise RuntimeError, as does any access to a k point not held by the rank.
+    Other subgroups (e.g. dft_bands_input) are read as a whole.
+    """
+
+    def read_input_from_hdf(self, subgrp, things_to_read):
+        if subgrp != self.dft_data:
+            return super(KSliceMixin, self).read_input_from_hdf(subgrp, things_to_read)
+
+        sliced = [it for it in ['hopping', 'proj_mat'] if it in things_to_read]
+        value_read = super(KSliceMixin, self).read_input_from_hdf(subgrp, [it for it in things_to_read if it not in sliced])
+        for it in sliced:
+            setattr(self, it, read_k_slice(self.hdf_file, subgrp, it))
+        return value_read
+
+    def _check_all_k_held(self, method):
+        arrays = [getattr(self, it, None) for it in ['hopping', 'proj_mat']]
+        if any(isinstance(a, KSlicedArray) and a.data.shape[0] < a.shape[0] for a in arrays):
+            raise RuntimeError("{} needs all k points on every MPI rank, but H(k) and projectors are "
+                               "distributed over MPI ranks.".format(method))
+
+    def eff_atomic_levels(self):
+        self._check_all_k_held('eff_atomic_levels')
+        return super(KSliceMixin, self).eff_atomic_levels()
+
+    def check_projectors(self):
+        self._check_all_k_held('check_projectors')
+        return super(KSliceMixin, self).check_projectors()
+
+
+class NodeSharedMixin(object):
+    """
+    Place large read-only arrays (H(k) and projectors) in node-shared memory if node_shared is True.
+    One copy per node is shared by all MPI ranks on the node.
+    node_shared must be set before SumkDFT.__init__ is called.
+    The window of an array is freed when the array is read again (e.g. from dft_bands_input).
+    Arrays read before must not be used after that.
+    """
+
+    _shared_things = ['hopping', 'proj_mat', 'proj_mat_all']
+
+    def read_input_from_hdf(self, subgrp, things_to_read):
+        if not getattr(self, 'node_shared', False):
+            return super(NodeSharedMixin, self).read_input_from_hdf(subgrp, things_to_read)
+
+        shared = [it for it in self._shared_things if it in things_to_read]
+        value_read = super(NodeSharedMixin, self).read_input_from_hdf(subgrp, [it for it in things_to_read if it not in shared])
+        if not hasattr(self, '_shared_windows'):
+            self._shared_windows = {}
+        for it in shared:
+            data, win = read_node_shared(self.hdf_file, subgrp, it)
+            if data is None:
+                mpi.report("Loading failed: No %s subgroup in hdf5!" % it)
+                value_read = False
+                continue
+            setattr(self, it, data)
+            # e.g. H(k) in dft_input is replaced by that in dft_bands_input
+            old_win = self._shared_windows.pop(it, None)
+            if not old_win is None:
+                old_win.Free()
+            self._shared_windows[it] = win
+        return value_read
+
+
+class SumkDFTDCore(TrivialProjectorMixin, SpinBlockMixin, NodeSharedMixin, KSliceMixin, SumkDFT):
+    """
+    SumkDFT with shortcuts for the model HDF5 files generated by dcore_pre
+    """
+
+    def __init__(self, hdf_file, node_shared=False, **kwargs):
+        self.node_shared = node_shared
+        SumkDFT.__init__(self, hdf_file=hdf_file, **kwargs)
+        init_trivial_projectors(self)
+        init_spin_blocks(self)
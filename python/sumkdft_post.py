@@ -21,9 +21,10 @@ from __future__ import print_function
 import numpy
 
 from .dft_tools_compat import SumkDFTTools
+from .sumkdft_dcore import TrivialProjectorMixin, SpinBlockMixin, NodeSharedMixin, KSliceMixin, init_trivial_projectors, init_spin_blocks
 import pytriqs.utility.mpi as mpi
 
-class SumkDFTDCorePost(SumkDFTTools):
+class SumkDFTDCorePost(TrivialProjectorMixin, SpinBlockMixin, NodeSharedMixin, KSliceMixin, SumkDFTTools):
     """
 
     Extends the SumkDFTTools class with some tools for postprocessing in DCore.
@@ -32,16 +33,20 @@ class SumkDFTDCorePost(SumkDFTTools):
 
     def __init__(self, hdf_file, h_field=0.0, use_dft_blocks=False, dft_data='dft_input', symmcorr_data='dft_symmcorr_input',
                  parproj_data='dft_parproj_input', symmpar_data='dft_symmpar_input', bands_data='dft_bands_input',
-                 transp_data='dft_transp_input', misc_data='dft_misc_input'):
+                 transp_data='dft_transp_input', misc_data='dft_misc_input', node_shared=False):
 
         """
         Initialisation of the class. Parameters are exactly as for SumKDFT.
+        If node_shared is True, H(k) and projectors are placed in node-shared memory.
         """
 
+        self.node_shared = node_shared
         SumkDFTTools.__init__(self, hdf_file=hdf_file, h_field=h_field, use_dft_blocks=use_dft_blocks,
                          dft_data=dft_data, symmcorr_data=symmcorr_data, parproj_data=parproj_data,
                          symmpar_data=symmpar_data, bands_data=bands_data, transp_data=transp_data,
                          misc_data=misc_data)
+        init_trivial_projectors(self)
+        init_spin_blocks(self)
 
     def calc_momentum_distribution(self, mu, beta, with_Sigma, with_dc):
         things_to_read = ['n_k', 'n_orbitals', 'proj_mat',
@@ -24,6 +24,8 @@ import shlex
 import subprocess
 from itertools import *
 import ast
+import threading
+import traceback
 
 from pytriqs.utility.h5diff import compare, failures
 from pytriqs.utility.h5diff import h5diff as h5diff_org
@@ -144,8 +146,12 @@ def extract_H0_from_tail(G0_iw):
     else:
         raise RuntimeError('extract_H0_from_tail does not support type {}'.format(type(G0_iw)))
 
-def compute_diag_basis(G0_iw):
-    H_loc0 = extract_H0_from_tail(G0_iw)
+def compute_diag_basis(G0_iw, H_loc=None):
+    """
+    Compute unitary matrices diagonalizing the non-interacting local Hamiltonian.
+    If H_loc (dict of matrices) is given, it is used instead of a tail fit of G0_iw.
+    """
+    H_loc0 = extract_H0_from_tail(G0_iw) if H_loc is None else H_loc
     rot = {}
     for sp in H_loc0.keys():
         eigval, rot[sp] = numpy.linalg.eigh(H_loc0[sp])
@@ -213,14 +219,16 @@ def launch_mpi_subprocesses(mpirun_command, rest_commands, output_file):
         print("Command: ", ' '.join(commands))
         raise RuntimeError("Error occurred while executing MPI program! Output messages may be found in {}!".format(os.path.abspath(output_file.name)))
 
-def extract_H0(G0_iw, block_names, hermitianize=True):
+def extract_H0(G0_iw, block_names, hermitianize=True, H_loc=None):
     """
     Extract non-interacting Hamiltonian elements from G0_iw
+
+    If H_loc (dict of matrices) is given, it is used instead of a tail fit of G0_iw.
     """
 
     assert isinstance(block_names, list)
 
-    H0_dict  = extract_H0_from_tail(G0_iw)
+    H0_dict = extract_H0_from_tail(G0_iw) if H_loc is None else H_loc
     H0 = [H0_dict[b] for b in block_names]
 
     n_spin_orb = numpy.sum([b.shape[0] for b in H0])
@@ -552,6 +560,249 @@ def make_empty_dir(dir_path):
     os.makedirs(dir_path)
 
 
+class _BackgroundTask(threading.Thread):
+    """
+    Thread running a function in background.
+    An exception raised in the function is re-raised as RuntimeError by join_and_raise.
+    """
+
+    def __init__(self, func, description):
+        super(_BackgroundTask, self).__init__()
+        self._func = func
+        self._description = description
+        self._traceback = None
+
+    def run(self):
+        try:
+            self._func()
+        except Exception:
+            self._traceback = traceback.format_exc()
+
+    def join_and_raise(self):
+        self.join()
+        if not self._traceback is None:
+            raise RuntimeError("{} failed in background!\n{}".format(self._description, self._traceback))
+
+
+# Background threads copying scratch working directories back (key: absolute path of destination)
+_copy_back_threads = {}
+
+# Per-process directories created in scratch directories
+_scratch_roots = set()
+
+
+def _wait_copy_back(dir_path):
+    t = _copy_back_threads.pop(os.path.abspath(dir_path), None)
+    if not t is None:
+        t.join_and_raise()
+
+
+def make_work_dir(work_dir, scratch_dir=None):
+    """
+
+    Prepare an empty working directory.
+
+    If scratch_dir is given (e.g. node-local storage), the directory is created
+    under scratch_dir instead of work_dir. Use copy_back_work_dir to bring results back to work_dir.
+
+    Parameters
+    ----------
+    work_dir : str
+        Path to a working directory
+    scratch_dir : str or None
+        Path to a scratch directory
+
+    Returns
+    -------
+    Path to the directory where the actual work is done
+
+    """
+
+    if scratch_dir is None:
+        make_empty_dir(work_dir)
+        return work_dir
+
+    # A previous copy to the same destination must be completed.
+    _wait_copy_back(work_dir)
+
+    if not os.path.isdir(scratch_dir):
+        raise RuntimeError("Scratch directory {} does not exist!".format(scratch_dir))
+    root = os.path.abspath(os.path.join(scratch_dir, 'dcore_{}'.format(os.getpid())))
+    _scratch_roots.add(root)
+    path = os.path.join(root, os.path.abspath(work_dir).lstrip(os.sep))
+    make_empty_dir(path)
+    return path
+
+
+def copy_back_work_dir(scratch_work_dir, work_dir, exclude=[], compress_logs=False):
+    """
+
+    Copy files in a scratch working directory back to work_dir and remove the scratch directory.
+    Copying is done in a background thread.
+    If copying fails, the scratch directory is kept and the error is raised
+    when the copy is waited for (see wait_work_dir_tasks).
+
+    Parameters
+    ----------
+    scratch_work_dir : str
+        Path returned by make_work_dir
+    work_dir : str
+        Destination
+    exclude : list of str
+        Names of files not to be copied (e.g. large input files)
+    compress_logs : bool
+        Compress log files ('output' and '*.log') with gzip
+
+    """
+    import shutil
+    import gzip
+
+    src = os.path.abspath(scratch_work_dir)
+    dst = os.path.abspath(work_dir)
+
+    def _copy():
+        make_empty_dir(dst)
+        for root, dirs, files in os.walk(src):
+            dst_root = os.path.normpath(os.path.join(dst, os.path.relpath(root, src)))
+            if not os.path.isdir(dst_root):
+                os.makedirs(dst_root)
+            for f in files:
+                if f in exclude:
+                    continue
+                if compress_logs and (f == 'output' or f.endswith('.log')):
+                    with open(os.path.join(root, f), 'rb') as f_in, gzip.open(os.path.join(dst_root, f + '.gz'), 'wb') as f_out:
+                        shutil.copyfileobj(f_in, f_out)
+                else:
+                    shutil.copy2(os.path.join(root, f), dst_root)
+        shutil.rmtree(src)
+
+    _wait_copy_back(dst)
+    t = _BackgroundTask(_copy, "Copying {} back to {}".format(src, dst))
+    t.start()
+    _copy_back_threads[dst] = t
+
+
+# Background thread pruning working directories
+_prune_thread = []
+
+
+def _wait_prune():
+    if _prune_thread:
+        _prune_thread.pop().join_and_raise()
+
+
+def wait_work_dir_tasks():
+    """
+    Wait for all background copies and pruning of working directories to complete
+    and remove per-process directories left in scratch directories.
+    RuntimeError is raised if any of them failed.
+    """
+    import shutil
+
+    _wait_prune()
+    for dst in list(_copy_back_threads.keys()):
+        _wait_copy_back(dst)
+    for root in list(_scratch_roots):
+        if os.path.isdir(root):
+            shutil.rmtree(root)
+        _scratch_roots.discard(root)
+
+
+def work_dirs_to_prune(iteration_number, n_inequiv_shells, keep_last, keep_every, first_iteration=1):
+    """
+
+    List existing working directories of impurity solvers (work/imp_shell*_ite*) to be pruned at iteration_number.
+    Those of the latest keep_last iterations and of every keep_every-th iteration are kept.
+
+    Parameters
+    ----------
+    iteration_number : int
+        Current iteration
+    n_inequiv_shells : int
+        Number of inequivalent shells
+    keep_last : int
+        Number of latest iterations to be kept
+    keep_every : int
+        Every keep_every-th iteration is kept (0 disables this)
+    first_iteration : int
+        Iterations before first_iteration are regarded as pruned already
+
+    Returns
+    -------
+    List of paths to working directories
+
+    """
+    dirs = []
+    for ite in range(first_iteration, iteration_number - keep_last + 1):
+        if keep_every > 0 and ite % keep_every == 0:
+            continue
+        for ish in range(n_inequiv_shells):
+            work_dir = 'work/imp_shell'+str(ish)+'_ite'+str(ite)
+            if os.path.isdir(work_dir):
+                dirs.append(work_dir)
+    return dirs
+
+
+def prune_work_dirs(dirs, policy, large_files=[], archive_file=None):
+    """
+
+    Prune working directories in a background thread.
+    A call waits for completion of the previous pruning and raises RuntimeError if it failed.
+    Call wait_work_dir_tasks to wait for the last one.
+
+    Parameters
+    ----------
+    dirs : list of str
+        Paths to working directories
+    policy : str
+        'delete' : remove the directories
+        'delete_inputs' : remove files whose names are in large_files
+        'archive' : move the directories into a zip archive
+    large_files : list of str
+        Names of large input files
+    archive_file : str
+        Path to the zip archive (must be set for policy = 'archive')
+
+    """
+    import shutil
+    import zipfile
+
+    if not policy in ['delete', 'delete_inputs', 'archive']:
+        raise RuntimeError("Unknown policy for pruning working directories: " + policy)
+    if policy == 'archive' and archive_file is None:
+        raise RuntimeError("archive_file must be set!")
+
+    dirs = [os.path.abspath(d) for d in dirs]
+    if not archive_file is None:
+        archive_file = os.path.abspath(archive_file)
+
+    def _prune():
+        for d in dirs:
+            # Wait until results are copied back from a scratch directory
+            _wait_copy_back(d)
+            if not os.path.isdir(d):
+                continue
+            if policy == 'delete':
+                shutil.rmtree(d)
+            elif policy == 'delete_inputs':
+                for f in large_files:
+                    if os.path.isfile(os.path.join(d, f)):
+                        os.remove(os.path.join(d, f))
+            elif policy == 'archive':
+                base_dir = os.path.dirname(d)
+                with zipfile.ZipFile(archive_file, 'a', zipfile.ZIP_DEFLATED, allowZip64=True) as z:
+                    for root, _, files in os.walk(d):
+                        for f in files:
+                            path = os.path.join(root, f)
+                            z.write(path, os.path.relpath(path, base_dir))
+                shutil.rmtree(d)
+
+    _wait_prune()
+    t = _BackgroundTask(_prune, "Pruning working directories")
+    t.start()
+    _prune_thread.append(t)
+
+
 def make_hermite_conjugate(Sigma_iw, check_only=False):
     """
     Make Sigma(iw_n) or G(iwn_n) hermite
@@ -573,3 +824,155 @@ def make_hermite_conjugate(Sigma_iw, check_only=False):
     return max_diff
 
 
+
+
+def _to_hashable(obj):
+    if isinstance(obj, dict):
+        return tuple((k, _to_hashable(obj[k])) for k in sorted(obj.keys()))
+    if isinstance(obj, numpy.ndarray):
+        import hashlib
+        return (obj.shape, obj.dtype.str, hashlib.sha1(numpy.ascontiguousarray(obj).tobytes()).hexdigest())
+    if isinstance(obj, (list, tuple)):
+        return tuple(_to_hashable(x) for x in obj)
+    return obj
+
+
+def input_hash(values, filenames=[]):
+    """
+    Compute a SHA-1 hash of input parameters and the contents of input files
+
+    Parameters
+    ----------
+    values : dict, list or scalar
+        Parameters (nested dicts, lists and numpy arrays are allowed).
+        A numpy array and a list of the same values give different hashes.
+    filenames : list of str
+        Input files. Missing files are ignored.
+
+    Returns
+    -------
+    hash : str
+    """
+    import hashlib
+
+    h = hashlib.sha1()
+    h.update(repr(_to_hashable(values)).encode())
+    for filename in filenames:
+        if not os.path.exists(filename):
+            continue
+        h.update(filename.encode())
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def read_input_hash(h5_file, path):
+    """
+    Read the hash of the inputs from which the group (or dataset) at path was generated.
+    Return None if the file, the group or the hash does not exist.
+    """
+    import h5py
+
+    if not os.path.exists(h5_file):
+        return None
+    with h5py.File(h5_file, 'r') as f:
+        if path not in f or 'dcore_input_hash' not in f[path].attrs:
+            return None
+        value = f[path].attrs['dcore_input_hash']
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def write_input_hash(h5_file, path, hash):
+    """
+    Store the hash of the inputs from which the group (or dataset) at path was generated.
+    """
+    import h5py
+
+    with h5py.File(h5_file, 'a') as f:
+        f[path].attrs['dcore_input_hash'] = numpy.bytes_(hash.encode())
+
+
+def pade_coefficients(z, u):
+    """
+    Compute the coefficients of Pade approximants by the Vidberg-Serene algorithm (as in TRIQS).
+    Many approximants sharing the input points are computed at once.
+    Unlike TRIQS, which uses multiprecision arithmetic (GMP), the recursion runs in double precision.
+    For noisy input with many points, the results may thus differ from those of TRIQS.
+
+    Parameters
+    ----------
+    z : 1D array of complex
+        Input points (e.g. positive Matsubara frequencies)
+    u : array of complex, shape (len(z), ...)
+        Values at z
+
+    Returns
+    -------
+    a : array of complex, same shape as u
+        Coefficients of the continued fraction. Non-finite coefficients are set to 0.
+    """
+    z = numpy.asarray(z, dtype=complex)
+    g = numpy.array(u, dtype=complex)
+    n = len(z)
+    a = numpy.empty_like(g)
+    a[0] = g[0]
+    dz_shape = (-1,) + (1,) * (g.ndim - 1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for p in range(1, n):
+            # g[j] holds g(p-1, j) for j >= p-1
+            g[p:] = (g[p-1] / g[p:] - 1.0) / (z[p:] - z[p-1]).reshape(dz_shape)
+            a[p] = g[p]
+    a[~numpy.isfinite(a)] = 0.0
+    return a
+
+
+def pade_evaluate(z, a, e):
+    """
+    Evaluate Pade approximants at complex points e.
+
+    Parameters
+    ----------
+    z : 1D array of complex
+        Input points used in pade_coefficients
+    a : array of complex, shape (len(z), ...)
+        Coefficients computed by pade_coefficients
+    e : 1D array of complex
+        Points where the approximants are evaluated (e.g. omega + i eta)
+
+    Returns
+    -------
+    values : array of complex, shape (len(e), ...)
+    """
+    e = numpy.asarray(e, dtype=complex).reshape((-1,) + (1,) * (a.ndim - 1))
+    A1, A2 = numpy.zeros_like(e * a[0]), e * 0 + a[0]
+    B1, B2 = numpy.ones_like(A1), numpy.ones_like(A1)
+    for i in range(len(z) - 1):
+        c = (e - z[i]) * a[i + 1]
+        A1, A2 = A2, A2 + c * A1
+        B1, B2 = B2, B2 + c * B1
+    return A2 / B2
+
+
+def _pade_coefficients_args(args):
+    return pade_coefficients(*args)
+
+
+def pade_coefficients_parallel(z, u, n_procs=1):
+    """
+    pade_coefficients distributed over a pool of n_procs processes.
+    The approximants (trailing axes of u) are divided into n_procs chunks.
+    """
+    if n_procs <= 1:
+        return pade_coefficients(z, u)
+
+    import multiprocessing
+    u2 = numpy.asarray(u, dtype=complex).reshape((len(z), -1))
+    chunks = [c for c in numpy.array_split(numpy.arange(u2.shape[1]), n_procs) if len(c) > 0]
+    pool = multiprocessing.Pool(len(chunks))
+    try:
+        a_chunks = pool.map(_pade_coefficients_args, [(z, u2[:, c]) for c in chunks])
+    finally:
+        pool.close()
+        pool.join()
+    return numpy.hstack(a_chunks).reshape(numpy.shape(u))
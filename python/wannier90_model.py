@@ -23,7 +23,7 @@ import numpy
 import sys
 import re
 
-from converters.wannier90_converter import Wannier90Converter
+from converters.wannier90_converter import Wannier90Converter, fourier_interpolate_ham
 from pytriqs.archive import HDFArchive
 import pytriqs.utility.mpi as mpi
 
@@ -68,11 +68,7 @@ def __generate_wannier90_model(seedname, ncor, norb, n_k, kvec):
     #
     n_orbitals = numpy.ones([n_k, n_spin], numpy.int) * nwan
     hopping = numpy.zeros([n_k, n_spin, numpy.max(n_orbitals), numpy.max(n_orbitals)], numpy.complex_)
-    for ik in range(n_k):
-        for ir in range(nr):
-            rdotk = numpy.dot(kvec[ik, :], rvec[ir, :])
-            factor = (numpy.cos(rdotk) + 1j * numpy.sin(rdotk)) / float(rdeg[ir])
-            hopping[ik, 0, :, :] += factor * hamr[ir][:, :]
+    hopping[:, 0, :, :] = fourier_interpolate_ham(kvec / (2 * numpy.pi), rvec, rdeg, hamr)
     #
     # proj_mat is (norb*norb) identities at each correlation shell
     #
@@ -20,6 +20,7 @@ from __future__ import print_function
 import glob
 import re
 import os
+import h5py
 from dcore.tools import h5diff
 from dcore.numdiff import numdiff
 from dcore.dcore_pre import dcore_pre
@@ -29,8 +30,115 @@ from dcore.dcore_post import dcore_post
 seedname = 'test'
 dcore_pre('dmft.ini')
 dcore('dmft.ini')
+
+
+def write_ini(filename, options):
+    """
+    Write a copy of dmft.ini with options {(section, name): value} set
+    """
+    try:
+        from configparser import ConfigParser
+    except ImportError:
+        from ConfigParser import ConfigParser
+
+    config = ConfigParser()
+    config.optionxform = str
+    config.read('dmft.ini')
+    for (section, name), value in options.items():
+        config.set(section, name, str(value))
+    with open(filename, 'w') as f:
+        config.write(f)
+
+
+def test_saved_Gloc():
+    """
+    By default, dcore saves Gloc of the last iteration, which does not match the final self-energy.
+    With save_Gloc_for_post, Gloc saved at the end of dcore is loaded in read-only mode
+    and agrees with Gloc computed again.
+    """
+    import numpy
+    from dcore.program_options import create_parser, parse_parameters
+    from dcore.dmft_core import DMFTCoreSolver
+
+    def make_solver(ini_file, name):
+        pars = create_parser()
+        pars.read(ini_file)
+        params = pars.as_dict()
+        parse_parameters(params)
+        params['control']['restart'] = True
+        params['mpi']['num_processes'] = 1
+        return DMFTCoreSolver(name, params, read_only=True)
+
+    with h5py.File(seedname + '.out.h5', 'r') as f:
+        assert 'dmft_out/Gloc' in f
+    assert make_solver('dmft.ini', seedname)._load_Gloc() is None
+
+    seedname_save = 'test_save_Gloc'
+    write_ini('dmft_save_Gloc.ini', {('model', 'seedname'): seedname_save, ('control', 'save_Gloc_for_post'): True})
+    dcore_pre('dmft_save_Gloc.ini')
+    dcore('dmft_save_Gloc.ini')
+    solver = make_solver('dmft_save_Gloc.ini', seedname_save)
+
+    r = solver._load_Gloc()
+    assert r is not None
+    Gloc_saved, dm_saved = r
+    H_loc_saved = solver._H_loc_sh
+
+    # Compute Gloc again (it is saved again)
+    with h5py.File(seedname_save + '.out.h5', 'a') as f:
+        del f['dmft_out/Gloc']
+    assert solver._load_Gloc() is None
+    Gloc, dm = solver.calc_Gloc()
+
+    Gloc_loaded, dm_loaded = solver._load_Gloc()
+    for ish in range(solver.n_inequiv_shells):
+        for bname, g in Gloc[ish]:
+            assert numpy.allclose(g.data, Gloc_saved[ish][bname].data)
+            assert numpy.allclose(g.data, Gloc_loaded[ish][bname].data)
+        for sp in dm[ish]:
+            assert numpy.allclose(dm[ish][sp], dm_saved[ish][sp])
+            assert numpy.allclose(dm[ish][sp], dm_loaded[ish][sp])
+            assert numpy.allclose(solver._H_loc_sh[ish][sp], H_loc_saved[ish][sp])
+
+test_saved_Gloc()
+
 dcore_post('dmft.ini')
 
+
+def test_cached_Sigma_w():
+    """
+    Sigma_w cached by dcore_post is reused unless the inputs change or force is set.
+    A replaced entry loses the marker attribute set below.
+    """
+    def set_marker():
+        with h5py.File(seedname + '.out.h5', 'a') as f:
+            keys = list(f['dmft_out/Sigma_w'].keys())
+            assert len(keys) == 1
+            f['dmft_out/Sigma_w'][keys[0]].attrs['test_marker'] = 1
+            return keys[0]
+
+    def cached_entries():
+        with h5py.File(seedname + '.out.h5', 'r') as f:
+            return {key: 'test_marker' in g.attrs for key, g in f['dmft_out/Sigma_w'].items()}
+
+    # Hit
+    key = set_marker()
+    dcore_post('dmft.ini', prefix='./cache_test/')
+    assert cached_entries() == {key: True}
+
+    # force
+    dcore_post('dmft.ini', prefix='./cache_test/', force=True)
+    assert cached_entries() == {key: False}
+
+    # Miss: only the new entry is kept
+    set_marker()
+    write_ini('dmft_eta.ini', {('tool', 'eta'): 0.01})
+    dcore_post('dmft_eta.ini', prefix='./cache_test/')
+    entries = cached_entries()
+    assert len(entries) == 1 and not key in entries
+
+test_cached_Sigma_w()
+
 data_files = glob.glob('./ref/*')
 
 for path in data_files:
@@ -0,0 +1,132 @@
+#
+# DCore -- Integrated DMFT software for correlated electrons
+# Copyright (C) 2017 The University of Tokyo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+from __future__ import print_function
+
+import os
+import shutil
+import numpy
+from itertools import product
+from pytriqs.operators import *
+import pytriqs.operators.util as op
+
+from dcore.impurity_solvers.base import make_h_int, load_or_make_h_int, creat_mapping_flatten_index, \
+    rotate_u_matrix, rotate_basis, delta_iw_to_tau
+from dcore.tools import to_spin_full_U_matrix, make_block_gf
+from dcore.pytriqs_gf_compat import GfImFreq
+
+
+def _make_h_int_naive(u_mat, gf_struct):
+    _, from_flatten_index = creat_mapping_flatten_index(gf_struct)
+    ham = Operator()
+    for i1, i2, i3, i4 in product(range(u_mat.shape[0]), repeat=4):
+        ham += 0.5 * u_mat[i1, i2, i3, i4] \
+               * c_dag(*from_flatten_index[i1]) * c_dag(*from_flatten_index[i2]) \
+               * c(*from_flatten_index[i4]) * c(*from_flatten_index[i3])
+    return ham
+
+
+def test_make_h_int():
+    norb = 3
+    u_mat = to_spin_full_U_matrix(op.U_matrix(l=1, U_int=4.0, J_hund=1.0, basis='cubic'))
+    for gf_struct in [{'ud': range(2*norb)}, {'up': range(norb), 'down': range(norb)}]:
+        diff = make_h_int(u_mat, gf_struct) - _make_h_int_naive(u_mat, gf_struct)
+        assert diff.is_zero()
+
+
+def test_h_int_cache():
+    norb = 3
+    u_mat = to_spin_full_U_matrix(op.U_matrix(l=1, U_int=4.0, J_hund=1.0, basis='cubic'))
+    gf_struct = {'up': range(norb), 'down': range(norb)}
+
+    cache_dir = 'h_int_cache'
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+
+    h_int = load_or_make_h_int(u_mat, gf_struct, cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    h_int_cached = load_or_make_h_int(u_mat, gf_struct, cache_dir)
+    assert (h_int - h_int_cached).is_zero()
+
+    # A different U matrix must not hit the cache
+    load_or_make_h_int(2 * u_mat, gf_struct, cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def _random_unitary(n):
+    q, r = numpy.linalg.qr(numpy.random.randn(n, n) + 1J * numpy.random.randn(n, n))
+    return q
+
+
+def test_rotate_u_matrix():
+    # Compare with a single five-operand einsum for 2 orbitals x 2 spins
+    n = 4
+    u_mat = numpy.random.randn(n, n, n, n) + 1J * numpy.random.randn(n, n, n, n)
+    rot = _random_unitary(n)
+
+    u_mat_ref = numpy.einsum("ijkl,im,jn,ko,lp", u_mat, numpy.conj(rot), numpy.conj(rot), rot, rot)
+    assert numpy.allclose(u_mat_ref, rotate_u_matrix(u_mat, rot))
+
+
+def test_rotate_gf():
+    norb = 3
+    beta = 10.0
+    n_iw = 100
+    gf_struct = {'up': range(norb), 'down': range(norb)}
+    rot = {sp: _random_unitary(norb) for sp in gf_struct}
+
+    G = make_block_gf(GfImFreq, gf_struct, beta, n_iw)
+    for sp, g in G:
+        g.data[...] = numpy.random.randn(*g.data.shape) + 1J * numpy.random.randn(*g.data.shape)
+    G_ref = G.copy()
+    for sp, g in G_ref:
+        g.from_L_G_R(rot[sp].transpose().conjugate(), g, rot[sp])
+
+    rotate_basis(rot, False, None, Gfs=[G], direction='forward')
+    for sp, g in G:
+        assert numpy.allclose(g.data, G_ref[sp].data)
+
+
+def test_delta_iw_to_tau():
+    # Hybridization function with a few bath levels, whose Delta(tau) is known analytically
+    beta = 10.0
+    n_iw = 1000
+    n_flavors = 3
+    n_bath = 5
+    eps = numpy.random.randn(n_bath)
+    V = numpy.random.randn(n_bath, n_flavors) + 1J * numpy.random.randn(n_bath, n_flavors)
+
+    iw = 1J * numpy.pi * (2 * numpy.arange(-n_iw, n_iw) + 1) / beta
+    Delta_iw = numpy.zeros((2*n_iw, n_flavors, n_flavors), dtype=complex)
+    for l in range(n_bath):
+        Delta_iw += numpy.outer(V[l], V[l].conj())[None, :, :] / (iw - eps[l])[:, None, None]
+
+    # n_tau smaller than 2*n_iw checks the folding of frequencies
+    for n_tau in [10001, 201]:
+        tau = numpy.linspace(0, beta, n_tau)
+        Delta_tau_ref = numpy.zeros((n_tau, n_flavors, n_flavors), dtype=complex)
+        for l in range(n_bath):
+            Delta_tau_ref -= numpy.outer(V[l], V[l].conj())[None, :, :] \
+                             * (numpy.exp(-eps[l] * tau) / (1 + numpy.exp(-beta * eps[l])))[:, None, None]
+        assert numpy.allclose(delta_iw_to_tau(Delta_iw, beta, n_tau), Delta_tau_ref, atol=1e-3)
+
+
+test_make_h_int()
+test_h_int_cache()
+test_rotate_u_matrix()
+test_rotate_gf()
+test_delta_iw_to_tau()
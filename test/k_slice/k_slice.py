@@ -0,0 +1,82 @@
+#
+# DCore -- Integrated DMFT software for correlated electrons
+# Copyright (C) 2017 The University of Tokyo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+from __future__ import print_function
+
+import numpy
+import pytriqs.utility.mpi as mpi
+
+# This test must be run with more than one MPI process (e.g. mpirun -np 2).
+
+nk, norb = 5, 2
+hdf_file = 'test_k_slice.h5'
+
+
+def make_model():
+    from dcore.converters.hk_converter import write_dft_input_from_hk
+
+    numpy.random.seed(100)
+    Hk = numpy.random.randn(nk, norb, norb) + 1J * numpy.random.randn(nk, norb, norb)
+    Hk = Hk + Hk.conjugate().transpose((0, 2, 1))
+    if mpi.is_master_node():
+        write_dft_input_from_hk(hdf_file, Hk, 1.0)
+    mpi.barrier()
+    return Hk
+
+def test_read_k_slice_mpi(Hk):
+    from dcore.sumkdft_dcore import read_k_slice, local_k_data, KSlicedArray
+
+    assert mpi.size > 1
+
+    hopping = read_k_slice(hdf_file, 'dft_input', 'hopping')
+    assert isinstance(hopping, KSlicedArray)
+    assert hopping.shape == (nk, 1, norb, norb)
+
+    # The hyperslab of each rank is the share given by mpi.slice_array
+    ik_local = mpi.slice_array(numpy.arange(nk))
+    assert numpy.allclose(local_k_data(hopping)[:, 0, :, :], Hk[ik_local])
+    assert mpi.all_reduce(mpi.world, len(ik_local), lambda x, y: x + y) == nk
+
+    Hk_sum = numpy.zeros((norb, norb), dtype=complex)
+    for ik in ik_local:
+        Hk_sum += hopping[ik, 0, :, :]
+    Hk_sum = mpi.all_reduce(mpi.world, Hk_sum, lambda x, y: x + y)
+    assert numpy.allclose(Hk_sum, numpy.sum(Hk, axis=0))
+
+    # k points held by other ranks
+    for ik in range(nk):
+        if ik in ik_local:
+            continue
+        try:
+            hopping[ik, 0, :, :]
+            assert False
+        except RuntimeError:
+            pass
+
+def test_sumkdft_dcore_mpi():
+    from dcore.sumkdft_dcore import SumkDFTDCore
+
+    sk = SumkDFTDCore(hdf_file=hdf_file, use_dft_blocks=False, h_field=0.0)
+    try:
+        sk.eff_atomic_levels()
+        assert False
+    except RuntimeError:
+        pass
+
+Hk = make_model()
+test_read_k_slice_mpi(Hk)
+test_sumkdft_dcore_mpi()
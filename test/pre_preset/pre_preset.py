@@ -37,3 +37,61 @@ for lattice in ['bethe', 'chain', 'square', 'cubic']:
     dcore_pre(input_fname)
 
     h5diff(seedname+".h5", seedname_ref+".h5")
+
+#
+# Rerun dcore_pre and check which groups are regenerated.
+# A regenerated group loses the marker attribute set below.
+#
+import h5py
+
+groups = ['dft_input', 'DCore/Umat', 'DCore/LocalPotential']
+
+def write_input(kanamori, kmesh_symmetry='None'):
+    with open('stan_rerun.in', 'w') as f:
+        print("[model]", file=f)
+        print("t = 1.0", file=f)
+        print("kanamori = [{}]".format(kanamori), file=f)
+        print("lattice = chain", file=f)
+        print("seedname = stan_rerun", file=f)
+        print("kmesh_symmetry = " + kmesh_symmetry, file=f)
+
+def set_markers():
+    with h5py.File('stan_rerun.h5', 'a') as f:
+        for g in groups:
+            f[g].attrs['test_marker'] = 1
+
+def kept_groups():
+    with h5py.File('stan_rerun.h5', 'r') as f:
+        return [g for g in groups if g in f and 'test_marker' in f[g].attrs]
+
+write_input("(4.0,0.0,0.0)")
+dcore_pre('stan_rerun.in')
+
+# (a) Unchanged inputs: nothing is regenerated
+set_markers()
+dcore_pre('stan_rerun.in')
+assert kept_groups() == groups
+
+# (b) Only the interaction is changed: H(k) is kept
+set_markers()
+write_input("(5.0,0.0,0.0)")
+dcore_pre('stan_rerun.in')
+assert 'dft_input' in kept_groups()
+assert not 'DCore/Umat' in kept_groups()
+
+# (c) --force: everything is regenerated
+set_markers()
+dcore_pre('stan_rerun.in', force=True)
+assert kept_groups() == []
+
+# (d) Only the contents of the file of symmetry operations are changed: H(k) is regenerated
+with open('stan_rerun_symm.txt', 'w') as f:
+    print("1 0 0 0 1 0 0 0 1", file=f)
+write_input("(5.0,0.0,0.0)", 'stan_rerun_symm.txt')
+dcore_pre('stan_rerun.in')
+set_markers()
+with open('stan_rerun_symm.txt', 'a') as f:
+    print("-1 0 0 0 1 0 0 0 1", file=f)
+dcore_pre('stan_rerun.in')
+assert not 'dft_input' in kept_groups()
+assert 'DCore/Umat' in kept_groups()
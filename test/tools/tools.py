@@ -19,6 +19,7 @@ from __future__ import print_function
 
 import numpy
 import h5py
+from itertools import product
 
 def test_spin_moments_sh():
     from dcore.tools import spin_moments_sh
@@ -91,5 +92,466 @@ def test_save_load_Sigma_iw():
         numpy.allclose(Sigma_iw_sh0.data, Sigma_iw_sh0_loaded.data)
         numpy.allclose(Sigma_iw_sh0.tail.data, Sigma_iw_sh0_loaded.tail.data)
 
+def test_fourier_interpolate_ham():
+    from dcore.converters.wannier90_converter import fourier_interpolate_ham
+
+    nrpt = 20
+    norb = 3
+    n_k = 50
+    rvec = numpy.random.randint(-2, 3, size=(nrpt, 3))
+    rdeg = numpy.random.randint(1, 4, size=nrpt)
+    hamr = numpy.random.randn(nrpt, norb, norb) + 1J * numpy.random.randn(nrpt, norb, norb)
+    kvec = numpy.random.rand(n_k, 3)
+
+    hamk_ref = numpy.zeros((n_k, norb, norb), dtype=complex)
+    for ik in range(n_k):
+        for ir in range(nrpt):
+            hamk_ref[ik] += numpy.exp(2J * numpy.pi * numpy.dot(kvec[ik], rvec[ir])) * hamr[ir] / rdeg[ir]
+
+    assert numpy.allclose(fourier_interpolate_ham(kvec, rvec, rdeg, hamr), hamk_ref)
+    # Small chunks
+    assert numpy.allclose(fourier_interpolate_ham(kvec, rvec, rdeg, hamr, max_memory=1000), hamk_ref)
+
+def test_fourier_ham_fft():
+    from itertools import product
+    from dcore.converters.wannier90_converter import fourier_interpolate_ham, fourier_ham_fft
+
+    nrpt = 20
+    norb = 2
+    # R vectors larger than the k mesh wrap around
+    rvec = numpy.random.randint(-5, 6, size=(nrpt, 3))
+    rdeg = numpy.random.randint(1, 4, size=nrpt)
+    hamr = numpy.random.randn(nrpt, norb, norb) + 1J * numpy.random.randn(nrpt, norb, norb)
+
+    msize = [4, 3, 5]
+    kvec = numpy.array([[float(ix)/msize[0], float(iy)/msize[1], float(iz)/msize[2]]
+                        for ix, iy, iz in product(range(msize[0]), range(msize[1]), range(msize[2]))])
+    assert numpy.allclose(fourier_ham_fft(msize, rvec, rdeg, hamr), fourier_interpolate_ham(kvec, rvec, rdeg, hamr))
+
+    # Slices along the first axis
+    n_k12 = msize[1] * msize[2]
+    assert numpy.allclose(fourier_ham_fft(msize, rvec, rdeg, hamr, ik0_range=(1, 3)),
+                          fourier_interpolate_ham(kvec[n_k12:3*n_k12], rvec, rdeg, hamr))
+
+def test_read_hr_dat():
+    from dcore.converters.wannier90_converter import read_hr_dat
+
+    nrpt = 17
+    norb = 2
+    rvec = numpy.array([[ir - nrpt//2, 0, 0] for ir in range(nrpt)])
+    rdeg = numpy.random.randint(1, 4, size=nrpt)
+    hamr = numpy.random.randn(nrpt, norb, norb) + 1J * numpy.random.randn(nrpt, norb, norb)
+
+    with open('test_hr.dat', 'w') as f:
+        print('test', file=f)
+        print(norb, file=f)
+        print(nrpt, file=f)
+        for ir in range(nrpt):
+            print(rdeg[ir], file=f, end='\n' if ir % 15 == 14 or ir == nrpt-1 else ' ')
+        for ir in range(nrpt):
+            for j, i in product(range(norb), repeat=2):
+                print(rvec[ir, 0], rvec[ir, 1], rvec[ir, 2], i+1, j+1,
+                      '{:.15e} {:.15e}'.format(hamr[ir, i, j].real, hamr[ir, i, j].imag), file=f)
+
+    rvec_read, rdeg_read, hamr_read = read_hr_dat('test_hr.dat')
+    assert numpy.array_equal(rvec_read, rvec)
+    assert numpy.array_equal(rdeg_read, rdeg)
+    assert numpy.allclose(hamr_read, hamr)
+
+    # Only R=0
+    rvec_read, rdeg_read, hamr_read = read_hr_dat('test_hr.dat', rvec_selected=[(0, 0, 0)])
+    assert numpy.array_equal(rvec_read, rvec[nrpt//2:nrpt//2+1])
+    assert numpy.allclose(hamr_read, hamr[nrpt//2:nrpt//2+1])
+
+    # Truncated list of degeneracies
+    with open('test_hr_truncated.dat', 'w') as f:
+        print('test', file=f)
+        print(norb, file=f)
+        print(5, file=f)
+        print('1 1 1', file=f)
+    try:
+        read_hr_dat('test_hr_truncated.dat')
+        assert False
+    except RuntimeError:
+        pass
+
+    # Corrupt orbital index
+    with open('test_hr.dat', 'r') as f:
+        lines = f.readlines()
+    lines[-1] = lines[-1].replace(' {} {} '.format(norb, norb), ' {} {} '.format(norb, norb+1), 1)
+    with open('test_hr.dat', 'w') as f:
+        f.writelines(lines)
+    read_hr_dat('test_hr.dat')
+    try:
+        read_hr_dat('test_hr.dat', strict=True)
+        assert False
+    except RuntimeError:
+        pass
+
+def test_write_dft_input_from_hk():
+    from dcore.converters.hk_converter import HkConverter, write_dft_input_from_hk
+
+    numpy.random.seed(100)
+    nk, norb = 4, 2
+    Hk = numpy.random.randn(nk, norb, norb) + 1J * numpy.random.randn(nk, norb, norb)
+    Hk = Hk + Hk.conjugate().transpose((0, 2, 1))
+    weight = numpy.random.rand(nk)
+
+    # Reference: General-Hk text file
+    with open('test_hk.inp', 'w') as f:
+        print(nk, file=f)
+        print(1.0, file=f)
+        print("1", file=f)
+        print("0 0 0 {0}".format(norb), file=f)
+        print("1", file=f)
+        print("0 0 0 {0} 0 0".format(norb), file=f)
+        print("1 {0}".format(norb), file=f)
+        for ik in range(nk):
+            print(repr(weight[ik]), file=f)
+        for ik in range(nk):
+            for iorb, jorb in product(range(norb), repeat=2):
+                print(repr(Hk[ik, iorb, jorb].real), file=f)
+            for iorb, jorb in product(range(norb), repeat=2):
+                print(repr(Hk[ik, iorb, jorb].imag), file=f)
+    HkConverter(filename='test_hk.inp', hdf_filename='test_hk_ref.h5').convert_dft_input(weights_in_file=True)
+
+    write_dft_input_from_hk('test_hk.h5', Hk, 1.0, bz_weights=weight)
+
+    with h5py.File('test_hk_ref.h5', 'r') as f_ref, h5py.File('test_hk.h5', 'r') as f:
+        for key in ['n_k', 'SO', 'SP', 'density_required', 'n_orbitals', 'bz_weights', 'hopping']:
+            assert numpy.allclose(f_ref['dft_input'][key][()], f['dft_input'][key][()])
+
+        # proj_mat is stored only for one k point
+        assert f['dft_input']['proj_mat'].shape[0] == 1
+        assert numpy.allclose(f_ref['dft_input']['proj_mat'][()], f['dft_input']['proj_mat'][()])
+        assert f['dft_input']['proj_mat_trivial'][()] == 1
+        assert numpy.all(f['dft_input']['proj_mat_offset'][()] == 0)
+
+def test_read_k_slice():
+    from pytriqs.archive import HDFArchive
+    from dcore.sumkdft_dcore import read_k_slice, local_k_data
+
+    with HDFArchive('test_hk.h5', 'r') as ar:
+        hopping_ref = ar['dft_input']['hopping']
+    hopping = read_k_slice('test_hk.h5', 'dft_input', 'hopping')
+    assert hopping.shape == hopping_ref.shape
+    assert numpy.allclose(local_k_data(hopping), hopping_ref)
+    for ik in range(hopping.shape[0]):
+        assert numpy.allclose(hopping[ik, 0, :, :], hopping_ref[ik, 0, :, :])
+
+def test_irreducible_kmesh():
+    from dcore.lattice_models.tools import cubic_point_group, irreducible_kmesh
+
+    nk = 4
+    kvec = 2 * numpy.pi * numpy.array(list(product(range(nk), repeat=3))) / nk
+
+    # Nearest-neighbor hopping on the cubic lattice: O_h
+    ek = 2 * numpy.sum(numpy.cos(kvec), axis=1)
+    ops, ik_irr, weights = irreducible_kmesh((nk, nk, nk), cubic_point_group(), ek)
+    assert len(ops) == 48
+    assert len(ik_irr) == 10
+    assert numpy.allclose(numpy.sum(weights * ek[ik_irr]**2), numpy.mean(ek**2))
+
+    # Lower symmetry
+    ek += 0.3 * numpy.cos(kvec[:, 0] + kvec[:, 1])
+    ops, ik_irr, weights = irreducible_kmesh((nk, nk, nk), cubic_point_group(), ek)
+    assert len(ops) < 48
+    assert numpy.allclose(numpy.sum(weights * ek[ik_irr]**3), numpy.mean(ek**3))
+
+def test_umat_symmetry_errors():
+    from dcore.lattice_models.tools import umat_symmetry_errors
+
+    # Kanamori interaction
+    norb, U, J = 3, 4.0, 0.5
+    u_mat = numpy.zeros((norb, norb, norb, norb), dtype=complex)
+    for iorb, jorb in product(range(norb), repeat=2):
+        u_mat[iorb, jorb, iorb, jorb] = U - 2 * J
+        u_mat[iorb, jorb, jorb, iorb] = J
+        u_mat[iorb, iorb, jorb, jorb] = J
+    for iorb in range(norb):
+        u_mat[iorb, iorb, iorb, iorb] = U
+    assert numpy.allclose(umat_symmetry_errors(u_mat), 0.0)
+
+    u_mat[0, 1, 0, 1] += 0.1
+    exchange, hermite = umat_symmetry_errors(u_mat)
+    assert numpy.allclose(exchange, 0.1)
+    assert numpy.allclose(hermite, 0.0)
+
+
+def test_copy_back_work_dir():
+    import os
+    import tempfile
+    from dcore.tools import make_work_dir, copy_back_work_dir, wait_work_dir_tasks
+
+    scratch_dir = tempfile.mkdtemp()
+    work_dir = os.path.join(tempfile.mkdtemp(), 'work')
+
+    path = make_work_dir(work_dir, scratch_dir)
+    with open(os.path.join(path, 'output'), 'w') as f:
+        f.write('test')
+    copy_back_work_dir(path, work_dir)
+    wait_work_dir_tasks()
+    assert os.path.isfile(os.path.join(work_dir, 'output'))
+    assert os.listdir(scratch_dir) == []
+
+    # Copying into a path under a regular file fails
+    path = make_work_dir(work_dir, scratch_dir)
+    with open(os.path.join(path, 'output'), 'w') as f:
+        f.write('test')
+    copy_back_work_dir(path, os.path.join(work_dir, 'output', 'work'))
+    try:
+        wait_work_dir_tasks()
+        assert False
+    except RuntimeError:
+        pass
+    # Results are kept in the scratch directory
+    assert os.path.isfile(os.path.join(path, 'output'))
+
+
+def test_prune_work_dirs():
+    import os
+    import tempfile
+    import zipfile
+    from dcore.tools import work_dirs_to_prune, prune_work_dirs, wait_work_dir_tasks
+
+    n_shells, n_ite = 2, 6
+    keep_last, keep_every = 2, 3
+    large_files = ['input.h5', 'delta.txt']
+    cwd_org = os.getcwd()
+
+    def make_dirs():
+        os.chdir(tempfile.mkdtemp())
+        for ish, ite in product(range(n_shells), range(1, n_ite+1)):
+            d = 'work/imp_shell{}_ite{}'.format(ish, ite)
+            os.makedirs(d)
+            for f in large_files + ['output']:
+                with open(os.path.join(d, f), 'w') as fout:
+                    fout.write(f)
+
+    def run(policy, archive_file=None):
+        # Prune after each iteration as DMFTCoreSolver does
+        last_pruned = 0
+        for ite in range(1, n_ite+1):
+            dirs = work_dirs_to_prune(ite, n_shells, keep_last, keep_every, last_pruned + 1)
+            # Directories pruned before are not listed again
+            for d in dirs:
+                assert int(d.split('_ite')[1]) > last_pruned
+            last_pruned = max(last_pruned, ite - keep_last)
+            if dirs:
+                prune_work_dirs(dirs, policy, large_files, archive_file)
+        wait_work_dir_tasks()
+
+    def files(ite):
+        return sorted(os.listdir('work/imp_shell0_ite{}'.format(ite)))
+
+    pruned, kept = [1, 2, 4], [3, 5, 6]
+
+    try:
+        make_dirs()
+        run('delete')
+        for ite in pruned:
+            assert not os.path.exists('work/imp_shell0_ite{}'.format(ite))
+        for ite in kept:
+            assert files(ite) == sorted(large_files + ['output'])
+
+        make_dirs()
+        run('delete_inputs')
+        for ite in pruned:
+            assert files(ite) == ['output']
+        for ite in kept:
+            assert files(ite) == sorted(large_files + ['output'])
+
+        make_dirs()
+        run('archive', 'work/imp_shell_archive.zip')
+        with zipfile.ZipFile('work/imp_shell_archive.zip', 'r') as z:
+            names = z.namelist()
+        for ish, ite in product(range(n_shells), pruned):
+            assert not os.path.exists('work/imp_shell{}_ite{}'.format(ish, ite))
+            for f in large_files + ['output']:
+                assert 'imp_shell{}_ite{}/{}'.format(ish, ite, f) in names
+        for ite in kept:
+            assert files(ite) == sorted(large_files + ['output'])
+
+        # A failure in background is re-raised by the next call or at the end
+        for wait in [lambda: prune_work_dirs(['work/imp_shell0_ite3'], 'delete'), wait_work_dir_tasks]:
+            make_dirs()
+            prune_work_dirs(['work/imp_shell0_ite1'], 'archive', archive_file='no_such_dir/archive.zip')
+            try:
+                wait()
+                assert False
+            except RuntimeError:
+                pass
+        wait_work_dir_tasks()
+    finally:
+        os.chdir(cwd_org)
+
+
+def test_calc_H_loc_sh():
+    from dcore.sumkdft import _calc_H_loc_sh
+
+    # One k point, one correlated shell with a non-trivial local coordinate system
+    dim = 2
+    spn = ['up', 'down']
+    hk = numpy.array([[1.0, 0.3-0.2j], [0.3+0.2j, -0.5]])
+    theta = 0.3
+    u = numpy.array([[numpy.cos(theta), -numpy.sin(theta)], [numpy.sin(theta), numpy.cos(theta)]], dtype=complex)
+
+    class SumkMock(object):
+        SO = 0
+        spin_block_names = [spn]
+        spin_names_to_ind = [{'up': 0, 'down': 1}]
+        n_k = 1
+        n_corr_shells = 1
+        n_inequiv_shells = 1
+        inequiv_to_corr = [0]
+        corr_shells = [{'dim': dim}]
+        n_orbitals = numpy.full((1, 2), dim, dtype=int)
+        hopping = numpy.array([[hk, hk]])
+        proj_mat = numpy.array([[[numpy.identity(dim)], [numpy.identity(dim)]]], dtype=complex)
+        bz_weights = numpy.ones(1)
+        symm_op = 0
+        use_rotations = True
+        rot_mat = [u]
+        rot_mat_time_inv = [0]
+
+    dc_imp = [{sp: numpy.diag([0.4, 0.1]) for sp in spn}]
+    potential = [{sp: numpy.diag([0.0, 0.2]) for sp in spn}]
+    mu = 0.7
+    H_loc_sh = _calc_H_loc_sh(SumkMock(), {'with_dc': True, 'dc_imp': dc_imp, 'mu': mu, 'potential': potential})
+
+    # dc_imp and potential are given in the local coordinate system
+    H_ref = numpy.dot(numpy.dot(u.conjugate().transpose(), hk), u) - dc_imp[0]['up']\
+            - mu * numpy.identity(dim) + potential[0]['up']
+    for sp in spn:
+        assert numpy.allclose(H_loc_sh[0][sp], H_ref)
+
+
+def test_spin_block_lattice_gf():
+    from pytriqs.archive import HDFArchive
+    from dcore.pytriqs_gf_compat import GfImFreq, BlockGf
+    from dcore.converters.hk_converter import write_dft_input_from_hk
+    from dcore.manip_database import turn_on_spin_orbit
+    from dcore.sumkdft_dcore import SumkDFTDCore
+    from dcore.dft_tools_compat import SumkDFT
+
+    numpy.random.seed(200)
+    nk, norb, beta, n_iw = 3, 2, 10.0, 10
+    Hk = numpy.random.randn(nk, norb, norb) + 1J * numpy.random.randn(nk, norb, norb)
+    Hk = Hk + Hk.conjugate().transpose((0, 2, 1))
+    write_dft_input_from_hk('test_spin_block_nso.h5', Hk, 1.0)
+
+    # H(k) = diag(H_up(k), H_down(k))
+    turn_on_spin_orbit('test_spin_block_nso.h5', 'test_spin_block.h5')
+
+    # Spin-flip terms in H(k)
+    with HDFArchive('test_spin_block.h5', 'r') as f:
+        hopping = f['dft_input']['hopping']
+    hopping[:, 0, 0, norb] = hopping[:, 0, norb, 0] = 0.1
+    turn_on_spin_orbit('test_spin_block_nso.h5', 'test_spin_block_offdiag.h5')
+    with HDFArchive('test_spin_block_offdiag.h5', 'a') as f:
+        f['dft_input']['hopping'] = hopping
+
+    def make_sigma(spin_flip):
+        sigma = numpy.diag(numpy.random.randn(2*norb)) + 0.1J * numpy.identity(2*norb)
+        if spin_flip:
+            sigma[0, norb] = sigma[norb, 0] = 0.2
+        g = GfImFreq(indices=list(range(2*norb)), beta=beta, n_points=n_iw)
+        g.data[...] = sigma[None, :, :]
+        return [BlockGf(name_list=['ud'], block_list=[g], make_copies=True)]
+
+    for hdf_file, spin_diag in [('test_spin_block.h5', True), ('test_spin_block_offdiag.h5', False)]:
+        sk = SumkDFTDCore(hdf_file=hdf_file, use_dft_blocks=False, h_field=0.0)
+        assert sk.hopping_spin_diag == spin_diag
+        for spin_flip in [False, True]:
+            sk.Sigma_imp_iw = make_sigma(spin_flip)
+            for ik in range(nk):
+                # The result of the full inversion
+                G_ref = SumkDFT.lattice_gf(sk, ik, mu=0.3, iw_or_w='iw', beta=beta)['ud'].data.copy()
+                G = sk.lattice_gf(ik, mu=0.3, iw_or_w='iw', beta=beta)['ud'].data
+                assert numpy.allclose(G, G_ref)
+
+
+def test_write_akw():
+    from dcore.dcore_post import write_akw_txt, write_akw_h5
+
+    numpy.random.seed(300)
+    n_k, n_omega = 4, 5
+    spin_block_names = ['up', 'down']
+    xk = numpy.linspace(0, 1, n_k)
+    mesh = numpy.linspace(-1, 1, n_omega)
+    akw = {isp: numpy.random.rand(n_k, n_omega) for isp in spin_block_names}
+
+    # Reference: previous implementation writing line by line
+    with open('test_akw_ref.dat', 'w') as f:
+        offset = 0.0
+        for isp in spin_block_names:
+            for ik in range(n_k):
+                for iom in range(n_omega):
+                    print("%f %f %f" % (xk[ik]+offset, mesh[iom], akw[isp][ik, iom]), file=f)
+                print("", file=f)
+            offset = xk[n_k-1] * 1.1
+            print("", file=f)
+
+    write_akw_txt('test_akw.dat', xk, mesh, akw, spin_block_names)
+    with open('test_akw_ref.dat', 'r') as f_ref, open('test_akw.dat', 'r') as f:
+        assert f.read() == f_ref.read()
+
+    write_akw_h5('test_akw.h5', xk, mesh, akw, spin_block_names)
+    with h5py.File('test_akw.h5', 'r') as f:
+        assert set(f.keys()) == {'xk', 'omega', 'akw'}
+        assert set(f['akw'].keys()) == set(spin_block_names)
+        assert numpy.allclose(f['xk'][()], xk)
+        assert numpy.allclose(f['omega'][()], mesh)
+        for isp in spin_block_names:
+            assert f['akw'][isp].shape == (n_k, n_omega)
+            assert numpy.allclose(f['akw'][isp][()], akw[isp])
+
+
+def test_pade():
+    from dcore.tools import pade_coefficients, pade_coefficients_parallel, pade_evaluate
+
+    # Rational function with poles off the real axis; the Pade approximant is exact
+    def f(z):
+        return 1/(z - 0.5 + 0.2j) + 0.5/(z + 1.0 + 0.3j)
+
+    beta = 10.0
+    z = 1J * (2*numpy.arange(20) + 1) * numpy.pi / beta
+    u = numpy.array([f(z), 2*f(z)]).transpose()
+    a = pade_coefficients_parallel(z, u, 2)
+    assert numpy.allclose(a, pade_coefficients(z, u))
+
+    w = numpy.linspace(-2, 2, 11) + 0.1J
+    assert numpy.allclose(pade_evaluate(z, a, w)[:, 0], f(w))
+    assert numpy.allclose(pade_evaluate(z, a, w)[:, 1], 2*f(w))
+
+    # Compare with Pade of TRIQS (computed in multiprecision) for all matrix elements, as done with fast_pade
+    from dcore.pytriqs_gf_compat import GfImFreq, GfReFreq
+    n_pade, eta = 20, 0.1
+    g_iw = GfImFreq(indices=[0, 1], beta=beta, n_points=100)
+    iw = numpy.array([complex(x) for x in g_iw.mesh])
+    g_iw.data[:, 0, 0] = f(iw)
+    g_iw.data[:, 1, 1] = 1/(iw + 0.3 + 0.1j)
+    g_iw.data[:, 0, 1] = g_iw.data[:, 1, 0] = 0.2 * f(iw)
+    g_w = GfReFreq(indices=[0, 1], window=(-2.0, 2.0), n_points=101)
+    g_w.set_from_pade(g_iw, n_points=n_pade, freq_offset=eta)
+    z = iw[iw.imag > 0][0:n_pade]
+    a = pade_coefficients(z, g_iw.data[iw.imag > 0][0:n_pade, :, :])
+    omega = numpy.array([x.real for x in g_w.mesh])
+    assert numpy.allclose(pade_evaluate(z, a, omega + 1J * eta), g_w.data)
+
+
 test_spin_moments_sh()
 test_save_load_Sigma_iw()
+test_fourier_interpolate_ham()
+test_fourier_ham_fft()
+test_read_hr_dat()
+test_write_dft_input_from_hk()
+test_read_k_slice()
+test_irreducible_kmesh()
+test_umat_symmetry_errors()
+test_copy_back_work_dir()
+test_prune_work_dirs()
+test_calc_H_loc_sh()
+test_spin_block_lattice_gf()
+test_write_akw()
+test_pade()
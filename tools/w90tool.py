@@ -4,6 +4,7 @@ from itertools import product
 import sympy
 import pytransform3d
 import re
+from dcore.converters.wannier90_converter import fourier_interpolate_ham, read_hr_dat
 
 class Wannier90( object ):
     def __init__(self, file_name, spin_orbital_order='up_up_down_down', verbose=0):
@@ -13,37 +14,13 @@ class Wannier90( object ):
         and the spin-full Hamiltonian will be constructed.
         Internally, the ordering of spins and orbitals in HamR is (orb1, up), (orb2, up) ... (orb1, down) ...
         """
-        f = open(file_name)
-        f.readline()
-        self.Nwann = int(f.readline())
-        self.nrpts = int(f.readline())
+        self.irvec, self.ndgen, self.HamR = read_hr_dat(file_name, strict=True)
+        self.nrpts, self.Nwann = self.HamR.shape[0], self.HamR.shape[1]
 
         if verbose > 0:
             print("Num of Wannier functions = ", self.Nwann)
             print("Num of R points = ", self.nrpts)
 
-        num_lines = self.nrpts // 15
-        if self.nrpts%15 != 0:
-            num_lines += 1
-        ndgen = []
-        for iline in range(num_lines):
-            ndgen.extend(f.readline().split())
-        self.ndgen = numpy.array(ndgen, dtype=int)
-
-        self.HamR = numpy.zeros((self.nrpts, self.Nwann, self.Nwann), dtype=complex)
-        self.irvec = numpy.zeros((self.nrpts, 3), dtype=int)
-        for ir in range(self.nrpts):
-            for j in range(self.Nwann):
-                for i in range(self.Nwann):
-                    i1, i2, i3, i_in, j_in, hr_real,hr_imag = f.readline().split()
-                    if i==0 and j==0:
-                        self.irvec[ir,0] = i1
-                        self.irvec[ir,1] = i2
-                        self.irvec[ir,2] = i3
-                    assert i == int(i_in)-1
-                    assert j == int(j_in)-1
-                    self.HamR[ir, i, j] = complex(float(hr_real), float(hr_imag))
-
         if spin_orbital_order == 'up_down_up_down':
             # (R, orb, spin, orb, spin) => (R, spin, orb, spin, orb)
             self.HamR_full = self.HamR.reshape((self.nrpts, self.Nwann//2, 2, self.Nwann//2, 2)).transpose((0, 2, 1, 4, 3))
@@ -64,14 +41,13 @@ class Wannier90( object ):
     def get_Hk(self, kvec):
         """
         Compute H(k)
-        :param kvec: (float, float, float). Fraction coordinates in k space.
-        :return: matrix of H(k)
+        :param kvec: (float, float, float) or 2D array of shape (n_k, 3). Fraction coordinates in k space.
+        :return: matrix of H(k) or 3D array of shape (n_k, 2*norb, 2*norb)
         """
 
-        Hk = numpy.zeros((2*self.norb, 2*self.norb),dtype=complex)
-        for iR in range(self.nrpts):
-            factor = numpy.exp(2J*numpy.pi*(self.irvec[iR,0]*kvec[0]+self.irvec[iR,1]*kvec[1]+self.irvec[iR,2]*kvec[2]))
-            Hk += self.HamR_full[iR,:,:] * factor / self.ndgen[iR]
+        Hk = fourier_interpolate_ham(kvec, self.irvec, self.ndgen, self.HamR_full)
+        if numpy.asarray(kvec).ndim == 1:
+            return Hk[0]
         return Hk
 
     def save(self, filename):